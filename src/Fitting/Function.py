@@ -1,36 +1,50 @@
 import numpy as np
-from scipy.integrate import quadrature, romberg
 from numpy import sin, cos, exp, log
+from compiledModel import legendreIntegral
 
 class PDF:
     """
     A PDF is a normalized Function, i.e. the integral of a PDF is 1
     This version is one-D only
+    fcn takes an array of points; it is normalized over [lower, upper],
+    which defaults to the range of the data
     """
-    def __init__(self, fcn, data):
-        a = min(data)
-        b = max(data)
-        print quadrature(fcn, 0, 1, maxiter=100)
-        # not as good
-        # print romberg(fcn, 0.00000001, 1)
-        
+    def __init__(self, fcn, data, lower=None, upper=None):
+        data = np.asarray(data, dtype=np.float64)
+        if lower is None:
+            lower = data.min()
+        if upper is None:
+            upper = data.max()
+        self.fcn = fcn
+        self.lower = lower
+        self.upper = upper
+        self.norm = legendreIntegral(fcn, lower, upper)
+        if not self.norm > 0:
+            raise ValueError('the integral of the function from %g to %g is not positive' % (lower, upper))
+
+    def __call__(self, x):
+        return self.fcn(np.asarray(x, dtype=np.float64)) / self.norm
+
+    def nll(self, data):
+        """ the negative log likelihood of the data, evaluated on all of them at once """
+        return -np.sum(np.log(self(data)))
+
 
 def test1(x):
     return x**2 + sin(x)
-    
+
 def test2(x):
     return sin(x) - cos(x)
 
 def test3(x):
     return x*sin(x)*cos(x)
-    
+
 def test4(x):
     return exp(x) * log(x)
-    
+
 if __name__ == '__main__':
-    data = np.random.randn(1000)
-    PDF(test1, data)
-    PDF(test2, data)
-    PDF(test3, data)
-    PDF(test4, data)
-    
+    # all four are positive between 1 and 1.5
+    data = 1.0 + 0.5 * np.random.rand(1000)
+    for fcn in [test1, test2, test3, test4]:
+        pdf = PDF(fcn, data)
+        print fcn.__name__, pdf.norm, pdf.nll(data)
@@ -21,6 +21,15 @@ from paida.math.pylapack.dgesv import dgesv
 
 from math import fabs, sqrt, sin, exp, log, fmod, pi
 import types
+import multiprocessing
+import numpy as np
+from compiledModel import numpyFunctions, compileCodelet, compileConstraints, compileIntegral, legendreIntegral
+
+### The Minuit2 engine needs the compiled pyMinuit2 extension.
+try:
+	from pyMinuit2 import Minuit
+except ImportError:
+	Minuit = None
 
 def copyEvaluatorParameterSpace(evaluatorParameterSpace):
 	newEvaluatorParameterSpace = evaluatorParameterSpace.copy()
@@ -34,9 +43,64 @@ def updateEvaluatorParameterSpace(evaluatorParameterSpaceFrom, evaluatorParamete
 class _EOFException(Exception):
 	pass
 
+### Work for a pool of processes: a function and the fixed part of its arguments.
+### The evaluators are bound to a fitter and its function, which cannot be pickled,
+### so the workers are forked with the work in place and only the tasks are sent to them.
+_poolWork = None
+_inPoolWorker = False
+
+def _forkedPool(function, context, processes):
+	### A pool whose workers run function(context, task) for the tasks given to _poolWorker.
+	global _poolWork
+	_poolWork = (function, context)
+	try:
+		return multiprocessing.Pool(processes, _initPoolWorker)
+	finally:
+		_poolWork = None
+
+def _initPoolWorker():
+	### A worker cannot have a pool of its own.
+	global _inPoolWorker
+	_inPoolWorker = True
+
+def _poolWorker(task):
+	function, context = _poolWork
+	return function(context, task)
+
+def _imapForked(function, context, tasks, processes, chunksize = 1):
+	### function(context, task) for all tasks in a forked pool, as they finish.
+	pool = _forkedPool(function, context, processes)
+	try:
+		for result in pool.imap_unordered(_poolWorker, tasks, chunksize):
+			yield result
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+def _mapForked(function, context, tasks, processes, chunksize = 1):
+	### function(context, task) for all tasks in a forked pool, in the order of the tasks.
+	pool = _forkedPool(function, context, processes)
+	try:
+		results = pool.map(_poolWorker, tasks, chunksize)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+	return results
+
+### The in-range data of an IFitData, a list of [center, weight, errorP, errorM] as the fit method needs them,
+### with the same data as arrays, see IFitter._getInRangeArrays.
+class _InRangeData(list):
+	arrays = None
+
 class IFitter:
 	_eps2 = 1.4901161193847656e-08
-	_engineNames = ['SimplePAIDA', 'PAIDA', 'SimpleGA', 'GA']
+	_engineNames = ['SimplePAIDA', 'PAIDA', 'SimpleGA', 'GA', 'Minuit2']
 
 	def __init__(self, method, engine, option = {}):
 		self.resetConstraints()
@@ -44,6 +108,17 @@ class IFitter:
 		self.setEngine(engine)
 		self.setFitMethod(method)
 		self._option = option
+		self._vectorized = True
+		self._function = None
+		self._inRangeData = []
+		self._inRangeArrays = None
+		self._compiledModel = None
+		self._vectorizedModel = False
+		self._vectorizedDerivatives = False
+		self._derivativeCache = None
+		self._normalizePDF = False
+		self._fitRange = None
+		self._integralCache = {}
 
 	def setUseFunctionGradient(self, boolean):
 		raise NotImplementedError
@@ -55,12 +130,30 @@ class IFitter:
 		engineNames = self._engineNames
 		if not engineName in engineNames:
 			raise TypeError('%s is not in %s.' % (engineName, engineNames))
+		elif (engineName == 'Minuit2') and (Minuit == None):
+			raise TypeError('The Minuit2 engine needs the pyMinuit2 extension, which is not built.')
 		else:
 			self._engineName = engineName
 
 	def engineName(self):
 		return self._engineName
 
+	def setVectorized(self, boolean):
+		### Evaluate the model on all points at once where possible.
+		self._vectorized = bool(boolean)
+
+	def isVectorized(self):
+		return self._vectorized
+
+	def setNormalizePDF(self, boolean):
+		### Normalize the function to unit integral over the fit range in unbinned maximum likelihood fits,
+		### so that it is a PDF. One dimension only.
+		### The overall scale of the function drops out of the fit, so a scale parameter has to be fixed.
+		self._normalizePDF = bool(boolean)
+
+	def isNormalizePDF(self):
+		return self._normalizePDF
+
 	def setFitMethod(self, name):
 		methods = ['LeastSquares', 'Chi2', 'CleverChi2', 'BinnedMaximumLikelihood', 'UnbinnedMaximumLikelihood']
 		if not name in methods:
@@ -272,55 +365,83 @@ class IFitter:
 			raise TypeError('Invalid arguments.')
 
 		inRangeData = self._getInRangeData(fitData)
-		self._inRangeData = inRangeData
-		self._function = _function
 
 		### Save original parameters.
 		originalParameters = _function.parameters()
 
 		### Auto parameter adjustment.
 		if (guessed == False) and (fitData._binned == True):
-			codelet = _function.codeletString()
-			if codelet.startswith('codelet:G:'):
-				### Gaussian
-				sum = 0.0
-				weight = 0.0
-				square = 0.0
-				for binData in inRangeData:
-					x = binData[0][0]
-					y = binData[1]
-					sum += x * y
-					weight += y
-					square += x**2 * y
-				mean = sum / weight
-				sigma = sqrt(square / weight - mean * mean)
-				amplitude = weight / (sqrt(2.0 * pi) * sigma)
-				_function.setParameters([amplitude, mean, sigma])
-			elif codelet.startswith('codelet:E:'):
-				### Exponential
-				x1 = None
-				x2 = None
-				for binData in inRangeData:
-					if binData[1] != 0.0:
-						x1 = binData[0][0]
-						y1 = binData[1]
-						break
-				for i in range(len(inRangeData)):
-					binData = inRangeData[-(i + 1)]
-					if binData[1] != 0.0:
-						x2 = binData[0][0]
-						y2 = binData[1]
-						break
-				if (x1 != None) and (x2 != None):
-					slope = log(y1 - y2) / (x1 - x2)
-					amplitude = y1 / exp(slope * x1)
-					_function.setParameters([amplitude, slope])
-			else:
-				### No change
-				pass
+			self._guessParameters(_function, inRangeData)
+
+		fitResult = self._fitInRangeData(_function, inRangeData, self._getFitSetup(_function), self._getFitRange(fitData, inRangeData))
+		if fitResult._isValid:
+			fitResult._fittedFunction = self._getFittedFunction(_function, fitResult._fittedParameters)
+
+		### Return to original states.
+		_function.setParameters(originalParameters)
+
+		return fitResult
+
+	def _guessParameters(self, function, inRangeData):
+		### Start values of a Gaussian or an exponential from binned data.
+		### Returns whether the parameters have been changed.
+		codelet = function.codeletString()
+		if codelet.startswith('codelet:G:'):
+			### Gaussian
+			sum = 0.0
+			weight = 0.0
+			square = 0.0
+			for binData in inRangeData:
+				x = binData[0][0]
+				y = binData[1]
+				sum += x * y
+				weight += y
+				square += x**2 * y
+			mean = sum / weight
+			sigma = sqrt(square / weight - mean * mean)
+			amplitude = weight / (sqrt(2.0 * pi) * sigma)
+			function.setParameters([amplitude, mean, sigma])
+			return True
+		elif codelet.startswith('codelet:E:'):
+			### Exponential
+			x1 = None
+			x2 = None
+			for binData in inRangeData:
+				if binData[1] != 0.0:
+					x1 = binData[0][0]
+					y1 = binData[1]
+					break
+			for i in range(len(inRangeData)):
+				binData = inRangeData[-(i + 1)]
+				if binData[1] != 0.0:
+					x2 = binData[0][0]
+					y2 = binData[1]
+					break
+			if (x1 != None) and (x2 != None):
+				slope = log(y1 - y2) / (x1 - x2)
+				amplitude = y1 / exp(slope * x1)
+				function.setParameters([amplitude, slope])
+				return True
+		### No change
+		return False
+
+	def _getFitSetup(self, function):
+		### The part of a fit that depends on the function and the settings but not on the data.
+		return {'initialization': self._fitInitialization(function, self._fitParameterSettings), 'modelState': None}
+
+	def _getFittedFunction(self, function, parameters):
+		fittedFunction = function._getParentFactory().cloneFunction(function, inner = True)
+		fittedFunction.annotation().setValue('Title', 'fitted_%s' % function.annotation().value('Title'))
+		fittedFunction.setParameters(parameters)
+		return fittedFunction
+
+	def _fitInRangeData(self, _function, inRangeData, setup, fitRange = None):
+		### Fits the function to the in-range data and returns the IFitResult without the fitted function.
+		### fitRange is the result of _getFitRange for the data.
+		### The parameters of the function are left at the result.
 
 		### Initialization.
-		freeParameterNames, limits, constraints, freeIndices, fixedIndices = self._fitInitialization(_function, self._fitParameterSettings)
+		freeParameterNames, limits, constraints, freeIndices, fixedIndices = setup['initialization']
 		engineName = self.engineName()
 		fitMethodName = self.fitMethodName()
 		parameterNames = _function.parameterNames()
@@ -345,6 +466,7 @@ class IFitter:
 		fitResult._fitMethodName = fitMethodName
 
 		evaluatorParameterSpace = _function._innerParameterNameSpace
+		self._setEvaluationState(_function, inRangeData, setup['modelState'], fitRange)
 		evaluatorValue, evaluatorGradient, evaluatorHessian = self._getEvaluator(engineName, fitMethodName)
 		ndf = len(inRangeData) - len(freeIndices)
 		if engineName in self._engineNames:
@@ -375,6 +497,8 @@ class IFitter:
 				minimum, hessian, warnflag, mesg = fmin_ncg(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, freeParameterNames, limits, constraints, freeIndices, fixedIndices, display = verbose)
 			elif engineName in ['SimpleGA', 'GA']:
 				minimum, hessian, warnflag, mesg = geneticAlgorithm(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, freeParameterNames, limits, constraints, freeIndices, fixedIndices, ndf, display = verbose)
+			elif engineName == 'Minuit2':
+				minuit, minimum, warnflag, mesg = self._minuit2Minimize(evaluatorValue, evaluatorParameterSpace, freeParameterNames, limits, constraints, freeIndices, up, verbose)
 			else:
 				raise RuntimeError, 'Unknown engine name:', engineName
 			resultValues = _function.parameters()
@@ -386,11 +510,13 @@ class IFitter:
 				fitResult._fittedParameters = resultValues
 				fitResult._dataDescription = mesg
 				fitResult._fitStatus = 0
-				fitResult._fittedFunction = _function._getParentFactory().cloneFunction(_function, inner = True)
-				fitResult._fittedFunction.annotation().setValue('Title', 'fitted_%s' % _function.annotation().value('Title'))
-				fitResult._fittedFunction.setParameters(resultValues)
 				fitResult._ndf = ndf
-				fitResult._quality = minimum / fitResult._ndf
+				### The value of the objective itself, which the quality does not keep if ndf is 0.
+				fitResult._minimum = minimum
+				if ndf != 0:
+					fitResult._quality = minimum / fitResult._ndf
+				else:
+					fitResult._quality = np.nan
 
 				if fitMethodName == 'LeastSquares':
 					### PAIDA is not able to calculate errors in this case.
@@ -400,7 +526,10 @@ class IFitter:
 					fitResult._errorsMinus = None
 				else:
 					### Get parabolic errors.
-					errorMatrix = self._getErrorMatrix(hessian)
+					if engineName == 'Minuit2':
+						errorMatrix = self._getMinuit2ErrorMatrix(minuit)
+					else:
+						errorMatrix = self._getErrorMatrix(hessian)
 					if errorMatrix == None:
 						### Invalid result.
 						fitResult._dataDescription = 'The solution is found, but parabolic error is invalid.'
@@ -427,7 +556,10 @@ class IFitter:
 							fitResult._errorsMinus = [None] * len(parabolicErrors)
 						else:
 							### Get asymmetric errors.
-							asymmetricErrors = self._getAsymmetricError(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum, up, parabolicErrors)
+							if engineName == 'Minuit2':
+								asymmetricErrors = self._getMinosErrors(minuit, evaluatorParameterSpace, parameterNames, freeParameterNames, constraints, freeIndices)
+							else:
+								asymmetricErrors = self._getAsymmetricError(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum, up, parabolicErrors, errorMatrix)
 							if asymmetricErrors == None:
 								### Invalid result.
 								fitResult._dataDescription = 'The solution and parabolic error are found, but asymmetric error is invalid.'
@@ -457,76 +589,382 @@ class IFitter:
 			_function._getDeriv2 = originalDeriv2
 			_function._getDeriv2Base = originalDeriv2Base
 
-		### Return to original states.
-		_function.setParameters(originalParameters)
-
 		return fitResult
 
+	def fitMany(self, datasets, function, processes = None):
+		### Fits the function to each of the datasets, which can be anything fit() accepts as data.
+		### Every fit starts from the current parameters of function, which is not changed.
+		### The settings, the model checks and the evaluators are set up once for all fits,
+		### and the fits are spread over a pool of processes, or run here if processes is 1.
+		### Returns a list of IFitResult in the order of the datasets.
+		### A fit that raised an exception has fitStatus() -2 and the exception in dataDescription().
+		if isinstance(function, types.StringTypes):
+			_functionFactory = IFunctionFactory(None)
+			function = _functionFactory.createFunctionByName(function, function, inner = True)
+		fitDataList = []
+		for data in datasets:
+			fitData = self._toFitData(data)
+			self._checkFitType(fitData)
+			fitDataList.append(fitData)
+
+		### All fits work on a clone, which every worker process has a copy of.
+		clone = function._getParentFactory().cloneFunction(function, inner = True)
+		setup = self._getFitSetup(clone)
+		if fitDataList != []:
+			state = self._setEvaluationState(clone, self._getInRangeData(fitDataList[0]))
+			setup['modelState'] = self._getModelState()
+			self._restoreEvaluationState(state)
+			clone.setParameters(function.parameters())
+		context = (clone, function.parameters(), fitDataList, setup)
+		if (processes == 1) or _inPoolWorker:
+			states = [self._fitManyOne(context, index) for index in range(len(fitDataList))]
+		else:
+			chunksize = max(1, len(fitDataList) // (4 * (processes or multiprocessing.cpu_count())))
+			states = _mapForked(self._fitManyOne, context, range(len(fitDataList)), processes, chunksize)
+
+		fitResults = []
+		for state in states:
+			fitResult = IFitResult()
+			fitResult.__dict__.update(state)
+			fitResult._fitParameterSettings = self._fitParameterSettings.copy()
+			if fitResult._isValid:
+				fitResult._fittedFunction = self._getFittedFunction(function, fitResult._fittedParameters)
+			fitResults.append(fitResult)
+		return fitResults
+
+	def _toFitData(self, data):
+		if isinstance(data, IFitData):
+			return data
+		fitData = IFitData()
+		if isinstance(data, IHistogram1D) or isinstance(data, IProfile1D) or isinstance(data, ICloud1D):
+			fitData.create1DConnection(data)
+		elif isinstance(data, IHistogram2D) or isinstance(data, IProfile2D) or isinstance(data, ICloud2D):
+			fitData.create2DConnection(data)
+		elif isinstance(data, IHistogram3D) or isinstance(data, ICloud3D):
+			fitData.create3DConnection(data)
+		elif isinstance(data, IDataPointSet):
+			indices = range(data.dimension())
+			fitData.createConnection(data, indices[:-1], indices[-1])
+		else:
+			raise TypeError('Invalid arguments.')
+		return fitData
+
+	def _fitManyOne(self, context, index):
+		### One fit of fitMany, as the attributes of its IFitResult, which can be pickled.
+		function, startParameters, fitDataList, setup = context
+		fitData = fitDataList[index]
+		function.setParameters(startParameters)
+		try:
+			inRangeData = self._getInRangeData(fitData)
+			if (fitData._binned == True) and self._guessParameters(function, inRangeData):
+				### The guessed start values have to be checked against the bounds again.
+				setup = dict(setup)
+				setup['initialization'] = self._fitInitialization(function, self._fitParameterSettings)
+			fitResult = self._fitInRangeData(function, inRangeData, setup, self._getFitRange(fitData, inRangeData))
+		except Exception, e:
+			fitResult = IFitResult()
+			fitResult._fittedParameterNames = function.parameterNames()[:]
+			fitResult._constraints = self.constraints()
+			fitResult._engineName = self.engineName()
+			fitResult._fitMethodName = self.fitMethodName()
+			fitResult._isValid = False
+			fitResult._dataDescription = '%s: %s' % (e.__class__.__name__, e)
+			fitResult._fitStatus = -2
+		state = fitResult.__dict__.copy()
+		for name in ['_fittedFunction', '_fitParameterSettings']:
+			if state.has_key(name):
+				del state[name]
+		return state
+
 	def _getInRangeData(self, fitData):
-		### Fitting range initialization with associated error check.
-		inRangeData = []
+		### The in-range points of fitData with their weights and errors as the fit method needs them.
+		### The result is kept on fitData and reused as long as its connection, its ranges and the fit method are the same,
+		### so that refitting the same data does not go through the points again.
+		connection = fitData._connection
+		key = (tuple([id(column) for column in connection]), tuple([len(column) for column in connection]), self._getRangeKey(fitData), self.fitMethodName())
+		cached = getattr(fitData, '_inRangeCache', None)
+		if (cached != None) and (cached[0] is connection) and (cached[1] == key):
+			return cached[2]
+		inRangeData = self._precomputeInRangeData(fitData)
+		fitData._inRangeCache = (connection, key, inRangeData)
+		return inRangeData
+
+	def _getRangeKey(self, fitData):
+		key = []
+		for axisNumber in range(fitData.dimension()):
+			rangeSet = fitData.range(axisNumber)
+			key.append((tuple(rangeSet.lowerBounds()), tuple(rangeSet.upperBounds())))
+		return tuple(key)
+
+	def _getRangeMask(self, fitData, centers):
+		### Whether each of the centers, one row per point, is in the range of every axis.
+		mask = np.ones(len(centers), dtype = bool)
+		for axisNumber in range(fitData.dimension()):
+			rangeSet = fitData.range(axisNumber)
+			coordinates = centers[:, axisNumber]
+			inRange = np.zeros(len(centers), dtype = bool)
+			for lower, upper in zip(rangeSet.lowerBounds(), rangeSet.upperBounds()):
+				inRange |= (lower <= coordinates) & (coordinates <= upper)
+			mask &= inRange
+		return mask
+
+	def _precomputeInRangeData(self, fitData):
+		### Fitting range selection with associated error check, on arrays of the whole connection.
 		dimension = fitData.dimension()
-		centers = fitData._connection[0]
-		weights = fitData._connection[1]
-		errorsP = fitData._connection[2]
-		errorsM = fitData._connection[3]
+		centers = np.array(fitData._connection[0], dtype = np.float64).reshape((-1, dimension))
+		weights = np.array(fitData._connection[1], dtype = np.float64)
+		mask = self._getRangeMask(fitData, centers)
 
 		fitMethodName = self.fitMethodName()
-		for i, center in enumerate(centers):
-			### Range check.
-			for axisNumber in range(dimension):
-				if not fitData.range(axisNumber).isInRange(center[axisNumber]):
-					### Out of range.
-					break
-			else:
-				### Check fit method.
-				if fitMethodName == 'Chi2':
-					weight = weights[i]
-
-					errorP = errorsP[i]
-					if errorP == None:
-						if weight > 0.0:
-							errorP = weight
-						else:
-							### Exclude.
-							continue
-					else:
-						if errorP == 0.0:
-							if weight > 0.0:
-								errorP = weight
-							else:
-								### Exclude.
-								continue
-
-					errorM = errorsM[i]
-					if errorM == None:
-						if weight > 0.0:
-							errorM = weight
-						else:
-							### Exclude.
-							continue
-					else:
-						if errorM == 0.0:
-							if weight > 0.0:
-								errorM = weight
-							else:
-								### Exclude.
-								continue
-					inRangeData.append([center, weight, errorP, errorM])
+		if fitMethodName == 'Chi2':
+			### Missing (None) and zero errors are replaced by the weight, or the point is excluded if the weight is not positive.
+			errors = []
+			for column in fitData._connection[2:4]:
+				### None is told apart from an error that is nan, which is kept as it is.
+				missing = np.array([error == None for error in column], dtype = bool)
+				error = np.array(column, dtype = np.float64)
+				missing |= (error == 0.0)
+				mask &= (~missing) | (weights > 0.0)
+				errors.append(np.where(missing, weights, error))
+		elif fitMethodName == 'CleverChi2':
+			mask &= (weights != 0.0)
+		elif not fitMethodName in ['LeastSquares', 'BinnedMaximumLikelihood', 'UnbinnedMaximumLikelihood']:
+			raise RuntimeError()
 
-				elif fitMethodName == 'CleverChi2':
-					if weights[i] != 0.0:
-						inRangeData.append([center, weights[i]])
-				elif fitMethodName == 'LeastSquares':
-					inRangeData.append([center, weights[i]])
-				elif fitMethodName == 'BinnedMaximumLikelihood':
-					inRangeData.append([center, weights[i]])
-				elif fitMethodName == 'UnbinnedMaximumLikelihood':
-					inRangeData.append([center])
-				else:
-					raise RuntimeError()
+		inRangeCenters = centers[mask]
+		if fitMethodName == 'UnbinnedMaximumLikelihood':
+			columns = [inRangeCenters]
+		elif fitMethodName == 'Chi2':
+			columns = [inRangeCenters, weights[mask], errors[0][mask], errors[1][mask]]
+		else:
+			columns = [inRangeCenters, weights[mask]]
+		inRangeData = _InRangeData([list(binData) for binData in zip(*[column.tolist() for column in columns])])
+
+		if len(inRangeData) > 0:
+			arrays = {}
+			arrays['x'] = np.ascontiguousarray(inRangeCenters.T)
+			if len(columns) > 1:
+				arrays['values'] = columns[1]
+			if len(columns) > 3:
+				arrays['errorsP'] = columns[2]
+				arrays['errorsM'] = columns[3]
+			inRangeData.arrays = arrays
 		return inRangeData
 
+	def _getInRangeArrays(self, inRangeData):
+		### The in-range data as contiguous arrays.
+		### 'x' has one row per axis, so that x[0] in a codelet is the array of all first coordinates.
+		if isinstance(inRangeData, _InRangeData):
+			return inRangeData.arrays
+		if inRangeData == []:
+			return None
+		arrays = {}
+		arrays['x'] = np.ascontiguousarray(np.array([binData[0] for binData in inRangeData], dtype = np.float64).T)
+		if len(inRangeData[0]) > 1:
+			arrays['values'] = np.array([binData[1] for binData in inRangeData], dtype = np.float64)
+		if len(inRangeData[0]) > 3:
+			arrays['errorsP'] = np.array([binData[2] for binData in inRangeData], dtype = np.float64)
+			arrays['errorsM'] = np.array([binData[3] for binData in inRangeData], dtype = np.float64)
+		return arrays
+
+	def _getFitRange(self, fitData, inRangeData):
+		### The intervals the PDF is normalized over, or None if it is not normalized.
+		### Infinite bounds are replaced by the extent of the in-range data.
+		if (not self._normalizePDF) or (self.fitMethodName() != 'UnbinnedMaximumLikelihood') or (inRangeData == []):
+			return None
+		if fitData.dimension() != 1:
+			raise TypeError('PDF normalization is only supported for one dimensional data.')
+		points = self._getInRangeArrays(inRangeData)['x'][0]
+		dataLower = points.min()
+		dataUpper = points.max()
+		rangeSet = fitData.range(0)
+		fitRange = []
+		for lower, upper in zip(rangeSet.lowerBounds(), rangeSet.upperBounds()):
+			if lower == IRangeSet._NINF:
+				lower = dataLower
+			if upper == IRangeSet._PINF:
+				upper = dataUpper
+			if lower < upper:
+				fitRange.append((lower, upper))
+		if fitRange == []:
+			fitRange.append((dataLower, dataUpper))
+		return fitRange
+
+	def _setEvaluationState(self, function, inRangeData, modelState = None, fitRange = None):
+		### Makes the evaluators work on function and inRangeData, and returns the previous state.
+		### modelState is the result of _getModelState for the same function on other data, to skip the checks.
+		### fitRange is the result of _getFitRange for the data.
+		previous = self._function, self._inRangeData, self._inRangeArrays, self._compiledModel, self._vectorizedModel, self._vectorizedDerivatives, self._fitRange, self._integralCache
+		self._function = function
+		self._inRangeData = inRangeData
+		self._inRangeArrays = self._getInRangeArrays(inRangeData)
+		self._fitRange = fitRange
+		self._integralCache = {}
+		if self._inRangeArrays == None:
+			self._compiledModel, self._vectorizedModel, self._vectorizedDerivatives = None, False, False
+		elif modelState != None:
+			self._compiledModel, self._vectorizedModel, self._vectorizedDerivatives = modelState
+		else:
+			self._compiledModel = self._getCompiledModel(function)
+			self._vectorizedModel = self._vectorized and self._checkVectorizedModel(function._innerParameterNameSpace)
+			self._vectorizedDerivatives = self._vectorizedModel and (not self._hasConstraints()) and self._checkVectorizedDerivatives(function._innerParameterNameSpace)
+		self._derivativeCache = None
+		return previous
+
+	def _getModelState(self):
+		return self._compiledModel, self._vectorizedModel, self._vectorizedDerivatives
+
+	def _restoreEvaluationState(self, state):
+		self._function, self._inRangeData, self._inRangeArrays, self._compiledModel, self._vectorizedModel, self._vectorizedDerivatives, self._fitRange, self._integralCache = state
+		self._derivativeCache = None
+
+	def _getCompiledModel(self, function):
+		### The codelet as a numpy function of (x, parameters), or None.
+		if not self._vectorized:
+			return None
+		try:
+			codelet = function.codeletString()
+		except Exception:
+			return None
+		return compileCodelet(codelet, function.parameterNames())
+
+	def _modelValues(self, parameterNameSpace):
+		### The model at all in-range points in one evaluation of the codelet.
+		x = self._inRangeArrays['x']
+		if self._compiledModel != None:
+			parameters = [parameterNameSpace[name] for name in self._function.parameterNames()]
+			return self._asPointArray(self._compiledModel(x, parameters))
+		space = copyEvaluatorParameterSpace(parameterNameSpace)
+		space.update(numpyFunctions)
+		space['x'] = x
+		return self._asPointArray(self._function._getDeriv0Base(space))
+
+	def _checkVectorizedModel(self, parameterNameSpace):
+		### The model can be evaluated on arrays if it gives the same values as point by point.
+		### A compiled model that does not is dropped in favour of the codelet evaluated on arrays.
+		### Large data are compared on an evenly spaced sample of 1000 points.
+		if self._inRangeArrays == None:
+			return False
+		getDeriv0Base = self._function._getDeriv0Base
+		nPoints = len(self._inRangeData)
+		samples = range(0, nPoints, max(1, nPoints // 1000))
+		expected = []
+		for k in samples:
+			parameterNameSpace['x'] = self._inRangeData[k][0]
+			expected.append(getDeriv0Base(parameterNameSpace))
+		while 1:
+			try:
+				values = self._modelValues(parameterNameSpace)
+				if (values.shape == (nPoints,)) and np.allclose(values[samples], expected, rtol = 1e-12, atol = 0.0):
+					return True
+			except Exception:
+				pass
+			if self._compiledModel == None:
+				return False
+			self._compiledModel = None
+
+	def _arrayParameterSpace(self, parameterNameSpace):
+		space = copyEvaluatorParameterSpace(parameterNameSpace)
+		space.update(numpyFunctions)
+		space['x'] = self._inRangeArrays['x']
+		return space
+
+	def _asPointArray(self, values):
+		### One value per point; a constant is broadcast to the points, any other shape raises ValueError.
+		values = np.asarray(values, dtype = np.float64)
+		shape = self._inRangeArrays['x'].shape[1:]
+		if values.shape != shape:
+			values = values + np.zeros(shape)
+			if values.shape != shape:
+				raise ValueError('The values do not broadcast to the %d points.' % shape[0])
+		return values
+
+	def _checkVectorizedDerivatives(self, parameterNameSpace):
+		### The first and second derivatives of the model can be evaluated on arrays
+		### if they agree with the point by point derivatives on a sample of the points.
+		function = self._function
+		nParameters = len(function.parameterNames())
+		nPoints = len(self._inRangeData)
+		samples = sorted(set([0, nPoints // 2, nPoints - 1]))
+		try:
+			space = self._arrayParameterSpace(parameterNameSpace)
+			first = [self._asPointArray(function._getDeriv1Base(space, i)) for i in range(nParameters)]
+			second = [[self._asPointArray(function._getDeriv2Base(space, i, j)) for j in range(nParameters)] for i in range(nParameters)]
+		except Exception:
+			return False
+		for k in samples:
+			parameterNameSpace['x'] = self._inRangeData[k][0]
+			for i in range(nParameters):
+				if not np.allclose(first[i][k], function._getDeriv1Base(parameterNameSpace, i), rtol = 1e-8, atol = 1e-12):
+					return False
+				for j in range(nParameters):
+					if not np.allclose(second[i][j][k], function._getDeriv2Base(parameterNameSpace, i, j), rtol = 1e-8, atol = 1e-12):
+						return False
+		return True
+
+	def _objectiveWeights(self, fValues):
+		### All objectives have the gradient sum(a * J[i]) and the Hessian sum(b * J[i] * J[j] + a * D2[i][j]),
+		### where J and D2 are the first and second derivatives of the model at each point.
+		fitMethodName = self.fitMethodName()
+		arrays = self._inRangeArrays
+		if fitMethodName == 'LeastSquares':
+			a = 2.0 * (fValues - arrays['values'])
+			b = 2.0 * np.ones_like(fValues)
+		elif fitMethodName == 'Chi2':
+			difference = fValues - arrays['values']
+			weights = 1.0 / np.where(difference > 0.0, arrays['errorsP'], arrays['errorsM'])
+			a = 2.0 * difference * weights
+			b = 2.0 * weights
+		elif fitMethodName == 'CleverChi2':
+			weights = 1.0 / np.fabs(fValues)
+			a = 2.0 * (fValues - arrays['values']) * weights
+			b = 2.0 * weights
+		elif fitMethodName == 'BinnedMaximumLikelihood':
+			a = 1.0 - arrays['values'] / fValues
+			b = arrays['values'] / fValues**2
+		elif fitMethodName == 'UnbinnedMaximumLikelihood':
+			a = -1.0 / fValues
+			b = 1.0 / fValues**2
+		else:
+			raise RuntimeError()
+		return a, b
+
+	def _getDerivativeCache(self, parameterNameSpace):
+		### The model derivatives at the current parameters.
+		### They are computed on demand and kept until the parameters change,
+		### so that the calls for every element of the gradient and Hessian share them.
+		function = self._function
+		key = tuple([parameterNameSpace[name] for name in function.parameterNames()])
+		cache = self._derivativeCache
+		if (cache == None) or (cache['key'] != key):
+			space = self._arrayParameterSpace(parameterNameSpace)
+			a, b = self._objectiveWeights(self._modelValues(parameterNameSpace))
+			cache = {'key': key, 'space': space, 'a': a, 'b': b, 'first': {}, 'gradient': {}, 'hessian': {}}
+			self._derivativeCache = cache
+		return cache
+
+	def _firstDerivative(self, cache, i):
+		first = cache['first']
+		if not first.has_key(i):
+			first[i] = self._asPointArray(self._function._getDeriv1Base(cache['space'], i))
+		return first[i]
+
+	def _gradientVectorized(self, parameterNameSpace, i):
+		cache = self._getDerivativeCache(parameterNameSpace)
+		gradient = cache['gradient']
+		if not gradient.has_key(i):
+			gradient[i] = self._roundResult(float(np.dot(cache['a'], self._firstDerivative(cache, i))))
+		return gradient[i]
+
+	def _hessianVectorized(self, parameterNameSpace, i, j):
+		cache = self._getDerivativeCache(parameterNameSpace)
+		hessian = cache['hessian']
+		if not hessian.has_key((i, j)):
+			second = self._asPointArray(self._function._getDeriv2Base(cache['space'], i, j))
+			value = np.dot(cache['b'], self._firstDerivative(cache, i) * self._firstDerivative(cache, j)) + np.dot(cache['a'], second)
+			hessian[(i, j)] = hessian[(j, i)] = self._roundResult(float(value))
+		return hessian[(i, j)]
+
 	def _fitInitialization(self, function, fitParameterSettings):
 		constraintNames = []
 		compiledConstraints = self._getCompiledConstraints()
@@ -647,23 +1085,132 @@ class IFitter:
 			sum += (fValue - binData[1] * log(fValue))
 		return self._roundResult(sum)
 
+	def _binnedMaximumLikelihoodValueConstrained(self, parameterNameSpace):
+		return self._binnedMaximumLikelihoodValue(parameterNameSpace)
 
-        def _binnedMaximumLikelihoodValueConstrained(self, parameterNameSpace):
-            return self._binnedMaximumLikelihoodValue(parameterNameSpace)
-    
-        def _unbinnedMaximumLikelihoodValue(self, parameterNameSpace):
-            function = self._function
-            getDeriv0Base = function._getDeriv0Base
-      
-            sum = 0.0
-            for binData in self._inRangeData:
-                parameterNameSpace['x'] = binData[0]
-                sum -= log(getDeriv0Base(parameterNameSpace))
-             return self._roundResult(sum)
-    
+	def _unbinnedMaximumLikelihoodValue(self, parameterNameSpace):
+		function = self._function
+		getDeriv0Base = function._getDeriv0Base
+		sum = 0.0
+		for binData in self._inRangeData:
+			parameterNameSpace['x'] = binData[0]
+			sum -= log(getDeriv0Base(parameterNameSpace))
+		return self._roundResult(sum)
 
-        def _unbinnedMaximumLikelihoodValueConstrained(self, parameterNameSpace):
-            return self._unbinnedMaximumLikelihoodValue(parameterNameSpace)
+	def _unbinnedMaximumLikelihoodValueConstrained(self, parameterNameSpace):
+		return self._unbinnedMaximumLikelihoodValue(parameterNameSpace)
+
+	def _objectiveFromModel(self, fValues):
+		### The objective of the fit method for the model values at all in-range points.
+		fitMethodName = self.fitMethodName()
+		arrays = self._inRangeArrays
+		if fitMethodName == 'LeastSquares':
+			difference = fValues - arrays['values']
+			result = np.dot(difference, difference)
+		elif fitMethodName == 'Chi2':
+			difference = fValues - arrays['values']
+			errors = np.where(difference > 0.0, arrays['errorsP'], arrays['errorsM'])
+			result = np.sum(difference**2 / errors)
+		elif fitMethodName == 'CleverChi2':
+			result = np.sum((fValues - arrays['values'])**2 / np.fabs(fValues))
+		elif fitMethodName == 'BinnedMaximumLikelihood':
+			result = np.sum(fValues - arrays['values'] * np.log(fValues))
+		elif fitMethodName == 'UnbinnedMaximumLikelihood':
+			result = -np.sum(np.log(fValues))
+		else:
+			raise RuntimeError()
+		return self._roundResult(float(result))
+
+	def _valueVectorized(self, parameterNameSpace):
+		return self._objectiveFromModel(self._modelValues(parameterNameSpace))
+
+	def _parameterArray(self, parameterNameSpace):
+		return np.array([parameterNameSpace[name] for name in self._function.parameterNames()], dtype = np.float64)
+
+	def _integrand(self, parameters):
+		### The model at the given parameters as a function of an array of points in one dimension.
+		function = self._function
+		model = self._compiledModel
+		if model != None:
+			return lambda x: model(x[None, :], parameters)
+		space = copyEvaluatorParameterSpace(function._innerParameterNameSpace)
+		for name, value in zip(function.parameterNames(), parameters):
+			space[name] = value
+		if self._vectorizedModel:
+			space.update(numpyFunctions)
+			def integrand(x):
+				space['x'] = x[None, :]
+				return function._getDeriv0Base(space)
+		else:
+			def integrand(x):
+				values = []
+				for point in x:
+					space['x'] = [point]
+					values.append(function._getDeriv0Base(space))
+				return np.array(values)
+		return integrand
+
+	def _logIntegral(self, parameters):
+		### The log of the integral of the model over the fit range, memoized by the parameter values.
+		### Catalog models are integrated analytically, other models by Gauss-Legendre quadrature.
+		key = tuple(parameters)
+		cache = self._integralCache
+		if not cache.has_key(key):
+			if len(cache) >= 4096:
+				cache.clear()
+			integral = None
+			if self._compiledModel != None:
+				integral = compileIntegral(self._function.codeletString(), self._function.parameterNames())
+			if integral != None:
+				value = sum([integral(lower, upper, parameters) for lower, upper in self._fitRange])
+			else:
+				integrand = self._integrand(parameters)
+				value = sum([legendreIntegral(integrand, lower, upper) for lower, upper in self._fitRange])
+			if value > 0.0:
+				cache[key] = log(value)
+			else:
+				cache[key] = np.inf
+		return cache[key]
+
+	def _normalizationTerm(self, parameters):
+		### N log(integral), which turns the -log likelihood of the model into that of the normalized PDF.
+		return len(self._inRangeData) * self._logIntegral(parameters)
+
+	def _shiftedNormalizationTerm(self, parameters, shifts):
+		### The normalization term with the parameters shifted by (index, shift) pairs, and the constraints applied.
+		parameters = parameters.copy()
+		for index, shift in shifts:
+			parameters[index] += shift
+		if self._hasConstraints():
+			parameters = compileConstraints(self.constraints(), self._function.parameterNames())(parameters)
+		return self._normalizationTerm(parameters)
+
+	def _normalizationGradient(self, parameterNameSpace, i):
+		### Central differences, the integral is cheap compared to the sum over the data.
+		parameters = self._parameterArray(parameterNameSpace)
+		h = 1e-5 * max(1.0, abs(parameters[i]))
+		return (self._shiftedNormalizationTerm(parameters, [(i, h)]) - self._shiftedNormalizationTerm(parameters, [(i, -h)])) / (2.0 * h)
+
+	def _normalizationHessian(self, parameterNameSpace, i, j):
+		parameters = self._parameterArray(parameterNameSpace)
+		hi = 1e-4 * max(1.0, abs(parameters[i]))
+		if i == j:
+			return (self._shiftedNormalizationTerm(parameters, [(i, hi)]) - 2.0 * self._shiftedNormalizationTerm(parameters, []) + self._shiftedNormalizationTerm(parameters, [(i, -hi)])) / hi**2
+		hj = 1e-4 * max(1.0, abs(parameters[j]))
+		result = 0.0
+		for si, sj in [(1.0, 1.0), (1.0, -1.0), (-1.0, 1.0), (-1.0, -1.0)]:
+			result += si * sj * self._shiftedNormalizationTerm(parameters, [(i, si * hi), (j, sj * hj)])
+		return result / (4.0 * hi * hj)
+
+	def _normalizedEvaluators(self, evaluatorValue, evaluatorGradient, evaluatorHessian):
+		### The evaluators with the normalization term added.
+		def value(parameterNameSpace):
+			return self._roundResult(evaluatorValue(parameterNameSpace) + self._normalizationTerm(self._parameterArray(parameterNameSpace)))
+		def gradient(parameterNameSpace, i):
+			return self._roundResult(evaluatorGradient(parameterNameSpace, i) + self._normalizationGradient(parameterNameSpace, i))
+		def hessian(parameterNameSpace, i, j):
+			return self._roundResult(evaluatorHessian(parameterNameSpace, i, j) + self._normalizationHessian(parameterNameSpace, i, j))
+		return value, gradient, hessian
 
 	def _leastSquaresGradient(self, parameterNameSpace, i):
 		function = self._function
@@ -945,32 +1492,138 @@ class IFitter:
 				return None
 		return errorMatrix
 
-	def _getAsymmetricError(self, evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum, up, parabolicErrors):
-		currentSpace = copyEvaluatorParameterSpace(evaluatorParameterSpace)
-		errors = []
+	def _getAsymmetricError(self, evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum, up, parabolicErrors, errorMatrix = None):
+		### Both sides of every free parameter are scanned independently, in a pool of processes if option['processes'] is given.
+		tasks = []
 		for i, parameterName in enumerate(parameterNames):
 			if i in freeIndices:
-				valuei = currentSpace[parameterName]
-				evaluatorParameterSpace[parameterName] = valuei - parabolicErrors[i]
-				### Get the solutions.
-				value1, warnflag1, mesg2 = self._asymmetricErrorSearch(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum + up, i, parameterName)
-				if warnflag1 != 0:
-					return None
+				for sign in [-1.0, 1.0]:
+					tasks.append((i, self._getScanStart(parameterNames, limits, freeIndices, evaluatorParameterSpace, parabolicErrors, errorMatrix, i, sign)))
+		context = (evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum + up)
+		processes = self._option.get('processes', 1)
+		if (processes == 1) or _inPoolWorker:
+			results = [self._asymmetricErrorScan(context, task) for task in tasks]
+		else:
+			results = _mapForked(self._asymmetricErrorScan, context, tasks, processes)
 
-				evaluatorParameterSpace[parameterName] = valuei + parabolicErrors[i]
-				### Get the solutions.
-				value2, warnflag2, mesg2 = self._asymmetricErrorSearch(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum + up, i, parameterName)
-				if warnflag2 != 0:
+		errors = []
+		for i, parameterName in enumerate(parameterNames):
+			if i in freeIndices:
+				value1, warnflag1 = results.pop(0)
+				value2, warnflag2 = results.pop(0)
+				if (warnflag1 != 0) or (warnflag2 != 0):
 					return None
 
 				#if value1 == value2:
 				#	return None
+				valuei = evaluatorParameterSpace[parameterName]
 				errorMinus = valuei - min(value1, value2)
 				errorPlus = max(value1, value2) - valuei
 				errors.append([errorMinus, errorPlus])
 			else:
 				errors.append([0.0, 0.0])
-		updateEvaluatorParameterSpace(currentSpace, evaluatorParameterSpace)
+		return errors
+
+	def _getScanStart(self, parameterNames, limits, freeIndices, evaluatorParameterSpace, parabolicErrors, errorMatrix, i, sign):
+		### The start of a scan: parameter i moved by one parabolic error, and the other free parameters
+		### moved to where the parabolic approximation has its minimum for that value of parameter i.
+		shift = sign * parabolicErrors[i]
+		start = {parameterNames[i]: evaluatorParameterSpace[parameterNames[i]] + shift}
+		if errorMatrix != None:
+			freeI = freeIndices.index(i)
+			for freeJ, j in enumerate(freeIndices):
+				if j == i:
+					continue
+				value = evaluatorParameterSpace[parameterNames[j]] + shift * errorMatrix[freeJ][freeI] / errorMatrix[freeI][freeI]
+				lower, upper = limits[j]
+				if ((lower == None) or (lower < value)) and ((upper == None) or (value < upper)):
+					start[parameterNames[j]] = value
+		return start
+
+	def _asymmetricErrorScan(self, context, task):
+		### One side of the scan of parameter i, on its own copy of the parameter space.
+		evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, targetValue = context
+		i, start = task
+		space = copyEvaluatorParameterSpace(evaluatorParameterSpace)
+		space.update(start)
+		value, warnflag, mesg = self._asymmetricErrorSearch(evaluatorValue, evaluatorGradient, evaluatorHessian, space, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, targetValue, i, parameterNames[i])
+		return value, warnflag
+
+	def _setFreeParameters(self, evaluatorParameterSpace, freeParameterNames, values, constraints):
+		for parameterName, value in zip(freeParameterNames, values):
+			evaluatorParameterSpace[parameterName] = value
+		for constraint in constraints:
+			exec constraint in evaluatorParameterSpace
+
+	def _minuit2Minimize(self, evaluatorValue, evaluatorParameterSpace, freeParameterNames, limits, constraints, freeIndices, up, verbose):
+		### Minuit varies the free parameters only, the constrained ones follow from them.
+		if self._vectorizedModel and (self._compiledModel != None):
+			### Straight from the parameter values to the model values, without the parameter name space.
+			parameterNames = self._function.parameterNames()
+			parameters = np.array([evaluatorParameterSpace[parameterName] for parameterName in parameterNames], dtype = np.float64)
+			free = np.array(freeIndices, dtype = int)
+			model = self._compiledModel
+			x = self._inRangeArrays['x']
+			if constraints != []:
+				constrain = compileConstraints(self.constraints(), parameterNames)
+			else:
+				constrain = None
+			normalized = self._fitRange != None
+			def fcn(values):
+				parameters[free] = values
+				if constrain == None:
+					modelParameters = parameters
+				else:
+					modelParameters = constrain(parameters)
+				result = self._objectiveFromModel(self._asPointArray(model(x, modelParameters)))
+				if normalized:
+					result += self._normalizationTerm(modelParameters)
+				return result
+		else:
+			def fcn(values):
+				self._setFreeParameters(evaluatorParameterSpace, freeParameterNames, values, constraints)
+				return evaluatorValue(evaluatorParameterSpace)
+
+		startValues = [evaluatorParameterSpace[parameterName] for parameterName in freeParameterNames]
+		freeLimits = [limits[i] for i in freeIndices]
+		minuit = Minuit(fcn, freeParameterNames, startValues, limits = freeLimits, up = up)
+		if minuit.migrad():
+			minuit.hesse()
+		### The last call of fcn need not be at the minimum.
+		self._setFreeParameters(evaluatorParameterSpace, freeParameterNames, minuit.values, constraints)
+		if verbose:
+			print 'Minuit2: fval = %g, edm = %g, %d calls' % (minuit.fval, minuit.edm, minuit.nfcn)
+			for parameterName, value, error in zip(freeParameterNames, minuit.values, minuit.errors):
+				print '  %s = %g +- %g' % (parameterName, value, error)
+		if minuit.isValid:
+			return minuit, minuit.fval, 0, 'Optimization terminated successfully.'
+		else:
+			return minuit, minuit.fval, 1, 'Minuit2 did not converge to a valid minimum.'
+
+	def _getMinuit2ErrorMatrix(self, minuit):
+		errorMatrix = minuit.covariance
+		if errorMatrix == None:
+			return None
+		for i in range(len(errorMatrix)):
+			if errorMatrix[i][i] < 0.0:
+				return None
+		return errorMatrix
+
+	def _getMinosErrors(self, minuit, evaluatorParameterSpace, parameterNames, freeParameterNames, constraints, freeIndices):
+		errors = []
+		freeIndex = 0
+		for i in range(len(parameterNames)):
+			if i in freeIndices:
+				lower, upper, valid = minuit.minos(freeIndex)
+				if not valid:
+					errors = None
+					break
+				errors.append([-lower, upper])
+				freeIndex += 1
+			else:
+				errors.append([0.0, 0.0])
+		### MINOS leaves the parameters where it evaluated last.
+		self._setFreeParameters(evaluatorParameterSpace, freeParameterNames, minuit.values, constraints)
 		return errors
 
 	def _asymmetricErrorSearch(self, evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, targetValue, i, parameterName, heightErrorLimit = None, maxIter = None):
@@ -1066,6 +1719,14 @@ class IFitter:
 					evaluatorHessian = self._unbinnedMaximumLikelihoodHessian
 				else:
 					raise RuntimeError()
+			### The constrained values are the plain ones, so the vectorized values serve both.
+			if self._vectorizedModel:
+				evaluatorValue = self._valueVectorized
+			if self._vectorizedDerivatives:
+				evaluatorGradient = self._gradientVectorized
+				evaluatorHessian = self._hessianVectorized
+			if self._fitRange != None:
+				evaluatorValue, evaluatorGradient, evaluatorHessian = self._normalizedEvaluators(evaluatorValue, evaluatorGradient, evaluatorHessian)
 		else:
 			raise RuntimeError()
 
@@ -1073,15 +1734,12 @@ class IFitter:
 
 	def createScan1D(self, fitData, function, parameterName, npts, pmin, pmax):
 		originals = function.parameters()
-		currentFunction = self._function
-		currentRangeData = self._inRangeData
 		dataPointSet = IDataPointSet('scan1D', 'scan1D', 2)
 		inRangeData = self._getInRangeData(fitData)
 		evaluatorParameterSpace = function._innerParameterNameSpace
+		currentState = self._setEvaluationState(function, inRangeData, fitRange = self._getFitRange(fitData, inRangeData))
 		evaluatorValue, evaluatorGradient, evaluatorHessian = self._getEvaluator(self.engineName(), self.fitMethodName())
 
-		self._function = function
-		self._inRangeData = inRangeData
 		for step in range(npts):
 			value = pmin + (pmax - pmin) * (step + 0.5) / npts
 			function.setParameter(parameterName, value)
@@ -1090,22 +1748,18 @@ class IFitter:
 			dataPoint.coordinate(1).setValue(evaluatorValue(evaluatorParameterSpace))
 
 		function.setParameters(originals)
-		self._function = currentFunction
-		self._inRangeData = currentRangeData
+		self._restoreEvaluationState(currentState)
 		return dataPointSet
 
 	def createContour(self, fitData, fitResult, parameterName1, parameterName2, npts, up):
 		function = fitResult.fittedFunction()
 		originals = fitResult.fittedParameters()
 		parameterNames = function.parameterNames()
-		currentFunction = self._function
-		currentRangeData = self._inRangeData
 		inRangeData = self._getInRangeData(fitData)
 		evaluatorParameterSpace = function._innerParameterNameSpace
+		currentState = self._setEvaluationState(function, inRangeData, fitRange = self._getFitRange(fitData, inRangeData))
 		evaluatorValue, evaluatorGradient, evaluatorHessian = self._getEvaluator(fitResult.engineName(), fitResult.fitMethodName())
 
-		self._function = function
-		self._inRangeData = inRangeData
 		minimum = evaluatorValue(evaluatorParameterSpace)
 		parameterErrorsAll = fitResult.errors()
 		wasFixed = {}
@@ -1159,8 +1813,7 @@ class IFitter:
 				dataPoint.coordinate(1).setValue(parameter2Plus)
 
 		function.setParameters(originals)
-		self._function = currentFunction
-		self._inRangeData = currentRangeData
+		self._restoreEvaluationState(currentState)
 		for name in parameterNames:
 			fitResult.fitParameterSettings(name).setFixed(wasFixed[name])
 
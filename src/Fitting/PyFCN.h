@@ -0,0 +1,51 @@
+#ifndef PYFCN_H
+#define PYFCN_H
+
+#include "Python.h"
+#include <stdexcept>
+#include <vector>
+#include "Minuit2/FCNBase.h"
+#include "Minuit2/FunctionMinimum.h"
+#include "Minuit2/MinosError.h"
+#include "Minuit2/MnMigrad.h"
+#include "Minuit2/MnMinos.h"
+
+/* Returns 0 and sets the value on success, -1 if the Python function raised. */
+typedef int (*PyFCNCallback)(PyObject* owner, const std::vector<double>& x, double* value);
+
+/* An FCN that evaluates a Python objective through a callback.
+   A Python exception is turned into a C++ exception, which stops the minimization. */
+class PyFCN : public ROOT::Minuit2::FCNBase {
+public:
+    PyFCN(PyObject* owner, PyFCNCallback callback, double up) : fOwner(owner), fCallback(callback), fUp(up) {}
+
+    virtual ~PyFCN() {}
+
+    virtual double operator()(const std::vector<double>& x) const {
+        double value;
+        if (fCallback(fOwner, x, &value) != 0) {
+            throw std::runtime_error("The Python objective function raised an exception");
+        }
+        return value;
+    }
+
+    virtual double Up() const { return fUp; }
+
+    virtual void SetErrorDef(double up) { fUp = up; }
+
+private:
+    PyObject* fOwner;
+    PyFCNCallback fCallback;
+    double fUp;
+};
+
+/* FunctionMinimum and MinosError have no default constructor, so they are copied to the heap here */
+inline ROOT::Minuit2::FunctionMinimum* RunMigrad(ROOT::Minuit2::MnMigrad& migrad, unsigned int maxfcn, double tolerance) {
+    return new ROOT::Minuit2::FunctionMinimum(migrad(maxfcn, tolerance));
+}
+
+inline ROOT::Minuit2::MinosError* RunMinos(ROOT::Minuit2::MnMinos& minos, unsigned int index, unsigned int maxcalls, double tolerance) {
+    return new ROOT::Minuit2::MinosError(minos.Minos(index, maxcalls, tolerance));
+}
+
+#endif
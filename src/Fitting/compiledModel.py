@@ -0,0 +1,173 @@
+### Compiles catalog model codelets and parameter constraints into numpy functions.
+### A model becomes model(x, p), where x has one row per axis and one column per point
+### and p holds the parameter values in the order of the parameter names.
+### A set of constraints becomes constrain(p), which returns the parameters with the constrained ones set.
+### Catalog models also have their integral compiled, integral(lower, upper, p) for one dimension.
+### The compiled functions are cached, so that repeated fits of the same model compile it once.
+import numpy as np
+import math
+
+### numpy versions of the math functions that codelets use, so that a model can be evaluated on all points at once.
+numpyFunctions = {
+	'exp': np.exp, 'log': np.log, 'log10': np.log10, 'sqrt': np.sqrt, 'pow': np.power,
+	'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan, 'atan2': np.arctan2,
+	'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh, 'fabs': np.fabs, 'abs': np.abs, 'floor': np.floor, 'ceil': np.ceil,
+	'fmod': np.fmod, 'hypot': np.hypot}
+
+def _globals():
+	### The names a compiled function sees besides its parameters, which take precedence.
+	space = dict(numpyFunctions)
+	space['pi'] = np.pi
+	space['e'] = np.e
+	space['array'] = np.array
+	return space
+
+_modelCache = {}
+_constraintCache = {}
+_integralCache = {}
+
+def _gaussian(names):
+	return '%s * exp(-0.5 * ((x[0] - %s) / %s)**2)' % tuple(names)
+
+def _exponential(names):
+	return '%s * exp(%s * x[0])' % tuple(names)
+
+def _polynomial(names):
+	### Horner's scheme, p0 + x * (p1 + x * (p2 + ...)).
+	expression = names[-1]
+	for name in reversed(names[:-1]):
+		expression = '%s + x[0] * (%s)' % (name, expression)
+	return expression
+
+### The integrals from lower to upper of the catalog functions.
+def _gaussianIntegral(names):
+	return '%s * fabs(%s) * sqrt(pi / 2.0) * (erf((upper - %s) / (sqrt(2.0) * fabs(%s))) - erf((lower - %s) / (sqrt(2.0) * fabs(%s))))' % (names[0], names[2], names[1], names[2], names[1], names[2])
+
+def _exponentialIntegral(names):
+	### expm1 keeps the precision for small exponents, where the difference of the exponentials cancels.
+	return '((%s * exp(%s * lower) * expm1(%s * (upper - lower)) / %s) if %s != 0.0 else %s * (upper - lower))' % (names[0], names[1], names[1], names[1], names[1], names[0])
+
+def _polynomialIntegral(names):
+	return ' + '.join(['%s * (upper**%d - lower**%d) / %d.0' % (name, k + 1, k + 1, k + 1) for k, name in enumerate(names)])
+
+def _catalogTerm(name):
+	### The number of parameters and the builders of the expression and its integral of a catalog function.
+	if name == 'G':
+		return 3, _gaussian, _gaussianIntegral
+	elif name == 'E':
+		return 2, _exponential, _exponentialIntegral
+	elif name.startswith('P') and name[1:].isdigit():
+		return int(name[1:]) + 1, _polynomial, _polynomialIntegral
+	else:
+		return None
+
+def _catalogSum(name, parameterNames, part):
+	### The expression (part 1) or integral (part 2) of a catalog function or a sum of them,
+	### with the parameters of the terms taken in order from parameterNames.
+	### Returns None for unknown functions or a wrong number of parameters.
+	terms = []
+	used = 0
+	for termName in name.split('+'):
+		term = _catalogTerm(termName.strip())
+		if term == None:
+			return None
+		nParameters = term[0]
+		names = parameterNames[used:used + nParameters]
+		if len(names) != nParameters:
+			return None
+		terms.append(term[part](names))
+		used += nParameters
+	if used != len(parameterNames):
+		return None
+	return ' + '.join(['(%s)' % term for term in terms])
+
+def catalogExpression(name, parameterNames):
+	### The expression of a catalog function or a sum of them, like 'G', 'P2' or 'G+E'.
+	return _catalogSum(name, parameterNames, 1)
+
+def catalogIntegral(name, parameterNames):
+	### The integral from lower to upper of a catalog function or a sum of them.
+	return _catalogSum(name, parameterNames, 2)
+
+def modelExpression(codelet, parameterNames):
+	### The expression of a catalog codelet string like 'codelet:G+P1:catalog', or None.
+	### Verbatim codelets are left to their function: their code is written for its name space,
+	### which the globals of a compiled model need not reproduce.
+	if (not codelet.startswith('codelet:')) or (':verbatim:' in codelet):
+		return None
+	return catalogExpression(codelet[len('codelet:'):].split(':', 1)[0], parameterNames)
+
+def _validNames(parameterNames):
+	for name in parameterNames:
+		if (not name.replace('_', 'a').isalnum()) or name[0].isdigit() or (name in ['x', 'p', 'array']) or numpyFunctions.has_key(name):
+			return False
+	return True
+
+def _unpacking(parameterNames):
+	### Makes the parameters local variables of the compiled function.
+	if parameterNames == []:
+		return ''
+	return '\t%s, = p\n' % ', '.join(parameterNames)
+
+def compileModel(expression, parameterNames):
+	### model(x, p) for an expression in x and the parameter names, or None if it cannot be compiled.
+	parameterNames = list(parameterNames)
+	key = (expression, tuple(parameterNames))
+	if not _modelCache.has_key(key):
+		model = None
+		if (expression != None) and _validNames(parameterNames):
+			source = 'def model(x, p):\n%s\treturn %s\n' % (_unpacking(parameterNames), expression)
+			space = _globals()
+			try:
+				exec compile(source, '<model %s>' % expression, 'exec') in space
+				model = space['model']
+			except SyntaxError:
+				pass
+		_modelCache[key] = model
+	return _modelCache[key]
+
+def compileCodelet(codelet, parameterNames):
+	### model(x, p) for a catalog codelet string, or None.
+	return compileModel(modelExpression(codelet, parameterNames), parameterNames)
+
+def compileIntegral(codelet, parameterNames):
+	### integral(lower, upper, p) for a one dimensional catalog codelet, or None.
+	parameterNames = list(parameterNames)
+	key = (codelet, tuple(parameterNames))
+	if not _integralCache.has_key(key):
+		integral = None
+		if codelet.startswith('codelet:') and (not ':verbatim:' in codelet) and _validNames(parameterNames) and (not 'lower' in parameterNames) and (not 'upper' in parameterNames):
+			expression = catalogIntegral(codelet[len('codelet:'):].split(':', 1)[0], parameterNames)
+			if expression != None:
+				source = 'def integral(lower, upper, p):\n%s\treturn %s\n' % (_unpacking(parameterNames), expression)
+				space = dict([(name, getattr(math, name)) for name in ['erf', 'exp', 'expm1', 'fabs', 'sqrt', 'pi']])
+				exec compile(source, '<integral %s>' % expression, 'exec') in space
+				integral = space['integral']
+		_integralCache[key] = integral
+	return _integralCache[key]
+
+def legendreIntegral(function, lower, upper, pieces = 16, order = 16):
+	### The integral of function, which takes an array of points, from lower to upper
+	### by Gauss-Legendre quadrature of the given order on each of the equal pieces of the interval.
+	nodes, weights = np.polynomial.legendre.leggauss(order)
+	edges = np.linspace(lower, upper, pieces + 1)
+	halfWidths = 0.5 * (edges[1:] - edges[:-1])
+	centers = 0.5 * (edges[1:] + edges[:-1])
+	x = (centers[:, None] + halfWidths[:, None] * nodes[None, :]).ravel()
+	values = np.asarray(function(x), dtype = np.float64) + np.zeros(x.shape)
+	return float(np.sum((halfWidths[:, None] * weights[None, :]).ravel() * values))
+
+def compileConstraints(constraints, parameterNames):
+	### constrain(p) for constraint statements like 'p1 = 2 * p0', run in order.
+	### Returns a new array, p itself is not changed.
+	parameterNames = list(parameterNames)
+	key = (tuple(constraints), tuple(parameterNames))
+	if not _constraintCache.has_key(key):
+		if not _validNames(parameterNames):
+			raise ValueError('Parameter names %s cannot be compiled.' % parameterNames)
+		body = ''.join(['\t%s\n' % constraint.strip() for constraint in constraints])
+		source = 'def constrain(p):\n%s%s\treturn array([%s])\n' % (_unpacking(parameterNames), body, ', '.join(parameterNames))
+		space = _globals()
+		exec compile(source, '<constraints>', 'exec') in space
+		_constraintCache[key] = space['constrain']
+	return _constraintCache[key]
@@ -1,35 +1,226 @@
-cdef extern from "arrayobject.h":
-    ctypedef int intp
-    
-    ctypedef extern class numpy.ndarray [object PyArrayObject]:
-        cdef char* data
-        cdef int nd
-        cdef intp* dimensions
-        cdef intp* strides
-        cdef int flags
-
-        
-cdef extern from "vector":
-    ctypedef struct doubleVec "std::vector<double>":
-        void (* push_back)(double elem)
-        void (* assign)(double* begin, double* end)
-        int (* size)()
-    doubleVec doubleVecFactory "std::vector<double>"(double* begin, double* end)
-    cdef extern double read_vec(doubleVec)
-    
-cdef extern from "Minuit2/FCNBase.h":
-    ctypedef struct FCNBase "ROOT::Minuit2::FCNBase":
-        double Up()
-        double call "operator()"(doubleVec*)
-        
-cdef extern from "Minuit2/MnUserParameters.h":
-    ctypedef struct MnUserParameters "ROOT::Minuit2::MnUserParameters":
-        void (* Fix)(unsigned int)
-        
-cdef class UserFunction(FCNBase):
-    cdef double Up(self):
-        return 1.0
-        
-    cdef double call(self, doubleVec* x):
-        return 1.0
-        
+# distutils: language = c++
+""" Minimization with Minuit2: MIGRAD, HESSE and MINOS for a Python objective function """
+from libcpp.vector cimport vector
+from libcpp.string cimport string
+from cpython.ref cimport PyObject
+import sys
+
+
+cdef extern from "Minuit2/FCNBase.h" namespace "ROOT::Minuit2":
+    cdef cppclass FCNBase:
+        pass
+
+cdef extern from "Minuit2/MnUserParameters.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnUserParameters:
+        MnUserParameters()
+        bint Add(string, double, double)
+        void Fix(unsigned int)
+        void SetLimits(unsigned int, double, double)
+        void SetLowerLimit(unsigned int, double)
+        void SetUpperLimit(unsigned int, double)
+
+cdef extern from "Minuit2/MnUserCovariance.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnUserCovariance:
+        double get "operator()"(unsigned int, unsigned int)
+        unsigned int Nrow()
+
+cdef extern from "Minuit2/MnUserParameterState.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnUserParameterState:
+        double Value(unsigned int)
+        double Error(unsigned int)
+        MnUserCovariance& Covariance()
+        bint HasCovariance()
+
+cdef extern from "Minuit2/FunctionMinimum.h" namespace "ROOT::Minuit2":
+    cdef cppclass FunctionMinimum:
+        bint IsValid()
+        double Fval()
+        double Edm()
+        int NFcn()
+        MnUserParameterState& UserState()
+
+cdef extern from "Minuit2/MnMigrad.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnMigrad:
+        MnMigrad(FCNBase&, MnUserParameters&, unsigned int)
+
+cdef extern from "Minuit2/MnHesse.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnHesse:
+        MnHesse(unsigned int)
+        void call "operator()"(FCNBase&, FunctionMinimum&, unsigned int) except +
+
+cdef extern from "Minuit2/MinosError.h" namespace "ROOT::Minuit2":
+    cdef cppclass MinosError:
+        double Lower()
+        double Upper()
+        bint LowerValid()
+        bint UpperValid()
+
+cdef extern from "Minuit2/MnMinos.h" namespace "ROOT::Minuit2":
+    cdef cppclass MnMinos:
+        MnMinos(FCNBase&, FunctionMinimum&, unsigned int)
+
+cdef extern from "PyFCN.h":
+    ctypedef int (*PyFCNCallback)(PyObject*, vector[double]&, double*)
+    cdef cppclass PyFCN(FCNBase):
+        PyFCN(PyObject*, PyFCNCallback, double)
+    FunctionMinimum* RunMigrad(MnMigrad&, unsigned int, double) except +
+    MinosError* RunMinos(MnMinos&, unsigned int, unsigned int, double) except +
+
+
+cdef int _callFunction(PyObject* owner, vector[double]& x, double* value):
+    """ Called by PyFCN for every evaluation. An exception is kept to be raised again after the minimization. """
+    cdef Minuit minuit = <Minuit>owner
+    cdef unsigned int i
+    try:
+        value[0] = minuit.function([x[i] for i in range(x.size())])
+    except:
+        minuit._error = sys.exc_info()
+        return -1
+    return 0
+
+
+cdef class Minuit:
+    """ Minimizes function(values) over the parameters with MIGRAD.
+        names: the parameter names
+        values: the start values
+        errors: the initial step sizes, by default a tenth of the values (or 0.1 for zero values)
+        limits: a (lower, upper) pair for each parameter, either of which may be None for no limit
+        fixed: the indices of the parameters that are kept at their start values
+        up: the change of the function that defines one standard deviation,
+            1.0 for a chi2 and 0.5 for a negative log likelihood
+        strategy: the Minuit strategy, 0 (fast), 1 (default) or 2 (careful)
+        All indices refer to the order of names.
+    """
+    cdef PyFCN* fcn
+    cdef MnUserParameters* parameters
+    cdef FunctionMinimum* minimum
+    cdef readonly object function
+    cdef readonly object names
+    cdef public object _error
+    cdef public unsigned int strategy
+
+    def __cinit__(self, function, names, values, errors=None, limits=None, fixed=(), up=1.0, strategy=1):
+        cdef unsigned int i
+        self.function = function
+        self.names = list(names)
+        self._error = None
+        self.strategy = strategy
+        self.minimum = NULL
+        self.fcn = new PyFCN(<PyObject*>self, <PyFCNCallback>_callFunction, up)
+        self.parameters = new MnUserParameters()
+        values = list(values)
+        if errors is None:
+            errors = [abs(value) * 0.1 or 0.1 for value in values]
+        for i, name in enumerate(self.names):
+            self.parameters.Add(name.encode('ascii'), values[i], errors[i])
+            if limits is not None:
+                lower, upper = limits[i]
+                if lower is not None and upper is not None:
+                    self.parameters.SetLimits(i, lower, upper)
+                elif lower is not None:
+                    self.parameters.SetLowerLimit(i, lower)
+                elif upper is not None:
+                    self.parameters.SetUpperLimit(i, upper)
+        for i in fixed:
+            self.parameters.Fix(i)
+
+    def __dealloc__(self):
+        del self.minimum
+        del self.parameters
+        del self.fcn
+
+    cdef _raiseError(self):
+        error, self._error = self._error, None
+        raise error[0], error[1], error[2]
+
+    cdef _checkMinimum(self):
+        if self.minimum == NULL:
+            raise RuntimeError('migrad has to be run first')
+
+    def migrad(self, unsigned int maxfcn=0, double tolerance=0.1):
+        """ Runs MIGRAD from the start values, returns whether the minimum is valid """
+        cdef MnMigrad* migrad = new MnMigrad(self.fcn[0], self.parameters[0], self.strategy)
+        try:
+            del self.minimum
+            self.minimum = NULL
+            self.minimum = RunMigrad(migrad[0], maxfcn, tolerance)
+        except RuntimeError:
+            if self._error is not None:
+                self._raiseError()
+            raise
+        finally:
+            del migrad
+        return self.minimum.IsValid()
+
+    def hesse(self, unsigned int maxcalls=0):
+        """ Recomputes the covariance matrix at the minimum from the second derivatives """
+        self._checkMinimum()
+        cdef MnHesse* hesse = new MnHesse(self.strategy)
+        try:
+            hesse.call(self.fcn[0], self.minimum[0], maxcalls)
+        except RuntimeError:
+            if self._error is not None:
+                self._raiseError()
+            raise
+        finally:
+            del hesse
+        return self.minimum.IsValid()
+
+    def minos(self, unsigned int index, unsigned int maxcalls=0, double tolerance=0.1):
+        """ Returns (lower, upper, valid) for the parameter with the given index.
+            lower is negative, i.e. the interval is [value + lower, value + upper].
+        """
+        self._checkMinimum()
+        cdef MnMinos* minos = new MnMinos(self.fcn[0], self.minimum[0], self.strategy)
+        cdef MinosError* error = NULL
+        try:
+            error = RunMinos(minos[0], index, maxcalls, tolerance)
+            return error.Lower(), error.Upper(), error.LowerValid() and error.UpperValid()
+        except RuntimeError:
+            if self._error is not None:
+                self._raiseError()
+            raise
+        finally:
+            del error
+            del minos
+
+    property values:
+        def __get__(self):
+            self._checkMinimum()
+            cdef unsigned int i
+            return [self.minimum.UserState().Value(i) for i in range(len(self.names))]
+
+    property errors:
+        def __get__(self):
+            self._checkMinimum()
+            cdef unsigned int i
+            return [self.minimum.UserState().Error(i) for i in range(len(self.names))]
+
+    property covariance:
+        """ The covariance matrix of the parameters that are not fixed, as a list of rows """
+        def __get__(self):
+            self._checkMinimum()
+            if not self.minimum.UserState().HasCovariance():
+                return None
+            cdef unsigned int i, j
+            cdef unsigned int n = self.minimum.UserState().Covariance().Nrow()
+            return [[self.minimum.UserState().Covariance().get(i, j) for j in range(n)] for i in range(n)]
+
+    property fval:
+        def __get__(self):
+            self._checkMinimum()
+            return self.minimum.Fval()
+
+    property edm:
+        def __get__(self):
+            self._checkMinimum()
+            return self.minimum.Edm()
+
+    property nfcn:
+        def __get__(self):
+            self._checkMinimum()
+            return self.minimum.NFcn()
+
+    property isValid:
+        def __get__(self):
+            return self.minimum != NULL and self.minimum.IsValid()
@@ -1,17 +1,22 @@
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Distutils import build_ext
+import os
+
+# the Minuit2 installation, with include/Minuit2 and lib/libMinuit2
+minuit2 = os.environ.get('MINUIT2_DIR', '/opt/Minuit2')
 
 setup(
-  name = 'PyMinui2',
-  ext_modules=[ 
+  name = 'PyMinuit2',
+  ext_modules=[
     Extension(
-        "pyMinuit"
+        "pyMinuit2"
       , ["pyMinuit2.pyx"]
       , language='c++'
+      , include_dirs=['.', os.path.join(minuit2, 'include')]
+      , library_dirs=[os.path.join(minuit2, 'lib')]
+      , libraries=['Minuit2']
     ),
     ],
   cmdclass = {'build_ext': build_ext},
-  include_dirs=['/Users/jstrube/lib/python2.5/site-packages/numpy/core/include/numpy'
-              , '/opt/Minuit2/include']
 )
@@ -0,0 +1,168 @@
+### Pseudo-experiments: toy datasets generated from a fitted model and fitted again,
+### for pull and coverage studies.
+from IFitter_chi2_scipy import copyEvaluatorParameterSpace, _imapForked
+import IFitter_chi2_scipy
+from compiledModel import numpyFunctions, compileCodelet
+import multiprocessing
+import copy
+import numpy as np
+
+class ToyStudy:
+	### Generates toys of fitData from the model of fitResult and fits them with fitter.
+	### Binned data get Poisson counts around the model at the bin centers.
+	### Unbinned data get as many entries as the data have in the fit range, drawn from the model
+	### by accept-reject in the box spanned by those entries.
+	### Toy i is drawn from RandomState([seed, i]), so each toy is reproducible on its own,
+	### whatever the number of processes.
+	### Each toy is fitted starting from the generating parameters.
+	### run() fills these arrays, with one row per toy and one column per parameter:
+	###   values, errors: the fitted parameters and their parabolic errors
+	###   residuals: values - generating parameters
+	###   pulls: residuals / errors
+	###   minimum: the value of the objective (chi2 or -log likelihood) at the minimum
+	###   status: the fitStatus of each fit, -2 if the fit raised an exception
+	### No IFitResult is kept.
+
+	def __init__(self, fitter, fitData, fitResult, seed = 0):
+		self._fitter = fitter
+		self._fitData = fitter._toFitData(fitData)
+		self._seed = seed
+		generator = fitResult.fittedFunction()
+		self._function = generator._getParentFactory().cloneFunction(generator, inner = True)
+		self._parameterNames = self._function.parameterNames()
+		self.parameters = np.array(fitResult.fittedParameters(), dtype = np.float64)
+		self._function.setParameters(list(self.parameters))
+		self._model = compileCodelet(self._function.codeletString(), self._parameterNames)
+		self._setTemplate()
+
+	def _modelValues(self, x):
+		### The generating model at the points x, with one row per axis.
+		if self._model != None:
+			values = self._model(x, self.parameters)
+		else:
+			space = copyEvaluatorParameterSpace(self._function._innerParameterNameSpace)
+			space.update(numpyFunctions)
+			space['x'] = x
+			values = self._function._getDeriv0Base(space)
+		return np.asarray(values, dtype = np.float64) + np.zeros(x.shape[1:])
+
+	def _setTemplate(self):
+		### The in-range points of the data, and what the toys are drawn from.
+		fitData = self._fitData
+		dimension = fitData.dimension()
+		centers = np.array(fitData._connection[0], dtype = np.float64).reshape((-1, dimension))
+		centers = centers[self._fitter._getRangeMask(fitData, centers)]
+		if len(centers) == 0:
+			raise ValueError('The data have no points in the fit range.')
+		x = np.ascontiguousarray(centers.T)
+		if fitData._binned:
+			self._centers = centers.tolist()
+			self._expected = np.maximum(self._modelValues(x), 0.0)
+		else:
+			self._nEntries = len(centers)
+			self._lower = x.min(axis = 1)
+			self._upper = x.max(axis = 1)
+			### The envelope of the accept-reject: the largest value on the data and on a uniform sample, with a margin.
+			sample = np.random.RandomState([self._seed]).uniform(self._lower[:, None], self._upper[:, None], (dimension, 10000))
+			self._envelope = 1.2 * max(self._modelValues(x).max(), self._modelValues(sample).max())
+			if not self._envelope > 0.0:
+				raise ValueError('The model is not positive in the fit range.')
+
+	def generate(self, index):
+		### Toy number index as an IFitData.
+		toy = copy.copy(self._fitData)
+		if self._fitData._binned:
+			random = np.random.RandomState([self._seed, index])
+			counts = random.poisson(self._expected).astype(np.float64)
+			points = self._centers
+			weights = counts.tolist()
+		else:
+			points = self._drawEntries(index)
+			weights = [1.0] * self._nEntries
+		nPoints = len(points)
+		toy._connection = [points, weights, [None] * nPoints, [None] * nPoints]
+		return toy
+
+	def _drawEntries(self, index):
+		### The entries of toy number index, drawn by accept-reject under the envelope.
+		### A model above the envelope at a drawn point would be cut off: the toy is drawn again
+		### from its first random number with the envelope above that value.
+		### The envelope of the study is not changed, so that each toy depends on its index only.
+		dimension = len(self._lower)
+		envelope = self._envelope
+		while 1:
+			random = np.random.RandomState([self._seed, index])
+			accepted = []
+			nAccepted = 0
+			efficiency = 0.5
+			while nAccepted < self._nEntries:
+				nDraw = max(1000, int(1.2 * (self._nEntries - nAccepted) / efficiency))
+				x = random.uniform(self._lower[:, None], self._upper[:, None], (dimension, nDraw))
+				values = self._modelValues(x)
+				if values.max() > envelope:
+					break
+				keep = random.uniform(0.0, envelope, nDraw) < values
+				efficiency = max(keep.mean(), 1e-3)
+				accepted.append(x[:, keep])
+				nAccepted += keep.sum()
+			if nAccepted >= self._nEntries:
+				return np.concatenate(accepted, axis = 1)[:, :self._nEntries].T.tolist()
+			envelope = 1.2 * values.max()
+
+	def _fitToy(self, context, index):
+		### Generates and fits one toy, and returns its summary.
+		function, setup = context
+		fitter = self._fitter
+		function.setParameters(list(self.parameters))
+		try:
+			toy = self.generate(index)
+			inRangeData = fitter._getInRangeData(toy)
+			fitResult = fitter._fitInRangeData(function, inRangeData, setup, fitter._getFitRange(toy, inRangeData))
+		except Exception:
+			return index, -2, None, None, None
+		if not fitResult._isValid:
+			return index, fitResult._fitStatus, None, None, None
+		return index, fitResult._fitStatus, fitResult._fittedParameters, fitResult._errors, fitResult._minimum
+
+	def run(self, nToys, processes = None):
+		### Generates and fits nToys toys, in a pool of processes unless processes is 1, and fills the result arrays.
+		fitter = self._fitter
+		nParameters = len(self._parameterNames)
+		self.values = np.empty((nToys, nParameters))
+		self.errors = np.empty((nToys, nParameters))
+		self.minimum = np.empty(nToys)
+		self.status = np.empty(nToys, dtype = int)
+		self.values.fill(np.nan)
+		self.errors.fill(np.nan)
+		self.minimum.fill(np.nan)
+
+		### The settings and the model checks are done once, on the first toy.
+		function = self._function
+		setup = fitter._getFitSetup(function)
+		if nToys > 0:
+			state = fitter._setEvaluationState(function, fitter._getInRangeData(self.generate(0)))
+			setup['modelState'] = fitter._getModelState()
+			fitter._restoreEvaluationState(state)
+		context = (function, setup)
+		### The summaries are written into the arrays as the toys are done.
+		if (processes == 1) or IFitter_chi2_scipy._inPoolWorker:
+			summaries = (self._fitToy(context, index) for index in xrange(nToys))
+		else:
+			chunksize = max(1, nToys // (16 * (processes or multiprocessing.cpu_count())))
+			summaries = _imapForked(self._fitToy, context, xrange(nToys), processes, chunksize)
+		for index, status, values, errors, minimum in summaries:
+			self.status[index] = status
+			if values != None:
+				self.values[index] = values
+				if errors != None:
+					self.errors[index] = errors
+				self.minimum[index] = minimum
+		function.setParameters(list(self.parameters))
+
+		self.residuals = self.values - self.parameters
+		olderr = np.seterr(divide = 'ignore', invalid = 'ignore')
+		try:
+			self.pulls = self.residuals / self.errors
+		finally:
+			np.seterr(**olderr)
+		return self
@@ -1,17 +1,20 @@
 # -*- Mode: Python -*-  Not really, but close enough
 
 #cimport definitions
-from math import sqrt, sin, cos
+from libc.math cimport sqrt, sin, cos
 from numpy import asmatrix, zeros
 import numpy as N
 # Numpy must be initialized
 #definitions.import_array()
 
+# The scalar vectors only store their components as C doubles.
+# The numpy representations ('asarray', '_coordinates') are built on demand,
+# so creating a vector and doing arithmetic with it does not allocate any arrays.
+
 cdef class ThreeVector:
     cdef double _x
     cdef double _y
     cdef double _z
-    cdef public _coordinates
 
     def __init__(self, *args):
         if len(args) == 1 and len(args[0]) == 3:
@@ -24,26 +27,54 @@ cdef class ThreeVector:
             raise TypeError, \
                 'A ThreeVector must be initialized with a length-3 array or with three components'
 
-        # coordinates are column vectors
-        self._coordinates = N.matrix(abc, dtype=N.float64).T
         self._x = abc[0]
         self._y = abc[1]
         self._z = abc[2]
 
 
     def mag(self):
-        return sqrt(self.x**2 + self.y**2 + self.z**2)
+        return sqrt(self._dot(self))
 
-    def __getitem__(self, index):
-        return self._coordinates[index] 
+    def mag2(self):
+        return self._dot(self)
+
+    def dot(self, ThreeVector other):
+        return self._dot(other)
+
+    cdef double _dot(self, ThreeVector other):
+        return self._x*other._x + self._y*other._y + self._z*other._z
 
-    def __setitem__(self, index, value):
+    def rotate(self, double phi, double theta, double psi):
+        """ Returns this vector rotated by the Euler angles 'phi', 'theta' and 'psi',
+            as the spatial part of makeRotationMatrix would do it
+        """
+        cdef double r[9]
+        _fillRotation(r, phi, theta, psi)
+        return _newThreeVector(type(self),
+                               r[0]*self._x + r[1]*self._y + r[2]*self._z,
+                               r[3]*self._x + r[4]*self._y + r[5]*self._z,
+                               r[6]*self._x + r[7]*self._y + r[8]*self._z)
+
+    def __getitem__(self, int index):
+        if index < 0:
+            index = index + 3
         if index == 0:
-            x = value
+            return self._x
+        elif index == 1:
+            return self._y
         elif index == 2:
-            y = value
-        elif index == 3:
-            z = value
+            return self._z
+        raise IndexError, 'ThreeVector only has three entries'
+
+    def __setitem__(self, int index, double value):
+        if index < 0:
+            index = index + 3
+        if index == 0:
+            self._x = value
+        elif index == 1:
+            self._y = value
+        elif index == 2:
+            self._z = value
         else:
             raise IndexError, 'ThreeVector only has three entries'
 
@@ -51,27 +82,28 @@ cdef class ThreeVector:
         def __get__(self):
             return self._x
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._x = val
-            self._coordinates[0] = val
 
-    
     property y:
         def __get__(self):
             return self._y
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._y = val
-            self._coordinates[1] = val
-
 
     property z:
         def __get__(self):
             return self._z
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._z = val
-            self._coordinates[2] = val
+
+    property _coordinates:
+        """ The coordinates as a column matrix. This is a new matrix on every access.
+        """
+        def __get__(self):
+            return N.matrix([[self._x], [self._y], [self._z]])
 
 
     def __len__(self):
@@ -80,15 +112,49 @@ cdef class ThreeVector:
     def asarray(self):
         """ Returns the vector as array, so it can be used with the standard numpy methods
         """
-        return self._coordinates.copy()
+        return N.array((self._x, self._y, self._z))
 
     def __add__(self, other):
-        return self.__class__(self.x+other.x, self.y+other.y, self.z+other.z)
+        if not (isinstance(self, ThreeVector) and isinstance(other, ThreeVector)):
+            return NotImplemented
+        cdef ThreeVector a = self, b = other
+        return _newThreeVector(type(a), a._x + b._x, a._y + b._y, a._z + b._z)
+
+    def __sub__(self, other):
+        if not (isinstance(self, ThreeVector) and isinstance(other, ThreeVector)):
+            return NotImplemented
+        cdef ThreeVector a = self, b = other
+        return _newThreeVector(type(a), a._x - b._x, a._y - b._y, a._z - b._z)
+
+    def __neg__(self):
+        return _newThreeVector(type(self), -self._x, -self._y, -self._z)
 
     def __iter__(self):
         """ Returns the iterator over the coordinates. This enables tuple unpacking, e.g. f(*self)
         """
-        return self._coordinates.__iter__()
+        return iter((self._x, self._y, self._z))
+
+    def __reduce__(self):
+        return (type(self), (self._x, self._y, self._z))
+
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (type(self).__name__, self._x, self._y, self._z)
+
+    def __str__(self):
+        return "(%s, %s, %s)" % (self._x, self._y, self._z)
+
+
+cdef ThreeVector _newThreeVector(type cls, double x, double y, double z):
+    # Creates a vector of type 'cls' without going through __init__
+    cdef ThreeVector vec
+    if cls is ThreeVector:
+        vec = ThreeVector.__new__(ThreeVector)
+    else:
+        vec = cls.__new__(cls)
+    vec._x = x
+    vec._y = y
+    vec._z = z
+    return vec
 
 
 
@@ -97,7 +163,7 @@ cdef class LorentzVector:
     cdef double _x
     cdef double _y
     cdef double _z
-    cdef readonly _coordinates
+
     def __init__(self, *args):
         if len(args) == 1 and len(args[0]) == 4:
             # assume we're having an array here
@@ -108,9 +174,7 @@ cdef class LorentzVector:
         else:
             raise TypeError, \
                 'A LorentzVector must be initialized with a length-4 array or with four components'
-        
-        # coordinates are a column vector
-        self._coordinates = N.matrix(abcd, dtype=N.float64).T
+
         self._t = abcd[0]
         self._x = abcd[1]
         self._y = abcd[2]
@@ -118,69 +182,174 @@ cdef class LorentzVector:
 
 
     def norm(self):
-        return sqrt(self.t**2 - self.x**2 - self.y**2 - self.z**2)
+        cdef double norm2 = self._dot(self)
+        if norm2 < 0:
+            raise ValueError, 'math domain error'
+        return sqrt(norm2)
+
+    def norm2(self):
+        return self._dot(self)
+
+    def dot(self, LorentzVector other):
+        """ The Minkowski product with metric (+, -, -, -)
+        """
+        return self._dot(other)
+
+    cdef double _dot(self, LorentzVector other):
+        return self._t*other._t - self._x*other._x - self._y*other._y - self._z*other._z
+
+    def boost(self, double beta_x, double beta_y, double beta_z):
+        """ Returns the coordinates of this vector in a frame that moves with velocity beta,
+            i.e. the product with makeBoostMatrix(beta_x, beta_y, beta_z)
+        """
+        return self._boost(beta_x, beta_y, beta_z)
+
+    cdef LorentzVector _boost(self, double beta_x, double beta_y, double beta_z):
+        cdef double beta2 = beta_x*beta_x + beta_y*beta_y + beta_z*beta_z
+        cdef double gamma, bp, a
+        if beta2 == 0:
+            return _newLorentzVector(type(self), self._t, self._x, self._y, self._z)
+        if beta2 > 1:
+            raise ValueError, \
+                "beta may not have magnitude greater than one, but is %s" % str([beta_x, beta_y, beta_z])
+        gamma = 1.0 / sqrt(1.0 - beta2)
+        bp = beta_x*self._x + beta_y*self._y + beta_z*self._z
+        a = (gamma - 1) * bp / beta2 - gamma * self._t
+        return _newLorentzVector(type(self), gamma * (self._t - bp),
+                                 self._x + a * beta_x, self._y + a * beta_y, self._z + a * beta_z)
+
+    def rotate(self, double phi, double theta, double psi):
+        """ Returns the product with makeRotationMatrix(phi, theta, psi)
+        """
+        cdef double r[9]
+        _fillRotation(r, phi, theta, psi)
+        return _newLorentzVector(type(self), self._t,
+                                 r[0]*self._x + r[1]*self._y + r[2]*self._z,
+                                 r[3]*self._x + r[4]*self._y + r[5]*self._z,
+                                 r[6]*self._x + r[7]*self._y + r[8]*self._z)
+
+
+    def __getitem__(self, int index):
+        if index < 0:
+            index = index + 4
+        if index == 0:
+            return self._t
+        elif index == 1:
+            return self._x
+        elif index == 2:
+            return self._y
+        elif index == 3:
+            return self._z
+        raise IndexError, 'LorentzVector only has four entries'
 
+    def __len__(self):
+        return 4
 
     property t:
         def __get__(self):
             return self._t
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._t = val
-            self._coordinates[0] = val
 
     property x:
         def __get__(self):
             return self._x
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._x = val
-            self._coordinates[1] = val
 
     property y:
         def __get__(self):
             return self._y
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._y = val
-            self._coordinates[2] = val
 
     property z:
         def __get__(self):
             return self._z
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._z = val
-            self._coordinates[3] = val
+
+    property _coordinates:
+        """ The coordinates as a column matrix. This is a new matrix on every access.
+        """
+        def __get__(self):
+            return N.matrix([[self._t], [self._x], [self._y], [self._z]])
+
+    def asarray(self):
+        """ Returns the vector as array, so it can be used with the standard numpy methods
+        """
+        return N.array((self._t, self._x, self._y, self._z))
 
     def v3(self):
-        return ThreeVector(self._coordinates[1:])
+        return _newThreeVector(ThreeVector, self._x, self._y, self._z)
 
     def __add__(self, other):
-        return self.__class__(self.t+other.t, self.x+other.x, self.y+other.y, self.z+other.z)
+        if not (isinstance(self, LorentzVector) and isinstance(other, LorentzVector)):
+            return NotImplemented
+        cdef LorentzVector a = self, b = other
+        return _newLorentzVector(type(a), a._t + b._t, a._x + b._x, a._y + b._y, a._z + b._z)
 
     def __sub__(self, other):
-        return self.__class__(self.t-other.t, self.x-other.x, self.y-other.y, self.z-other.z)        
+        if not (isinstance(self, LorentzVector) and isinstance(other, LorentzVector)):
+            return NotImplemented
+        cdef LorentzVector a = self, b = other
+        return _newLorentzVector(type(a), a._t - b._t, a._x - b._x, a._y - b._y, a._z - b._z)
 
     def __neg__(self):
-        self._coordinates = -self._coordinates
-        self._t = -self._t
-        self._x = -self._x
-        self._y = -self._y
-        self._z = -self._z
-        return self
-        
+        return _newLorentzVector(type(self), -self._t, -self._x, -self._y, -self._z)
 
     def __iter__(self):
         """ Returns the iterator over the coordinates. This enables tuple unpacking, e.g. f(*self)
         """
-        return self._coordinates.__iter__()
-        
+        return iter((self._t, self._x, self._y, self._z))
+
+    def __reduce__(self):
+        return (type(self), (self._t, self._x, self._y, self._z))
+
     def __repr__(self):
-        return "%r" % self._coordinates
+        return "%s(%r, %r, %r, %r)" % (type(self).__name__, self._t, self._x, self._y, self._z)
 
     def __str__(self):
-        return "%s" % self._coordinates
+        return "(%s, %s, %s, %s)" % (self._t, self._x, self._y, self._z)
+
+
+cdef LorentzVector _newLorentzVector(type cls, double t, double x, double y, double z):
+    # Creates a vector of type 'cls' without going through __init__
+    cdef LorentzVector vec
+    if cls is Momentum:
+        vec = Momentum.__new__(Momentum)
+    elif cls is LorentzVector:
+        vec = LorentzVector.__new__(LorentzVector)
+    else:
+        vec = cls.__new__(cls)
+    vec._t = t
+    vec._x = x
+    vec._y = y
+    vec._z = z
+    return vec
+
+
+cdef void _fillRotation(double *r, double phi, double theta, double psi):
+    # The spatial 3x3 block of makeRotationMatrix, row by row
+    cdef double sinph = sin(phi)
+    cdef double cosph = cos(phi)
+    cdef double sinth = sin(theta)
+    cdef double costh = cos(theta)
+    cdef double sinps = sin(psi)
+    cdef double cosps = cos(psi)
+    r[0] =   cosph * costh * cosps - sinph * sinps
+    r[1] = - cosph * costh * sinps - sinph * cosps
+    r[2] =   cosph * sinth
+    r[3] =   sinph * costh * cosps + cosph * sinps
+    r[4] = - sinph * costh * sinps + cosph * cosps
+    r[5] =   sinph * sinth
+    r[6] = -         sinth * cosps
+    r[7] =           sinth * sinps
+    r[8] =           costh
 
 
 
@@ -258,26 +427,116 @@ def makeBoostMatrix(double beta_x, double beta_y, double beta_z):
 
 
 
+def makeBoostMatrices(betas):
+    # Construct a stack of boost matrices.
+    # Returns an (N, 4, 4) array holding, for each row of the (N, 3) array
+    # 'betas', the same matrix as makeBoostMatrix.
+
+    betas = N.asarray(betas, dtype=N.float64)
+    if betas.ndim != 2 or betas.shape[1] != 3:
+        raise TypeError, 'expected an (N, 3) array of velocities, got shape %s' % (betas.shape,)
+    beta2 = N.einsum('ij,ij->i', betas, betas)
+    if (beta2 > 1).any():
+        raise ValueError, \
+            "beta may not have magnitude greater than one, but is %s" % str(betas[beta2 > 1][0])
+    gamma = 1.0 / N.sqrt(1.0 - beta2)
+    # (gamma - 1) / beta2 goes to zero with beta2, which handles the zero-boost rows.
+    factor = N.zeros_like(beta2)
+    moving = beta2 > 0
+    factor[moving] = (gamma[moving] - 1) / beta2[moving]
+
+    matrices = N.empty((betas.shape[0], 4, 4), dtype=N.float64)
+    matrices[:, 0, 0] = gamma
+    matrices[:, 0, 1:] = -gamma[:, None] * betas
+    matrices[:, 1:, 0] = matrices[:, 0, 1:]
+    matrices[:, 1:, 1:] = factor[:, None, None] * betas[:, :, None] * betas[:, None, :]
+    diagonal = N.arange(1, 4)
+    matrices[:, diagonal, diagonal] += 1
+    return matrices
+
+
+def makeRestFrameMatrices(momenta):
+    # Construct the boosts into the rest frames of many particles at once.
+    # 'momenta' is an (N, 4) array of (e, px, py, pz).
+    # Returns the (N, 4, 4) stack of boosts from the lab into each rest frame,
+    # and the stack of their inverses, the boosts with the opposite velocity.
+
+    momenta = N.asarray(momenta, dtype=N.float64)
+    if momenta.ndim != 2 or momenta.shape[1] != 4:
+        raise TypeError, 'expected an (N, 4) array of momenta, got shape %s' % (momenta.shape,)
+    boosts = makeBoostMatrices(momenta[:, 1:] / momenta[:, :1])
+    # Reversing the velocity only flips the sign of the mixed time-space elements.
+    inverses = boosts.copy()
+    inverses[:, 0, 1:] *= -1
+    inverses[:, 1:, 0] *= -1
+    return boosts, inverses
+
+
+# g_mu g_nu for the metric g = diag(1, -1, -1, -1)
+_metricSigns = N.outer([1., -1., -1., -1.], [1., -1., -1., -1.])
+
+def lorentzInverse(transformation):
+    # Invert a Lorentz transformation in closed form.
+    # Any Lorentz transformation L satisfies L^T g L = g, so its inverse is g L^T g.
+    # This is exact and much cheaper than a general matrix inversion.
+    # 'transformation' is a 4x4 matrix or an (N, 4, 4) stack; the result has the same type.
+
+    if isinstance(transformation, N.matrix):
+        return asmatrix(transformation.A.T * _metricSigns)
+    return N.swapaxes(transformation, -1, -2) * _metricSigns
+
+
+
 cdef class Frame:
     """A reference frame."""
     cdef readonly __inverse_matrix
-    cdef readonly __matrix
+    cdef object __matrix
     cdef public __name
+    cdef bint __lorentz
+    # __matrix, row by row, for the scalar fast path of coordinatesOf
+    cdef double __elements[16]
+    cdef bint __hasElements
 
-    def __init__(self, transformation, name=None):
+    def __init__(self, transformation, name=None, inverse=None, lorentz=True):
         # Construct a new reference frame.
         #
         #   'transformation' -- The Lorentz transformation from the lab
         #    frame to the new frame.
         #
         #    'name' -- An optional name for this frame.
+        #
+        #    'inverse' -- The inverse of 'transformation', if it is already known.
+        #
+        #    'lorentz' -- If false, 'transformation' is not assumed to be a Lorentz
+        #    transformation and its inverse is computed numerically.
 
         # Boosting the coordinate system is contravariant.
+        # The inverse is only computed when it is first needed.
         self.__inverse_matrix = transformation
-        self.__matrix = self.__inverse_matrix.I
+        self.__matrix = inverse
+        self.__lorentz = lorentz
         self.__name = name
 
 
+    cdef _getMatrix(self):
+        if self.__matrix is None:
+            if self.__lorentz:
+                self.__matrix = lorentzInverse(self.__inverse_matrix)
+            else:
+                self.__matrix = self.__inverse_matrix.I
+        return self.__matrix
+
+
+    cdef double *_getElements(self):
+        cdef int i
+        if not self.__hasElements:
+            flat = N.asarray(self._getMatrix(), dtype=N.float64).ravel()
+            for i from 0 <= i < 16:
+                self.__elements[i] = flat[i]
+            self.__hasElements = True
+        return self.__elements
+
+
     def __repr__(self):
         if self.__name is None:
             name = "at 0x%x" % id(self)
@@ -295,33 +554,57 @@ cdef class Frame:
 
     def coordinatesOf(self, vector):
         """ Return the four coordinates of 'vector' in this frame.
+            The result has the same type as 'vector'.
         """
-        x = self.__matrix * vector._coordinates
-        vec = LorentzVector(x.A1)
-        # neat little hack to ensure we return the same type that was passed in
-        vec.__class__ == vector.__class__
-        return vec
+        cdef LorentzVector v
+        cdef double *m
+        if isinstance(vector, LorentzVector):
+            v = vector
+            m = self._getElements()
+            return _newLorentzVector(type(v),
+                                     m[0]*v._t + m[1]*v._x + m[2]*v._y + m[3]*v._z,
+                                     m[4]*v._t + m[5]*v._x + m[6]*v._y + m[7]*v._z,
+                                     m[8]*v._t + m[9]*v._x + m[10]*v._y + m[11]*v._z,
+                                     m[12]*v._t + m[13]*v._x + m[14]*v._y + m[15]*v._z)
+        x = self._getMatrix() * vector._coordinates
+        return vector.__class__(x.A1)
 
 
     def boostTo(self, vector):
         return self.coordinatesOf(vector)
 
 
+    def coordinatesOfArray(self, vectors):
+        """ Return the coordinates of many four-vectors in this frame.
+
+            'vectors' -- an (N, 4) array or a LorentzVectorArray.
+
+            returns -- the transformed (N, 4) array, or a container of the same type
+            as 'vectors'. All rows are transformed with a single matrix product.
+        """
+        if isinstance(vectors, LorentzVectorArray):
+            return vectors.__class__(N.dot(vectors._coordinates, self._getMatrix().A.T))
+        return N.dot(N.asarray(vectors, dtype=N.float64), self._getMatrix().A.T)
+
+
+    def boostToArray(self, vectors):
+        return self.coordinatesOfArray(vectors)
+
+
     def makeLorentzVector(self, *args, **kwargs):
         """ creates a four vector with the desired coordinates in this frame
         """
 
         cls = kwargs.get('cls', LorentzVector)
         if len(args) == 1 and len(args[0]) == 4:
-            vec = N.array(args[0])
+            vec = N.asarray(args[0], dtype=N.float64)
         elif len(args) == 4:
-            vec = N.array(args)
+            vec = N.asarray(args, dtype=N.float64)
         else:
             raise AttributeError, \
                 'arguments %s have the wrong shape for %s' % (args, cls.__name__)
-        data = self.__inverse_matrix * vec
-        # return an array, not a matrix
-        return cls(data.A[0])
+        data = N.dot(N.asarray(self.__inverse_matrix), vec.ravel())
+        return cls(data)
 
 
 
@@ -332,7 +615,7 @@ cdef class Frame:
             this frame is 'matrix'.
         """
 
-        return self.__inverse_matrix * matrix * self.__matrix
+        return self.__inverse_matrix * matrix * self._getMatrix()
 
 
     def makeBoost(self, beta_x, beta_y, beta_z):
@@ -355,6 +638,106 @@ cdef class Frame:
         return self.makeTransformation(makeRotationMatrix(phi, theta, psi))
 
 
+cdef class FrameArray:
+    """ A stack of N reference frames.
+        Row i of an array of four-vectors is transformed into frame i, so each
+        candidate can be boosted into its own rest frame in one call.
+    """
+    cdef readonly _inverse_matrices
+    cdef object __matrices
+    cdef bint __lorentz
+
+    def __init__(self, transformations, inverses=None, lorentz=True):
+        # Construct a stack of reference frames.
+        #
+        #   'transformations' -- An (N, 4, 4) array of the Lorentz transformations
+        #    from the lab frame to each of the new frames.
+        #
+        #   'inverses' -- The inverses of 'transformations', if they are already known.
+        #
+        #   'lorentz' -- If false, the inverses are computed numerically rather
+        #    than with lorentzInverse.
+        transformations = N.asarray(transformations, dtype=N.float64)
+        if transformations.ndim != 3 or transformations.shape[1:] != (4, 4):
+            raise TypeError, \
+                'A FrameArray must be initialized with an (N, 4, 4) array, got shape %s' % (transformations.shape,)
+        if inverses is not None:
+            inverses = N.asarray(inverses, dtype=N.float64)
+            if inverses.shape != transformations.shape:
+                raise TypeError, \
+                    'the inverses have shape %s, but the transformations %s' % (inverses.shape, transformations.shape)
+        # Boosting the coordinate system is contravariant.
+        # The inverses are only computed when they are first needed.
+        self._inverse_matrices = transformations
+        self.__matrices = inverses
+        self.__lorentz = lorentz
+
+
+    property _matrices:
+        def __get__(self):
+            if self.__matrices is None:
+                if self.__lorentz:
+                    self.__matrices = lorentzInverse(self._inverse_matrices)
+                else:
+                    self.__matrices = N.linalg.inv(self._inverse_matrices)
+            return self.__matrices
+
+
+    def __len__(self):
+        return self._inverse_matrices.shape[0]
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if self.__matrices is None:
+                return FrameArray(self._inverse_matrices[index], lorentz=self.__lorentz)
+            return FrameArray(self._inverse_matrices[index], self.__matrices[index], self.__lorentz)
+        if self.__matrices is None:
+            return Frame(asmatrix(self._inverse_matrices[index]), lorentz=self.__lorentz)
+        return Frame(asmatrix(self._inverse_matrices[index]), inverse=asmatrix(self.__matrices[index]), lorentz=self.__lorentz)
+
+
+    def __repr__(self):
+        return "<FrameArray of %d frames at 0x%x>" % (len(self), id(self))
+
+
+    def coordinatesOf(self, vectors):
+        """ Return the coordinates of row i of 'vectors' in frame i.
+
+            'vectors' -- an (N, 4) array or a LorentzVectorArray of the same length as this stack.
+
+            returns -- the transformed (N, 4) array, or a container of the same type as 'vectors'.
+        """
+        if isinstance(vectors, LorentzVectorArray):
+            return vectors.__class__(_transformRows(self._matrices, vectors._coordinates))
+        return _transformRows(self._matrices, N.asarray(vectors, dtype=N.float64))
+
+
+    def boostTo(self, vectors):
+        return self.coordinatesOf(vectors)
+
+
+    def makeLorentzVectors(self, vectors):
+        """ The inverse of coordinatesOf: row i of 'vectors' holds coordinates in frame i,
+            the result holds the same four-vectors in the lab frame.
+        """
+        if isinstance(vectors, LorentzVectorArray):
+            return vectors.__class__(_transformRows(self._inverse_matrices, vectors._coordinates))
+        return _transformRows(self._inverse_matrices, N.asarray(vectors, dtype=N.float64))
+
+
+
+def _transformRows(matrices, coordinates):
+    # Multiplies each row of the (N, 4) 'coordinates' by the matching 4x4 matrix of the (N, 4, 4) stack.
+    if coordinates.ndim != 2 or coordinates.shape[1] != 4:
+        raise TypeError, 'expected an (N, 4) array, got shape %s' % (coordinates.shape,)
+    if coordinates.shape[0] != matrices.shape[0]:
+        raise ValueError, \
+            'got %d four-vectors for %d frames' % (coordinates.shape[0], matrices.shape[0])
+    return N.einsum('nij,nj->ni', matrices, coordinates)
+
+
+
 cdef class Momentum(LorentzVector):
     """A momentum four-vector."""
 
@@ -366,9 +749,7 @@ cdef class Momentum(LorentzVector):
 
 
     cdef Frame __get_restFrame(self):
-        cdef double en, px, py, pz
-        en, px, py, pz = self._coordinates
-        return Frame(makeBoostMatrix(-px/en, -py/en, -pz/en))
+        return Frame(makeBoostMatrix(-self._x/self._t, -self._y/self._t, -self._z/self._t))
 
 
     property restFrame:
@@ -380,32 +761,269 @@ cdef class Momentum(LorentzVector):
         def __get__(self):
             return self._t
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._t = val
-            self._coordinates[0] = val
 
     property px:
         def __get__(self):
             return self._x
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._x = val
-            self._coordinates[1] = val
 
     property py:
         def __get__(self):
             return self._y
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._y = val
-            self._coordinates[2] = val
 
     property pz:
         def __get__(self):
             return self._z
 
-        def __set__(self, val):
+        def __set__(self, double val):
             self._z = val
-            self._coordinates[3] = val
-            
-    
+
+
+
+
+cdef class ThreeVectorArray:
+    """ A column-oriented collection of N three-vectors.
+        The coordinates live in one (N, 3) float64 array, so all operations run at numpy speed.
+        Building from an existing array does not copy; the result is a view on it.
+    """
+    cdef readonly _coordinates
+
+    def __init__(self, data, copy=False):
+        if copy:
+            coordinates = N.array(data, dtype=N.float64)
+        else:
+            coordinates = N.asarray(data, dtype=N.float64)
+        if coordinates.ndim != 2 or coordinates.shape[1] != 3:
+            raise TypeError, \
+                'A ThreeVectorArray must be initialized with an (N, 3) array, got shape %s' % (coordinates.shape,)
+        self._coordinates = coordinates
+
+
+    def mag(self):
+        return N.sqrt(N.einsum('ij,ij->i', self._coordinates, self._coordinates))
+
+
+    property x:
+        def __get__(self):
+            return self._coordinates[:, 0]
+
+        def __set__(self, val):
+            self._coordinates[:, 0] = val
+
+    property y:
+        def __get__(self):
+            return self._coordinates[:, 1]
+
+        def __set__(self, val):
+            self._coordinates[:, 1] = val
+
+    property z:
+        def __get__(self):
+            return self._coordinates[:, 2]
+
+        def __set__(self, val):
+            self._coordinates[:, 2] = val
+
+
+    def __len__(self):
+        return self._coordinates.shape[0]
+
+    def __getitem__(self, index):
+        item = self._coordinates[index]
+        if item.ndim == 1:
+            return ThreeVector(item)
+        return self.__class__(item)
+
+    def __iter__(self):
+        for row in self._coordinates:
+            yield ThreeVector(row)
+
+    def asarray(self):
+        """ Returns the (N, 3) coordinate array itself, not a copy
+        """
+        return self._coordinates
+
+    def __add__(self, other):
+        if not isinstance(self, ThreeVectorArray):
+            # the array is on the right hand side
+            return other.__class__(_asCoordinates(self, 3) + other._coordinates)
+        return self.__class__(self._coordinates + _asCoordinates(other, 3))
+
+    def __sub__(self, other):
+        if not isinstance(self, ThreeVectorArray):
+            return other.__class__(_asCoordinates(self, 3) - other._coordinates)
+        return self.__class__(self._coordinates - _asCoordinates(other, 3))
+
+    def __neg__(self):
+        return self.__class__(-self._coordinates)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self._coordinates)
+
+
+
+cdef class LorentzVectorArray:
+    """ A column-oriented collection of N four-vectors (t, x, y, z).
+        The coordinates live in one C-contiguous (N, 4) float64 array.
+        An array that already has this layout is used as is, without copying.
+    """
+    cdef readonly _coordinates
+
+    def __init__(self, data, copy=False):
+        if copy:
+            coordinates = N.array(data, dtype=N.float64, order='C')
+        else:
+            coordinates = N.ascontiguousarray(data, dtype=N.float64)
+        if coordinates.ndim != 2 or coordinates.shape[1] != 4:
+            raise TypeError, \
+                'A %s must be initialized with an (N, 4) array, got shape %s' % (self.__class__.__name__, coordinates.shape)
+        self._coordinates = coordinates
+
+
+    cdef _element(self, row):
+        return LorentzVector(row)
+
+
+    def norm(self):
+        c = self._coordinates
+        return N.sqrt(c[:, 0]**2 - c[:, 1]**2 - c[:, 2]**2 - c[:, 3]**2)
+
+
+    property t:
+        def __get__(self):
+            return self._coordinates[:, 0]
+
+        def __set__(self, val):
+            self._coordinates[:, 0] = val
+
+    property x:
+        def __get__(self):
+            return self._coordinates[:, 1]
+
+        def __set__(self, val):
+            self._coordinates[:, 1] = val
+
+    property y:
+        def __get__(self):
+            return self._coordinates[:, 2]
+
+        def __set__(self, val):
+            self._coordinates[:, 2] = val
+
+    property z:
+        def __get__(self):
+            return self._coordinates[:, 3]
+
+        def __set__(self, val):
+            self._coordinates[:, 3] = val
+
+    def v3(self):
+        """ Returns the spatial components as a ThreeVectorArray that is a view on this array
+        """
+        return ThreeVectorArray(self._coordinates[:, 1:])
+
+
+    def __len__(self):
+        return self._coordinates.shape[0]
+
+    def __getitem__(self, index):
+        item = self._coordinates[index]
+        if item.ndim == 1:
+            return self._element(item)
+        return self.__class__(item)
+
+    def __iter__(self):
+        for row in self._coordinates:
+            yield self._element(row)
+
+    def asarray(self):
+        """ Returns the (N, 4) coordinate array itself, not a copy
+        """
+        return self._coordinates
+
+    def __add__(self, other):
+        if not isinstance(self, LorentzVectorArray):
+            # the array is on the right hand side
+            return other.__class__(_asCoordinates(self, 4) + other._coordinates)
+        return self.__class__(self._coordinates + _asCoordinates(other, 4))
+
+    def __sub__(self, other):
+        if not isinstance(self, LorentzVectorArray):
+            return other.__class__(_asCoordinates(self, 4) - other._coordinates)
+        return self.__class__(self._coordinates - _asCoordinates(other, 4))
+
+    def __neg__(self):
+        return self.__class__(-self._coordinates)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self._coordinates)
+
+
+
+cdef class MomentumArray(LorentzVectorArray):
+    """ A column-oriented collection of N momentum four-vectors (e, px, py, pz)."""
+
+    cdef _element(self, row):
+        return Momentum(row)
+
+
+    property mass:
+        """The invariant masses"""
+        def __get__(self):
+            return self.norm()
+
+    property restFrame:
+        """The rest frames of particles with these momenta, as a FrameArray"""
+        def __get__(self):
+            boosts, inverses = makeRestFrameMatrices(self._coordinates)
+            return FrameArray(inverses, boosts)
+
+    property e:
+        def __get__(self):
+            return self._coordinates[:, 0]
+
+        def __set__(self, val):
+            self._coordinates[:, 0] = val
+
+    property px:
+        def __get__(self):
+            return self._coordinates[:, 1]
+
+        def __set__(self, val):
+            self._coordinates[:, 1] = val
+
+    property py:
+        def __get__(self):
+            return self._coordinates[:, 2]
+
+        def __set__(self, val):
+            self._coordinates[:, 2] = val
+
+    property pz:
+        def __get__(self):
+            return self._coordinates[:, 3]
+
+        def __set__(self, val):
+            self._coordinates[:, 3] = val
+
+
+
+def _asCoordinates(other, int dimension):
+    # Returns the coordinates of 'other' in a form that broadcasts against an (N, dimension) array.
+    # Single vectors are added to every row.
+    if isinstance(other, (ThreeVectorArray, LorentzVectorArray)):
+        return other._coordinates
+    if isinstance(other, (ThreeVector, LorentzVector)):
+        return other.asarray()
+    coordinates = N.asarray(other, dtype=N.float64)
+    if coordinates.shape[-1] != dimension:
+        raise TypeError, \
+            'cannot combine an array of shape %s with %d-vectors' % (coordinates.shape, dimension)
+    return coordinates
@@ -14,6 +14,7 @@
 from __future__ import division
 from math import sqrt, sin, cos, pi, atan2, hypot
 from geometry import ThreeVector, LorentzVector, Frame, Momentum
+from geometry import ThreeVectorArray, LorentzVectorArray, FrameArray
 from numpy import eye, zeros, array, asmatrix
 import numpy as N
 
@@ -47,12 +48,12 @@ class LabFrame(Frame):
         return "lab frame"
 
     def coordinatesOf(self, vector):
-        return self.makeLorentzVector(vector._coordinates)
+        return vector.__class__(*vector)
 
     def getMomentum(self, *args):
         if len(args) == 2:
             vec = [args[0]]
-            vec.extend(args[1]._coordinates)
+            vec.extend(args[1])
             return self.makeLorentzVector(vec, cls=Momentum)
 
 
@@ -62,11 +63,42 @@ lab = LabFrame()
 #-----------------------------------------------------------------------
 # functions
 #-----------------------------------------------------------------------
+# All functions accept single vectors as well as arrays of vectors, i.e.
+# ThreeVectorArrays, LorentzVectorArrays or arrays whose last axis holds
+# the components. Arrays are evaluated with numpy ufuncs and broadcast
+# against each other, so whole samples are processed without a Python loop.
+
+def _spatialComponents(vector):
+    """Return the x, y and z components of one or many three-vectors."""
+
+    if isinstance(vector, (ThreeVector, ThreeVectorArray)):
+        coordinates = vector.asarray()
+    else:
+        coordinates = N.asarray(vector, dtype=N.float64)
+    return coordinates[..., 0], coordinates[..., 1], coordinates[..., 2]
+
+
+def _frameComponents(p4, frame):
+    """Return the t, x, y and z components of one or many four-vectors in 'frame'.
+
+    'frame' may also be a FrameArray, with one frame per four-vector."""
+
+    if isinstance(p4, LorentzVector):
+        return tuple(frame.coordinatesOf(p4))
+    if isinstance(frame, FrameArray):
+        coordinates = frame.coordinatesOf(p4)
+    else:
+        coordinates = frame.coordinatesOfArray(p4)
+    if isinstance(coordinates, LorentzVectorArray):
+        coordinates = coordinates.asarray()
+    return coordinates[..., 0], coordinates[..., 1], coordinates[..., 2], coordinates[..., 3]
+
+
 def angles(vector):
     """Return the polar and azimuthal angles relative to the z axis."""
 
-    x, y, z = vector
-    return atan2(hypot(x, y), z), atan2(y, x)
+    x, y, z = _spatialComponents(vector)
+    return N.arctan2(N.hypot(x, y), z), N.arctan2(y, x)
 
 
 def cosAngle(vector1, vector2=ThreeVector(0, 0, 1)):
@@ -75,7 +107,10 @@ def cosAngle(vector1, vector2=ThreeVector(0, 0, 1)):
     If only one vector is given, returns the cosine of the angle between
     it and the positive z axis."""
 
-    return (N.dot(vector1._coordinates,  vector2._coordinates)) / (vector1.mag() * vector2.mag())
+    x1, y1, z1 = _spatialComponents(vector1)
+    x2, y2, z2 = _spatialComponents(vector2)
+    return (x1 * x2 + y1 * y2 + z1 * z2) \
+           / N.sqrt((x1 * x1 + y1 * y1 + z1 * z1) * (x2 * x2 + y2 * y2 + z2 * z2))
 
 
 def openingAngle(vector1, vector2=ThreeVector(0, 0, 1)):
@@ -84,7 +119,8 @@ def openingAngle(vector1, vector2=ThreeVector(0, 0, 1)):
     If only one vector is given, returns the angle between it and the
     positive z axis."""
 
-    return acos(cosAngle(vector1, vector2))
+    # rounding can push the cosine of (anti)parallel vectors just beyond +-1
+    return N.arccos(N.clip(cosAngle(vector1, vector2), -1.0, 1.0))
 
 
 def twoBodyDecayMomentum(mass_a, mass_b, mass_c):
@@ -95,29 +131,42 @@ def twoBodyDecayMomentum(mass_a, mass_b, mass_c):
     'mass_b', 'mass_c' -- The masses of the decay products.
 
     returns -- The magnitude of the momentum of each the decay products in
-    the rest frame of the decaying particle."""
-
-    if mass_a < mass_b + mass_c:
-        raise ValueError, \
-              "parent's mass cannot be less than sum of children's"
-    return sqrt(  (mass_a - mass_b - mass_c)
-                * (mass_a + mass_b - mass_c)
-                * (mass_a - mass_b + mass_c)
-                * (mass_a + mass_b + mass_c)) / (2 * mass_a)
+    the rest frame of the decaying particle.
+
+    The masses broadcast against each other, e.g. one parent mass against
+    an array of daughter mass hypotheses. For arrays, the result is a
+    masked array in which the entries below threshold are masked; a single
+    decay below threshold raises a ValueError."""
+
+    mass_a = N.asarray(mass_a, dtype=N.float64)
+    mass_b = N.asarray(mass_b, dtype=N.float64)
+    mass_c = N.asarray(mass_c, dtype=N.float64)
+    belowThreshold = mass_a < mass_b + mass_c
+    # clipped at zero, because rounding can make it negative right at threshold
+    product = N.maximum(  (mass_a - mass_b - mass_c)
+                        * (mass_a + mass_b - mass_c)
+                        * (mass_a - mass_b + mass_c)
+                        * (mass_a + mass_b + mass_c), 0.0)
+    if belowThreshold.ndim == 0:
+        if belowThreshold:
+            raise ValueError, \
+                  "parent's mass cannot be less than sum of children's"
+        return sqrt(product) / (2 * mass_a)
+    return N.ma.masked_array(N.sqrt(product) / (2 * mass_a), mask=belowThreshold)
 
 
 def azimuth(p4, frame=lab):
     """Returns the 3D azimuthal angle 'arctan(hypot(x, y) / z)'."""
 
-    t, x, y, z = frame.coordinatesOf(p4)
-    return atan2(sqrt(x * x + y * y), z)
+    t, x, y, z = _frameComponents(p4, frame)
+    return N.arctan2(N.hypot(x, y), z)
 
 
 def cos_azimuth(p4, frame=lab):
     """Returns the cosine of 'azimuth'."""
 
-    t, x, y, z = frame.coordinatesOf(p4)
-    return z / sqrt(x * x + y * y + z * z)
+    t, x, y, z = _frameComponents(p4, frame)
+    return z / N.sqrt(x * x + y * y + z * z)
 
 
 #-----------------------------------------------------------------------
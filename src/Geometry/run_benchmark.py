@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Compares the scalar vectors, which only store C doubles, with the
+    per-instance numpy matrix layout that they used to have
+"""
+from geometry import LorentzVector, Momentum
+import time
+import random
+import numpy as N
+
+n = 100000
+components = [(random.random() + 2, random.random(), random.random(), random.random()) for x in xrange(n)]
+
+start = time.time()
+for c in components:
+    N.matrix(c, dtype=N.float64).T
+matrixConstruction = time.time() - start
+print 'construction, numpy matrix:', matrixConstruction
+
+start = time.time()
+for c in components:
+    LorentzVector(*c)
+construction = time.time() - start
+print 'construction, LorentzVector:', construction, '(%.1fx)' % (matrixConstruction / construction)
+
+matrices = [N.matrix(c, dtype=N.float64).T for c in components]
+start = time.time()
+for a, b in zip(matrices[1:], matrices[:-1]):
+    s = a + b
+    d = a - b
+    m = N.sqrt(s[0, 0]**2 - s[1, 0]**2 - s[2, 0]**2 - s[3, 0]**2)
+matrixArithmetic = time.time() - start
+print 'add, sub, mass, numpy matrix:', matrixArithmetic
+
+vectors = [Momentum(*c) for c in components]
+start = time.time()
+for a, b in zip(vectors[1:], vectors[:-1]):
+    s = a + b
+    d = a - b
+    m = s.mass
+arithmetic = time.time() - start
+print 'add, sub, mass, Momentum:', arithmetic, '(%.1fx)' % (matrixArithmetic / arithmetic)
+
+boost = N.matrix([[1.25, 0, 0, -0.75], [0, 1, 0, 0], [0, 0, 1, 0], [-0.75, 0, 0, 1.25]])
+start = time.time()
+for a in matrices:
+    boost * a
+matrixBoost = time.time() - start
+print 'boost, numpy matrix:', matrixBoost
+
+start = time.time()
+for a in vectors:
+    a.boost(0, 0, 0.6)
+vectorBoost = time.time() - start
+print 'boost, Momentum:', vectorBoost, '(%.1fx)' % (matrixBoost / vectorBoost)
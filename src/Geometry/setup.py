@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-"""Install file for example on how to use Pyrex with Numpy.
+"""Install file for example on how to use Cython with Numpy.
 
 For more details, see:
 http://www.scipy.org/Cookbook/Pyrex_and_NumPy
@@ -9,19 +9,20 @@ http://www.scipy.org/Cookbook/ArrayStruct_and_Pyrex
 from distutils.core import setup
 from distutils.extension import Extension
 
-# Make this usable by people who don't have pyrex installed (I've committed
-# the generated C sources to SVN).
+# Make this usable by people who don't have Cython installed (the generated
+# C sources are committed; regenerate them with "cython geometry.pyx" after
+# changing geometry.pyx or definitions.pxd).
 try:
-    from Pyrex.Distutils import build_ext
-    has_pyrex = True
+    from Cython.Distutils import build_ext
+    has_cython = True
 except ImportError:
-    has_pyrex = False
+    has_cython = False
 
 import numpy
 
-# Define a pyrex-based extension module, using the generated sources if pyrex
+# Define a Cython-based extension module, using the generated sources if Cython
 # is not available.
-if has_pyrex:
+if has_cython:
     pyx_sources = ['geometry.pyx']
     cmdclass    = {'build_ext': build_ext}
 else:
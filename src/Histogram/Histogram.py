@@ -1,4 +1,78 @@
 import numpy as np
+from bisect import bisect_right
+import multiprocessing
+
+
+class Axis(object):
+    """
+    The binning along one dimension.
+    Bin i covers binEdges[i] <= x < binEdges[i+1].
+    """
+    def __init__(self, binEdges):
+        self.binEdges = np.asarray(binEdges, np.float64)
+        # a plain list is much faster than the array for bisecting single values
+        self._edges = self.binEdges.tolist()
+        # with equal bin widths the index follows from arithmetic alone
+        widths = np.diff(self.binEdges)
+        self._uniform = len(widths) > 0 and np.isfinite(self.binEdges).all() \
+            and np.allclose(widths, widths[0], rtol=1e-9, atol=0)
+        if self._uniform:
+            self._inverse_width = 1. / widths[0]
+
+    def bins(self):
+        return len(self.binEdges) - 1
+
+    def find_index(self, x):
+        """
+        Returns the index of the bin that this item would be put into
+        """
+        edges = self._edges
+        # this is also False for NaN
+        if not edges[0] <= x < edges[-1]:
+            return None
+        if self._uniform:
+            i = min(int((x - edges[0]) * self._inverse_width), len(edges) - 2)
+            # rounding can put values right next to an edge into the neighbouring bin
+            if x < edges[i]:
+                return i - 1
+            if x >= edges[i+1]:
+                return i + 1
+            return i
+        return bisect_right(edges, x) - 1
+
+    def find_indices(self, xs):
+        """
+        Returns the bin index for each value in the array xs, or -1 if it is outside of all bins
+        """
+        xs = np.asarray(xs, np.float64)
+        edges = self.binEdges
+        indices = np.empty(xs.shape, np.intp)
+        indices.fill(-1)
+        inside = (xs >= edges[0]) & (xs < edges[-1])
+        xs = xs[inside]
+        if self._uniform:
+            i = ((xs - edges[0]) * self._inverse_width).astype(np.intp)
+            np.minimum(i, len(edges) - 2, out=i)
+            # same correction as in find_index
+            i += (xs >= edges[i+1]).astype(np.intp) - (xs < edges[i])
+        else:
+            i = np.searchsorted(edges, xs, side='right') - 1
+        indices[inside] = i
+        return indices
+
+
+def _as_weights(weights, n):
+    """
+    Returns the weights as a flat array of length n; a single number is used for all entries
+    """
+    weights = np.asarray(weights, np.float64)
+    if weights.ndim == 0:
+        return np.repeat(weights, n)
+    weights = weights.ravel()
+    if len(weights) != n:
+        raise ValueError("Got %d weights for %d values" % (len(weights), n))
+    return weights
+
 
 class Histogram(object):
     """
@@ -20,14 +94,19 @@ class Histogram(object):
         This is the constructor.
         The histogram must be created with the bins edges. (Left edges + the last right edge)
         """
-        self.binEdges = binEdges
+        self.axis = Axis(binEdges)
+        self.binEdges = self.axis.binEdges
         self.entries = np.zeros(len(binEdges)-1, np.int32)
         self.weights = np.zeros(len(binEdges)-1, np.float64)
         self.weights_squared = np.zeros(len(binEdges)-1, np.float64)
         self.torques = np.zeros(len(binEdges)-1, np.float64)
         self.inertials = np.zeros(len(binEdges)-1, np.float64)
+        # running totals over all bins, so that the statistics don't have to sum the bins
+        self.sum_weights = 0.
+        self.sum_torques = 0.
+        self.sum_inertials = 0.
         if data is not None:
-            self.entries=np.histogram(data, binEdges, new=True)[0]
+            self.fill_many(data)
 
 
     def fill(self, x, weight=1.):
@@ -39,42 +118,371 @@ class Histogram(object):
         self.weights_squared[index] += weight*weight
         self.torques[index] += x*weight
         self.inertials[index] += x*x*weight
+        self.sum_weights += weight
+        self.sum_torques += x*weight
+        self.sum_inertials += x*x*weight
         
         
+    def fill_many(self, xs, weights=None):
+        """
+        Fills all values of the array xs at once, optionally with an array of weights.
+        This is equivalent to calling fill for each value, but runs at numpy speed.
+        """
+        xs = np.asarray(xs, np.float64).ravel()
+        if weights is not None:
+            weights = _as_weights(weights, len(xs))
+        # work in chunks so the temporaries stay small for very large inputs
+        for start in range(0, len(xs), self._chunksize):
+            chunk = slice(start, start + self._chunksize)
+            if weights is None:
+                self._fill_chunk(xs[chunk], None)
+            else:
+                self._fill_chunk(xs[chunk], weights[chunk])
+
+    _chunksize = 1 << 20
+
+    def _fill_chunk(self, xs, weights):
+        nbins = len(self.entries)
+        indices = self.find_indices(xs)
+        inside = indices >= 0
+        indices = indices[inside]
+        xs = xs[inside]
+        counts = np.bincount(indices, minlength=nbins)
+        self.entries += counts.astype(self.entries.dtype)
+        if weights is None:
+            self.weights += counts
+            self.weights_squared += counts
+            xw = xs
+            self.sum_weights += len(xs)
+        else:
+            weights = weights[inside]
+            self.weights += np.bincount(indices, weights, minlength=nbins)
+            self.weights_squared += np.bincount(indices, weights*weights, minlength=nbins)
+            xw = xs*weights
+            self.sum_weights += weights.sum()
+        xxw = xs*xw
+        self.torques += np.bincount(indices, xw, minlength=nbins)
+        self.inertials += np.bincount(indices, xxw, minlength=nbins)
+        self.sum_torques += xw.sum()
+        self.sum_inertials += xxw.sum()
+
+
     def find_index(self, x):
         """
         Returns the index of the bin that this item would be put into
         """
-        if x < self.binEdges[0]:
-            return None
-        # we shift the index of the binEgdes by starting at 1
-        # thats why we return i rather than i-1
-        for i, edge in enumerate(self.binEdges[1:]):
-            if x < edge:
-                return i
+        return self.axis.find_index(x)
+
+
+    def find_indices(self, xs):
+        """
+        Returns the bin index for each value in the array xs, or -1 if it is outside of all bins
+        """
+        return self.axis.find_indices(xs)
+
+    def _update_totals(self):
+        """
+        Recomputes the running totals from the bins,
+        for histograms whose bins were set directly rather than filled
+        """
+        self.sum_weights = self.weights.sum()
+        self.sum_torques = self.torques.sum()
+        self.sum_inertials = self.inertials.sum()
 
-    def _compute_rms(self):
-        return sum(self.torques)
-        
     def _compute_mean(self):
-        return sum(self.entries)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.true_divide(self.sum_torques, self.sum_weights)
+
+    def _compute_variance(self):
+        mean = self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # rounding can make the difference slightly negative for a narrow distribution
+            return np.maximum(np.true_divide(self.sum_inertials, self.sum_weights) - mean*mean, 0.)
+
+    def _compute_rms(self):
+        return np.sqrt(self.variance)
+
+    mean = property(_compute_mean, doc="The weighted mean of all entries in the bins, nan if there are none")
+
+    variance = property(_compute_variance, doc="The weighted variance of all entries in the bins, nan if there are none")
 
-    rms = property(_compute_rms, doc="The root mean square is defined as")
+    rms = property(_compute_rms, doc="The root mean square deviation from the mean, i.e. the square root of the variance")
 
-    mean = property(_compute_mean, doc="The mean value of all entries")
+    def _check_compatible(self, other):
+        if not np.array_equal(self.binEdges, other.binEdges):
+            raise ValueError("The bin edges must be the same for both histograms")
+
+    def _empty_copy(self):
+        return Histogram(self.binEdges)
 
     def __add__(self, other):
-        if not all(self.binEdges == other.binEdges):
-            print "ERROR! The bin egdes must be the same for both histograms"
-            return
-        h = Histogram(self.binEdges)
-        h.entries = self.entries + other.entries
-        h.weights = self.weights + other.weights
-        h.weights_squared = self.weights_squared + other.weights_squared
-        raise NotImplementedError, "The weights are not yet dealt with properly"
+        """
+        Merges two histograms with the same binning. All accumulators are added,
+        so the result is exactly what filling one histogram with both inputs gives.
+        """
+        h = self._empty_copy()
+        h += self
+        h += other
         return h
-        
+
+    def __iadd__(self, other):
+        self._check_compatible(other)
+        self.entries += other.entries
+        self.weights += other.weights
+        self.weights_squared += other.weights_squared
+        self.torques += other.torques
+        self.inertials += other.inertials
+        self.sum_weights = self.sum_weights + other.sum_weights
+        self.sum_torques = self.sum_torques + other.sum_torques
+        self.sum_inertials = self.sum_inertials + other.sum_inertials
+        return self
 
     def ks_test():
         raise NotImplementedError, "Implementing a KS test may require depending on scipy"
 
+
+
+class HistogramND(object):
+    """
+    A histogram in any number of dimensions, with the same bookkeeping as Histogram.
+    Bin (i, j, ...) covers binEdges[0][i] <= x_0 < binEdges[0][i+1], binEdges[1][j] <= x_1 < ...
+    Entries outside of the bins are not counted.
+    The accumulators are dense arrays with one axis per dimension.
+    torques and inertials have an additional first axis with one entry per dimension,
+    i.e. torques[d] is the sum of w*x_d and inertials[d] the sum of w*x_d**2 in each bin.
+    mean, variance and rms are arrays with one entry per dimension.
+    """
+    def __init__(self, binEdges, data=None, weights=None):
+        """
+        The histogram is created with a sequence of bin edges for each dimension.
+        data is an optional (N, D) array to fill with.
+        """
+        self.axes = [Axis(edges) for edges in binEdges]
+        self.binEdges = [axis.binEdges for axis in self.axes]
+        shape = tuple(axis.bins() for axis in self.axes)
+        self.entries = np.zeros(shape, np.int32)
+        self.weights = np.zeros(shape, np.float64)
+        self.weights_squared = np.zeros(shape, np.float64)
+        self.torques = np.zeros((len(shape),) + shape, np.float64)
+        self.inertials = np.zeros((len(shape),) + shape, np.float64)
+        self.sum_weights = 0.
+        self.sum_torques = np.zeros(len(shape), np.float64)
+        self.sum_inertials = np.zeros(len(shape), np.float64)
+        if data is not None:
+            self.fill_many(data, weights)
+
+
+    def dimension(self):
+        return len(self.axes)
+
+
+    def _check_compatible(self, other):
+        if len(self.binEdges) != len(other.binEdges) or \
+           not all(np.array_equal(a, b) for a, b in zip(self.binEdges, other.binEdges)):
+            raise ValueError("The bin edges must be the same for both histograms")
+
+    def _empty_copy(self):
+        return HistogramND(self.binEdges)
+
+    __add__ = Histogram.__add__.im_func
+
+    __iadd__ = Histogram.__iadd__.im_func
+
+    def _update_totals(self):
+        dimension = len(self.axes)
+        self.sum_weights = self.weights.sum()
+        self.sum_torques = self.torques.reshape(dimension, -1).sum(axis=1)
+        self.sum_inertials = self.inertials.reshape(dimension, -1).sum(axis=1)
+
+    mean = Histogram.mean
+
+    variance = Histogram.variance
+
+    rms = Histogram.rms
+
+
+    def fill(self, x, weight=1.):
+        """
+        Fills one point; x is a sequence with one coordinate per dimension
+        """
+        if len(x) != len(self.axes):
+            raise ValueError("Got %d coordinates for a %d-dimensional histogram" % (len(x), len(self.axes)))
+        index = []
+        for axis, xd in zip(self.axes, x):
+            i = axis.find_index(xd)
+            if i is None:
+                return
+            index.append(i)
+        index = tuple(index)
+        self.entries[index] += 1
+        self.weights[index] += weight
+        self.weights_squared[index] += weight*weight
+        for d, xd in enumerate(x):
+            self.torques[(d,) + index] += xd*weight
+            self.inertials[(d,) + index] += xd*xd*weight
+            self.sum_torques[d] += xd*weight
+            self.sum_inertials[d] += xd*xd*weight
+        self.sum_weights += weight
+
+
+    def fill_many(self, data, weights=None):
+        """
+        Fills all rows of the (N, D) array data at once, optionally with an array of weights.
+        This is equivalent to calling fill for each row, but runs at numpy speed.
+        """
+        data = np.asarray(data, np.float64)
+        if data.ndim != 2 or data.shape[1] != len(self.axes):
+            raise ValueError("Expected an (N, %d) array, got shape %s" % (len(self.axes), data.shape))
+        if weights is not None:
+            weights = _as_weights(weights, len(data))
+        for start in range(0, len(data), Histogram._chunksize):
+            chunk = slice(start, start + Histogram._chunksize)
+            if weights is None:
+                self._fill_chunk(data[chunk], None)
+            else:
+                self._fill_chunk(data[chunk], weights[chunk])
+
+
+    def _fill_chunk(self, data, weights):
+        shape = self.entries.shape
+        size = self.entries.size
+        indices = [axis.find_indices(data[:, d]) for d, axis in enumerate(self.axes)]
+        inside = np.logical_and.reduce([i >= 0 for i in indices])
+        # one bincount over the flattened bins fills all dimensions at once
+        flat = np.ravel_multi_index(tuple(i[inside] for i in indices), shape)
+        data = data[inside]
+        counts = np.bincount(flat, minlength=size).reshape(shape)
+        self.entries += counts.astype(self.entries.dtype)
+        if weights is None:
+            self.weights += counts
+            self.weights_squared += counts
+            self.sum_weights += len(data)
+        else:
+            weights = weights[inside]
+            self.weights += np.bincount(flat, weights, minlength=size).reshape(shape)
+            self.weights_squared += np.bincount(flat, weights*weights, minlength=size).reshape(shape)
+            self.sum_weights += weights.sum()
+        for d in range(len(self.axes)):
+            xs = data[:, d]
+            if weights is not None:
+                xw = xs*weights
+            else:
+                xw = xs
+            xxw = xs*xw
+            self.torques[d] += np.bincount(flat, xw, minlength=size).reshape(shape)
+            self.inertials[d] += np.bincount(flat, xxw, minlength=size).reshape(shape)
+            self.sum_torques[d] += xw.sum()
+            self.sum_inertials[d] += xxw.sum()
+
+
+    def projection(self, axes):
+        """
+        Sums over all dimensions except the given ones.
+        For a single axis the result is a Histogram, otherwise a HistogramND with the axes in the given order.
+        """
+        if isinstance(axes, int):
+            axes = [axes]
+        axes = list(axes)
+        others = tuple(d for d in range(len(self.axes)) if d not in axes)
+        # after summing, the remaining dimensions are in increasing order
+        order = [sorted(axes).index(d) for d in axes]
+        def project(values):
+            return np.transpose(values.sum(axis=others), order)
+        def project_moments(values):
+            return np.array([project(values[d]) for d in axes])
+        if len(axes) == 1:
+            h = Histogram(self.binEdges[axes[0]])
+        else:
+            h = HistogramND([self.binEdges[d] for d in axes])
+        h.entries = project(self.entries)
+        h.weights = project(self.weights)
+        h.weights_squared = project(self.weights_squared)
+        if len(axes) == 1:
+            h.torques = project(self.torques[axes[0]])
+            h.inertials = project(self.inertials[axes[0]])
+        else:
+            h.torques = project_moments(self.torques)
+            h.inertials = project_moments(self.inertials)
+        h._update_totals()
+        return h
+
+
+    def slice(self, axis, index):
+        """
+        Returns the entries in bin 'index' along 'axis' as a histogram with one dimension less.
+        entries, weights and weights_squared are views into this histogram, so no data is copied.
+        torques and inertials are views as well if 'axis' is the first or the last dimension.
+        """
+        dimension = len(self.axes)
+        bins = [slice(None)] * dimension
+        bins[axis] = index
+        bins = tuple(bins)
+        others = [d for d in range(dimension) if d != axis]
+        if axis == 0:
+            moments = slice(1, None)
+        elif axis == dimension - 1:
+            moments = slice(None, -1)
+        else:
+            moments = others
+        if len(others) == 1:
+            h = Histogram(self.binEdges[others[0]])
+            h.torques = self.torques[(others[0],) + bins]
+            h.inertials = self.inertials[(others[0],) + bins]
+        else:
+            h = HistogramND([self.binEdges[d] for d in others])
+            h.torques = self.torques[moments][(slice(None),) + bins]
+            h.inertials = self.inertials[moments][(slice(None),) + bins]
+        h.entries = self.entries[bins]
+        h.weights = self.weights[bins]
+        h.weights_squared = self.weights_squared[bins]
+        h._update_totals()
+        return h
+
+
+
+# The input of fill_parallel, set in each worker process.
+# With fork the workers share the parent's arrays instead of receiving copies.
+_parallel_input = None
+
+def _init_parallel_fill(template, data, weights):
+    global _parallel_input
+    _parallel_input = (template, data, weights)
+
+def _fill_range(bounds):
+    template, data, weights = _parallel_input
+    start, stop = bounds
+    h = template._empty_copy()
+    if weights is None:
+        h.fill_many(data[start:stop])
+    else:
+        h.fill_many(data[start:stop], weights[start:stop])
+    return h
+
+
+def fill_parallel(histogram, data, weights=None, processes=None, chunks=None):
+    """
+    Fills histogram (a Histogram or a HistogramND) with data in a pool of processes.
+    Each worker fills its own histogram from a range of rows,
+    and the partial histograms are merged into histogram, which is also returned.
+    processes defaults to the number of CPUs, chunks to four ranges per process.
+    """
+    data = np.asarray(data, np.float64)
+    if weights is not None:
+        weights = _as_weights(weights, len(data))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunks is None:
+        chunks = 4 * processes
+    bounds = np.linspace(0, len(data), chunks + 1).astype(int)
+    ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    pool = multiprocessing.Pool(processes, _init_parallel_fill, (histogram._empty_copy(), data, weights))
+    try:
+        for h in pool.imap_unordered(_fill_range, ranges):
+            histogram += h
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return histogram
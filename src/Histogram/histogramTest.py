@@ -1,6 +1,6 @@
 import numpy as np
 
-from Histogram import Histogram
+from Histogram import Histogram, HistogramND, fill_parallel
 """
 This test suit ensures sane properties of the histogram classes.
 We start out with a simple comparison with numpy
@@ -10,7 +10,7 @@ bins = np.concatenate([-np.random.random_sample(5), np.random.random_sample(5)])
 bins.sort()
 
 #for comparison
-npHist = np.histogram(data, bins, new=True)
+npHist = np.histogram(data, bins)
 
 
 def test_constructor():
@@ -44,3 +44,123 @@ def test_methods():
         assert b == bins[i]
         assert b == npHist[1][i]
 
+
+
+def test_fill_many():
+    uniform = np.linspace(-2, 2, 41)
+    for edges in [bins, uniform]:
+        weights = np.random.random_sample(len(data))
+        h1 = Histogram(edges)
+        h2 = Histogram(edges)
+        for d, w in zip(data, weights):
+            h1.fill(d, w)
+        h2.fill_many(data, weights)
+        assert (h1.entries == h2.entries).all()
+        for a, b in [(h1.weights, h2.weights), (h1.weights_squared, h2.weights_squared),
+                     (h1.torques, h2.torques), (h1.inertials, h2.inertials)]:
+            assert np.allclose(a, b)
+
+
+def test_find_index():
+    uniform = np.linspace(-2, 2, 41)
+    h = Histogram(uniform)
+    # values on the edges belong to the bin on their right
+    for i, edge in enumerate(uniform[:-1]):
+        assert h.find_index(edge) == i
+    assert h.find_index(uniform[-1]) is None
+    assert h.find_index(-2.5) is None
+    assert h.find_index(np.nan) is None
+    assert list(h.find_indices(uniform)) == range(40) + [-1]
+
+
+def test_histogramND():
+    points = np.random.randn(2000, 3)
+    weights = np.random.random_sample(len(points))
+    edges = [np.linspace(-2, 2, 11), bins, np.linspace(-1, 3, 5)]
+    h1 = HistogramND(edges)
+    for p, w in zip(points, weights):
+        h1.fill(p, w)
+    h2 = HistogramND(edges, points, weights)
+    assert (h1.entries == h2.entries).all()
+    assert np.allclose(h1.weights_squared, h2.weights_squared)
+    assert np.allclose(h1.torques, h2.torques)
+    assert np.allclose(h1.inertials, h2.inertials)
+
+    # the projection on x equals a 1D histogram of the points inside the y and z ranges
+    inside = (points[:, 1] >= bins[0]) & (points[:, 1] < bins[-1]) & (points[:, 2] >= -1) & (points[:, 2] < 3)
+    hx = Histogram(edges[0])
+    hx.fill_many(points[inside, 0], weights[inside])
+    px = h2.projection(0)
+    assert (px.entries == hx.entries).all()
+    assert np.allclose(px.torques, hx.torques)
+    pzx = h2.projection([2, 0])
+    assert pzx.entries.shape == (4, 10)
+    assert (pzx.entries.sum(axis=0) == hx.entries).all()
+    assert np.allclose(pzx.torques[1].sum(axis=0), hx.torques)
+
+    # slices are views
+    s = h2.slice(2, 1)
+    assert s.entries.shape == (10, len(bins) - 1)
+    assert np.may_share_memory(s.entries, h2.entries)
+    assert np.may_share_memory(s.torques, h2.torques)
+    assert (s.entries == h2.entries[:, :, 1]).all()
+    assert np.allclose(h2.slice(1, 3).torques[1], h2.torques[2][:, 3, :])
+
+
+def test_merge():
+    weights = np.random.random_sample(len(data))
+    h = Histogram(bins)
+    h.fill_many(data, weights)
+    h1 = Histogram(bins)
+    h2 = Histogram(bins)
+    h1.fill_many(data[:3000], weights[:3000])
+    h2.fill_many(data[3000:], weights[3000:])
+    merged = h1 + h2
+    assert (merged.entries == h.entries).all()
+    for a, b in [(merged.weights, h.weights), (merged.weights_squared, h.weights_squared),
+                 (merged.torques, h.torques), (merged.inertials, h.inertials)]:
+        assert np.allclose(a, b)
+    try:
+        h1 + Histogram(bins[1:])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("histograms with different binning must not be merged")
+
+
+def test_fill_parallel():
+    weights = np.random.random_sample(len(data))
+    h = Histogram(bins)
+    h.fill_many(data, weights)
+    hp = fill_parallel(Histogram(bins), data, weights, processes=2)
+    assert (hp.entries == h.entries).all()
+    assert np.allclose(hp.inertials, h.inertials)
+    points = np.random.randn(5000, 2)
+    edges = [bins, np.linspace(-2, 2, 9)]
+    hnd = fill_parallel(HistogramND(edges), points, processes=2, chunks=7)
+    assert (hnd.entries == HistogramND(edges, points).entries).all()
+
+
+def test_statistics():
+    weights = np.random.random_sample(len(data))
+    h = Histogram(bins)
+    h.fill_many(data[:5000], weights[:5000])
+    for x, w in zip(data[5000:], weights[5000:]):
+        h.fill(x, w)
+    inside = (data >= bins[0]) & (data < bins[-1])
+    mean = np.average(data[inside], weights=weights[inside])
+    variance = np.average((data[inside] - mean)**2, weights=weights[inside])
+    assert np.allclose(h.mean, mean)
+    assert np.allclose(h.variance, variance)
+    assert np.allclose(h.rms, np.sqrt(variance))
+    assert np.isnan(Histogram(bins).mean)
+    merged = h + h
+    assert np.allclose(merged.mean, mean)
+    assert np.allclose(merged.rms, h.rms)
+    points = np.random.randn(5000, 2)
+    hnd = HistogramND([bins, np.linspace(-2, 2, 9)], points)
+    projection = hnd.projection(1)
+    inside = (np.abs(points[:, 1]) < 2) & (points[:, 0] >= bins[0]) & (points[:, 0] < bins[-1])
+    assert np.allclose(projection.mean, points[inside, 1].mean())
+    assert np.allclose(hnd.mean[1], projection.mean)
+    assert np.allclose(hnd.rms, points[inside].std(axis=0))
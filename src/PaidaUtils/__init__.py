@@ -1,3 +1,2 @@
 from paidaUtils import *
-
-
+from columnCache import ColumnCache
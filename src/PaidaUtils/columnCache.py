@@ -0,0 +1,200 @@
+""" A cache of tuple columns on disk, so that repeated extractions of the same column
+    are read back as memory-mapped arrays instead of walking the tuple again.
+"""
+from paidaUtils import paida, tupleColumns2arrays
+import numpy as N
+import hashlib
+import os
+import tempfile
+
+# locking is only available on POSIX; without it concurrent jobs may extract the same column twice
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _defaultDirectory():
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'heppy', 'columns')
+
+
+def _columnName(column):
+    if isinstance(column, basestring):
+        return column
+    return column.expression()
+
+
+class _Lock(object):
+    """ An exclusive lock on a file, held between acquire and release"""
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+
+class ColumnCache(object):
+    """ Caches columns extracted from tuples as .npy files in a directory.
+        A column is identified by the path, modification time and size of the file,
+        the name of the tuple, the column name or evaluator expression and the filter expression,
+        so that a changed file or a different cut makes a new entry.
+        Cached columns are returned as read-only memory-mapped arrays.
+        When the files take more than maxBytes the least recently used ones are removed.
+        Several processes may share the directory: each entry is filled by one of them under a lock
+        and appears atomically, entries that are being read can be removed safely.
+    """
+
+    def __init__(self, directory=None, maxBytes=1 << 32):
+        if directory is None:
+            directory = _defaultDirectory()
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another job may have created it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+
+    def key(self, fileName, tupleName, column, filt=None):
+        """ Returns the name of the cache entry for the column"""
+        fileName = os.path.realpath(fileName)
+        status = os.stat(fileName)
+        parts = [fileName, repr(status.st_mtime), str(status.st_size), tupleName, _columnName(column)]
+        if filt:
+            parts.append(filt.expression())
+        return hashlib.sha1('\0'.join(parts)).hexdigest()
+
+
+    def _path(self, key, extension='.npy'):
+        return os.path.join(self.directory, key + extension)
+
+
+    def _load(self, key):
+        """ Returns the cached column or None, and marks it as recently used"""
+        path = self._path(key)
+        try:
+            array = N.load(path, mmap_mode='r')
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return array
+
+
+    def _store(self, key, array):
+        """ Writes the array to a temporary file and moves it into place, so readers never see a partial file"""
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            f = os.fdopen(handle, 'wb')
+            try:
+                N.save(f, array)
+            finally:
+                f.close()
+            os.rename(temporary, self._path(key))
+        except:
+            os.remove(temporary)
+            raise
+
+
+    def columns(self, fileName, tupleName, columns, filt=None):
+        """ Returns a dict of the columns of the tuple in the file, keyed by column name.
+            columns: sequence of column names and/or IEvaluator objects, as for tupleColumns2arrays
+            filt: IFilter object
+            Columns that are not cached yet are extracted together in one pass over the tuple.
+        """
+        keys = dict((_columnName(column), self.key(fileName, tupleName, column, filt)) for column in columns)
+        result = {}
+        for name, key in keys.items():
+            array = self._load(key)
+            if array is not None:
+                result[name] = array
+        missing = [column for column in columns if _columnName(column) not in result]
+        if missing:
+            # one lock for all missing columns, so that concurrent jobs wait for each other instead of extracting twice
+            lock = _Lock(self._path(keys[_columnName(missing[0])], '.lock'))
+            lock.acquire()
+            try:
+                stillMissing = []
+                for column in missing:
+                    array = self._load(keys[_columnName(column)])
+                    if array is None:
+                        stillMissing.append(column)
+                    else:
+                        result[_columnName(column)] = array
+                if stillMissing:
+                    tree = paida.treeFactory.create(fileName, readOnly=True)
+                    try:
+                        arrays = tupleColumns2arrays(tree.find(tupleName), stillMissing, filt)
+                    finally:
+                        tree.close()
+                    for name, array in arrays.items():
+                        self._store(keys[name], array)
+                    self.evict(keep=[keys[name] for name in arrays])
+                    for name, array in arrays.items():
+                        # prefer the mapped file, but an entry that does not fit into the cache is returned as is
+                        mapped = self._load(keys[name])
+                        result[name] = array if mapped is None else mapped
+            finally:
+                lock.release()
+        return result
+
+
+    def column(self, fileName, tupleName, column, filt=None):
+        """ Returns a single column, see columns"""
+        return self.columns(fileName, tupleName, [column], filt)[_columnName(column)]
+
+
+    def evict(self, keep=()):
+        """ Removes the least recently used entries until the cache fits into maxBytes.
+            The entries in keep are only removed if they do not fit on their own.
+            The .lock files are left alone: another job may hold or wait for one,
+            and a new file in its place would not lock against it. They are empty.
+        """
+        lock = _Lock(os.path.join(self.directory, '.evict.lock'))
+        lock.acquire()
+        try:
+            keep = set(self._path(key) for key in keep)
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                # kept entries sort last, so they go only when everything else is gone
+                entries.append((path in keep, status.st_mtime, status.st_size, path))
+            entries.sort()
+            total = sum(size for kept, used, size, path in entries)
+            for kept, used, size, path in entries:
+                if total <= self.maxBytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        finally:
+            lock.release()
+
+
+    def clear(self):
+        """ Removes all entries"""
+        maxBytes, self.maxBytes = self.maxBytes, -1
+        try:
+            self.evict()
+        finally:
+            self.maxBytes = maxBytes
@@ -1,30 +1,39 @@
 #!/usr/bin/env python
-""" 
+"""
     mergeTuples.py
     takes a list of tuples to merge and writes them all into the same tree
     similar to the cp and mv commands, the last argument is the name of the targetFile
-    TODO: use optparse to allow a list of tuples in each file
+    TODO: allow a list of tuples in each file
 
+    By default the tuples are chained and copied when the target tree is committed.
+    With --parallel the input trees are read ahead in a pool of processes and their rows are
+    streamed into the target in chunks, with only a few chunks per process in memory.
+    Many inputs are merged as a tree of merges:
+    groups of --fan-in files are merged into intermediate files in parallel,
+    then those are merged, until one merge into the target is left.
 
-    usage: mergeTuples.py <tuplename> <filename1 [, filename2, ...]> <targetname>
+    usage: mergeTuples.py [options] <tuplename> <filename1 [, filename2, ...]> <targetname>
 """
-import paida.paida_gui.PGuiSelector
-paida.paida_gui.PGuiSelector.setGuiEngineName('batch')
-
-from paida import IAnalysisFactory
+from paidaUtils import paida, iter_chunks
+from optparse import OptionParser
+import multiprocessing
 import os
+import Queue
+import shutil
 import sys
+import tempfile
+import time
 
 def getChain(tupleName, listOfTrees, targetName):
     """ creates a chain from a list of trees and returns the target tree
-        
+
         tupleName: Name of the tuple that has to be available in each file
         listOfTrees: an iterable that contains the filenames of the trees
             that should be merged
         targetName: filename of the tree that contains the merged tuples
     """
-    af = IAnalysisFactory.create()
-    tf = af.createTreeFactory()
+    af = paida.af
+    tf = paida.treeFactory
     if os.path.exists(targetName):
         raise SystemError('The target file exists. Bailing out to prevent data loss')
     tree = tf.create(targetName, readOnly=False, createNew=True)
@@ -38,9 +47,255 @@ def getChain(tupleName, listOfTrees, targetName):
     return tree
 
 
-if __name__ == '__main__':
-    tree = getChain(sys.argv[1], sys.argv[2:-1], sys.argv[-1])
-    
+def _report(message):
+    print >> sys.stderr, message
+
+
+def _quiet(message):
+    pass
+
+
+def _openTuple(treeName, tupleName):
+    # open file in readonly mode to prevent data loss
+    tree = paida.treeFactory.create(treeName, readOnly=True)
+    return tree, tree.find(tupleName)
+
+
+def _columnNames(tuple):
+    return [tuple.columnName(i) for i in range(tuple.columns())]
+
+
+def _readChunks(treeName, tupleName, chunksize):
+    """ Streams all columns of the tuple in chunks, closing the tree when done"""
+    tree, tuple = _openTuple(treeName, tupleName)
+    try:
+        for chunk in iter_chunks(tuple, _columnNames(tuple), chunksize):
+            yield chunk
+    finally:
+        tree.close()
+
+
+# the number of chunks a reading process can get ahead of the writer
+_queueChunks = 2
+
+# the queue of each reading slot, set in the reading processes
+_slotQueues = None
+
+def _initReader(queues):
+    global _slotQueues
+    _slotQueues = queues
+
+
+def _streamTuple(args):
+    """ Streams the chunks of an input tuple through the queue of its slot, followed by None.
+        The queue only holds a few chunks, so the reader waits for the writer instead of reading ahead.
+    """
+    slot, treeName, tupleName, chunksize = args
+    queue = _slotQueues[slot]
+    for chunk in _readChunks(treeName, tupleName, chunksize):
+        queue.put(chunk)
+    queue.put(None)
+
+
+def _workersAlive(pool):
+    """ Returns a function that tells whether all processes the pool started with are still running.
+        They only end when the pool is closed: one that ended before was killed, e.g. for lack of memory.
+        The pool starts another process in its place, but the result of its task is never ready.
+    """
+    workers = list(pool._pool)
+    def alive():
+        return all(worker.exitcode is None for worker in workers)
+    return alive
+
+
+def _waitFor(result, alive):
+    """ Returns the value of the AsyncResult, raising RuntimeError if a process of the pool died on the way"""
+    while not result.ready():
+        result.wait(1.0)
+        if not (result.ready() or alive()):
+            raise RuntimeError('A worker process died')
+    return result.get()
+
+
+def _receiveChunks(queue, result, alive):
+    """ Yields the chunks that a reader streams through the queue, up to its None.
+        Raises RuntimeError if a reading process died, instead of waiting for its chunks forever.
+    """
+    while True:
+        try:
+            chunk = queue.get(timeout=1.0)
+        except Queue.Empty:
+            if result.ready():
+                # raises the exception of the reader, if any; otherwise the None is still on its way
+                result.get()
+            elif not alive():
+                raise RuntimeError('A process reading the inputs died')
+            continue
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _streamedInputs(listOfTrees, tupleName, chunksize, processes):
+    """ Yields an iterator over the chunks of each input tree, in order.
+        The inputs are read by a pool of processes, one slot with its own bounded queue per process.
+        An input is only started when its slot is free, i.e. at most processes inputs are read ahead,
+        so at most processes * (_queueChunks + 1) chunks are held besides the one being written.
+    """
+    window = min(processes, len(listOfTrees))
+    queues = [multiprocessing.Queue(_queueChunks) for slot in range(window)]
+    pool = multiprocessing.Pool(window, _initReader, (queues,))
+    alive = _workersAlive(pool)
+    results = {}
+    def submit(i):
+        results[i] = pool.apply_async(_streamTuple, ((i % window, listOfTrees[i], tupleName, chunksize),))
+    try:
+        for i in range(window):
+            submit(i)
+        for i in range(len(listOfTrees)):
+            chunks = _receiveChunks(queues[i % window], results.pop(i), alive)
+            yield chunks
+            # the slot is only reused once its queue is empty
+            for chunk in chunks:
+                pass
+            if i + window < len(listOfTrees):
+                submit(i + window)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _appendRows(target, names, chunk):
+    """ Appends the rows of a chunk of column arrays to the target tuple and returns their number"""
+    columns = [chunk[name].tolist() for name in names]
+    indices = range(len(names))
+    for row in zip(*columns):
+        for i, value in zip(indices, row):
+            target.fill(i, value)
+        target.addRow()
+    return len(columns[0])
+
+
+def mergeFiles(tupleName, listOfTrees, targetName, chunksize=65536, processes=None, report=_report):
+    """ Copies the tuple from each of the trees into a new tree, row by row in chunks.
+        Without processes the input trees are read in this process, so that only one chunk
+        is in memory at a time. With processes they are read ahead in that many worker processes
+        while the rows are written, and each of those holds at most a few chunks.
+        report is called with a line of progress and throughput for each file.
+        Returns the number of rows written.
+
+        tupleName: Name of the tuple that has to be available in each file
+        listOfTrees: filenames of the trees that should be merged
+        targetName: filename of the tree that contains the merged tuples
+    """
+    listOfTrees = list(listOfTrees)
+    if os.path.exists(targetName):
+        raise SystemError('The target file exists. Bailing out to prevent data loss')
+    # the layout of the target tuple is taken from the first input
+    sourceTree, source = _openTuple(listOfTrees[0], tupleName)
+    names = _columnNames(source)
+    types = [source.columnType(i) for i in range(source.columns())]
+    title = source.title()
+    sourceTree.close()
+
+    tree = paida.treeFactory.create(targetName, readOnly=False, createNew=True)
+    target = paida.getFactory('tuple', tree).create(tupleName, title, names, types)
+    if processes is None:
+        inputs = (_readChunks(treeName, tupleName, chunksize) for treeName in listOfTrees)
+    else:
+        inputs = _streamedInputs(listOfTrees, tupleName, chunksize, processes)
+    total = 0
+    start = time.time()
+    try:
+        for i, chunks in enumerate(inputs):
+            treeName = listOfTrees[i]
+            fileStart = time.time()
+            rows = 0
+            for chunk in chunks:
+                rows += _appendRows(target, names, chunk)
+            seconds = time.time() - fileStart
+            total += rows
+            report('[%d/%d] %s: %d rows in %.1f s (%.0f rows/s)'
+                   % (i + 1, len(listOfTrees), treeName, rows, seconds, rows / max(seconds, 1e-9)))
+    finally:
+        # after an error, stops the processes that read ahead
+        inputs.close()
     tree.commit()
     tree.close()
+    seconds = time.time() - start
+    report('%s: %d rows in %.1f s (%.0f rows/s)' % (targetName, total, seconds, total / max(seconds, 1e-9)))
+    return total
+
+
+def _mergeGroup(args):
+    tupleName, listOfTrees, targetName, chunksize, report = args
+    return mergeFiles(tupleName, listOfTrees, targetName, chunksize, report=report)
+
+
+def parallelMerge(tupleName, listOfTrees, targetName, processes=None, fanIn=16, chunksize=65536, report=_report):
+    """ Merges the tuple from all trees into a new tree with a pool of processes.
+        As long as there are more than fanIn inputs, groups of fanIn of them are merged
+        into intermediate files next to the target, one group per worker.
+        The last merge reads its inputs ahead in processes workers and writes the target.
+        The intermediate files are removed at the end.
+        Returns the number of rows in the target.
+    """
+    listOfTrees = list(listOfTrees)
+    if os.path.exists(targetName):
+        raise SystemError('The target file exists. Bailing out to prevent data loss')
+    if fanIn < 2:
+        raise ValueError('fanIn must be at least 2')
+    processes = processes or multiprocessing.cpu_count()
+    workDir = tempfile.mkdtemp(prefix='mergeTuples', dir=os.path.dirname(os.path.abspath(targetName)))
+    try:
+        level = 0
+        while len(listOfTrees) > fanIn:
+            groups = [listOfTrees[i:i + fanIn] for i in range(0, len(listOfTrees), fanIn)]
+            targets = [os.path.join(workDir, 'level%d_%d.aida' % (level, i)) for i in range(len(groups))]
+            pool = multiprocessing.Pool(processes)
+            try:
+                _waitFor(pool.map_async(_mergeGroup, [(tupleName, group, target, chunksize, report)
+                                                      for group, target in zip(groups, targets)]),
+                         _workersAlive(pool))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            if level > 0:
+                for treeName in listOfTrees:
+                    os.remove(treeName)
+            listOfTrees = targets
+            level += 1
+        return mergeFiles(tupleName, listOfTrees, targetName, chunksize, processes, report)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options] <tuplename> <filename1 [, filename2, ...]> <targetname>')
+    parser.add_option('-p', '--parallel', action='store_true', default=False,
+                      help='read the inputs in a pool of processes and stream the rows into the target')
+    parser.add_option('-j', '--processes', type='int', default=None,
+                      help='number of processes for --parallel, by default one per CPU')
+    parser.add_option('--fan-in', type='int', default=16, dest='fanIn',
+                      help='number of files merged at once for --parallel [default: %default]')
+    parser.add_option('--chunk-size', type='int', default=65536, dest='chunksize',
+                      help='number of rows read at a time for --parallel [default: %default]')
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+                      help='do not report the progress')
+    options, args = parser.parse_args()
+    if len(args) < 3:
+        parser.error('need a tuple name, at least one input file and a target file')
+    if options.parallel:
+        report = options.quiet and _quiet or _report
+        parallelMerge(args[0], args[1:-1], args[-1], options.processes, options.fanIn, options.chunksize, report)
+    else:
+        tree = getChain(args[0], args[1:-1], args[-1])
 
+        tree.commit()
+        tree.close()
@@ -1,15 +1,187 @@
-import paida.paida_gui.PGuiSelector
-paida.paida_gui.PGuiSelector.setGuiEngineName('batch')
-from paida import IAnalysisFactory, PTypes
 import numpy as N
+import itertools
 
 
-numpyTypes2PaidaTypes = {
-    N.int32  : PTypes.Integer
-  , N.int64  : PTypes.Long
-  , N.float32: PTypes.Float
-  , N.float64: PTypes.Double
-  , N.int8   : PTypes.Byte}
+_paidaModule = None
+
+def _importPaida():
+    """ Imports paida on first use rather than when this module is imported.
+        The batch GUI engine has to be selected before paida itself is imported.
+    """
+    global _paidaModule
+    if _paidaModule is None:
+        from paida.paida_gui import PGuiSelector
+        PGuiSelector.setGuiEngineName('batch')
+        import paida as paidaModule
+        _paidaModule = paidaModule
+    return _paidaModule
+
+
+# the maps between numpy types, paida column types and ITuple getters, built by _typeMaps on first use
+_typeMapCache = {}
+
+def _typeMaps():
+    """ Builds the type maps the first time they are needed, so that importing this module does not import paida"""
+    if not _typeMapCache:
+        PTypes = _importPaida().PTypes
+        numpy2paida = {
+            N.int32  : PTypes.Integer
+          , N.int64  : PTypes.Long
+          , N.float32: PTypes.Float
+          , N.float64: PTypes.Double
+          , N.int8   : PTypes.Byte}
+        # the ITuple getter for each column type that has a numpy equivalent
+        getters = {
+            PTypes.Integer: 'getInt'
+          , PTypes.Long   : 'getLong'
+          , PTypes.Float  : 'getFloat'
+          , PTypes.Double : 'getDouble'
+          , PTypes.Byte   : 'getByte'}
+        _typeMapCache['paidaTypes2numpyTypes'] = dict((v, k) for k, v in numpy2paida.items())
+        _typeMapCache['paidaTypeGetters'] = getters
+        _typeMapCache['numpyTypes2PaidaTypes'] = numpy2paida
+    return _typeMapCache
+
+
+def _numpyTypes2PaidaTypes():
+    """ The paida column type of each numpy type"""
+    return _typeMaps()['numpyTypes2PaidaTypes']
+
+
+def _paidaTypes2numpyTypes():
+    """ The numpy type of each paida column type that has one"""
+    return _typeMaps()['paidaTypes2numpyTypes']
+
+
+def _paidaTypeGetters():
+    """ The name of the ITuple getter of each paida column type that has a numpy equivalent"""
+    return _typeMaps()['paidaTypeGetters']
+
+
+def _columnReaders(tuple, columns):
+    """ Returns a list of (name, dtype, read) for each column,
+        where read() returns the value of the column in the current row.
+        A column is either the name of a tuple column, which is read with its typed getter,
+        or an IEvaluator, which is read as a double.
+    """
+    readers = []
+    getters = _paidaTypeGetters()
+    for column in columns:
+        if isinstance(column, basestring):
+            index = tuple.findColumn(column)
+            columnType = tuple.columnType(index)
+            if columnType not in getters:
+                raise TypeError, "Column %s has no numpy equivalent" % column
+            getter = getattr(tuple, getters[columnType])
+            readers.append((column, _paidaTypes2numpyTypes()[columnType], lambda getter=getter, index=index: getter(index)))
+        else:
+            column.initialize(tuple)
+            readers.append((column.expression(), N.float64, column.evaluateDouble))
+    names = [name for name, dtype, read in readers]
+    if len(set(names)) != len(names):
+        raise ValueError, "Duplicate column names in %s" % names
+    return readers
+
+
+def _readChunk(tuple, reads, buffers, filt, size):
+    """ Reads up to size accepted rows from the current position of the tuple into the buffers.
+        Returns the number of rows read; less than size means the tuple is exhausted.
+    """
+    n = 0
+    columns = zip(buffers, reads)
+    while n < size and tuple.next():
+        if filt and not filt.accept():
+            continue
+        for buffer, read in columns:
+            buffer[n] = read()
+        n += 1
+    return n
+
+
+def _allocateColumns(dtype, size, structured):
+    """ Returns the storage for size rows, either a structured array or a list of arrays,
+        and the list of per-column arrays to write into.
+    """
+    if structured:
+        storage = N.empty(size, dtype)
+        return storage, [storage[name] for name, columnType in dtype]
+    storage = [N.empty(size, columnType) for name, columnType in dtype]
+    return storage, storage
+
+
+def _iterChunks(tuple, readers, chunksize, filt):
+    dtype = [(name, columnType) for name, columnType, read in readers]
+    reads = [read for name, columnType, read in readers]
+    if filt:
+        filt.initialize(tuple)
+    tuple.start()
+    n = chunksize
+    while n == chunksize:
+        # fresh arrays for every chunk, so that the consumer may keep them
+        storage, buffers = _allocateColumns(dtype, chunksize, False)
+        n = _readChunk(tuple, reads, buffers, filt, chunksize)
+        if n:
+            yield dict((name, buffer[:n]) for (name, columnType), buffer in zip(dtype, buffers))
+
+
+def iter_chunks(tuple, columns, chunksize=65536, filter=None):
+    """ Iterates over the tuple in blocks of chunksize accepted rows,
+        so that a tuple can be processed without holding all of it in memory.
+        tuple: ITuple object
+        columns: sequence of column names and/or IEvaluator objects, as for tupleColumns2arrays
+        chunksize: number of rows in each block; only the last block may be shorter
+        filter: IFilter object
+        Yields a dict of arrays for each block, keyed by column name.
+    """
+    return _iterChunks(tuple, _columnReaders(tuple, columns), chunksize, filter)
+
+
+def tupleColumns2arrays(tuple, columns, filt=None, chunksize=65536, structured=False):
+    """ Converts several tuple columns to numpy arrays in a single pass over the tuple.
+        tuple: ITuple object
+        columns: sequence of column names and/or IEvaluator objects.
+                 Named columns keep their type, evaluators are evaluated as doubles
+                 and are named by their expression.
+        filt: IFilter object
+        chunksize: number of rows read at a time when the number of rows is not known up front
+        structured: return one structured array instead of a dict of arrays
+        When the tuple knows its number of rows the arrays are allocated once and filled in place,
+        otherwise the rows are read with iter_chunks and joined at the end.
+    """
+    readers = _columnReaders(tuple, columns)
+    dtype = [(name, columnType) for name, columnType, read in readers]
+    rows = tuple.rows()
+    if rows >= 0:
+        reads = [read for name, columnType, read in readers]
+        if filt:
+            filt.initialize(tuple)
+        tuple.start()
+        storage, buffers = _allocateColumns(dtype, rows, structured)
+        n = _readChunk(tuple, reads, buffers, filt, rows)
+        del buffers
+        if n < rows:
+            # rows is only an upper bound with a filter, give back the rest in place
+            if structured:
+                storage.resize(n)
+            else:
+                for i in range(len(storage)):
+                    storage[i].resize(n)
+    else:
+        chunks = list(_iterChunks(tuple, readers, chunksize, filt))
+        if structured:
+            storage = N.empty(sum(len(chunk[dtype[0][0]]) for chunk in chunks), dtype)
+            start = 0
+            for chunk in chunks:
+                stop = start + len(chunk[dtype[0][0]])
+                for name, columnType in dtype:
+                    storage[name][start:stop] = chunk[name]
+                start = stop
+        else:
+            storage = [N.concatenate([chunk[name] for chunk in chunks] or [N.empty(0, columnType)])
+                       for name, columnType in dtype]
+    if structured:
+        return storage
+    return dict((name, array) for (name, columnType), array in zip(dtype, storage))
 
 
 def tupleColumn2array(tuple, evaluator, filt=None):
@@ -18,67 +190,294 @@ def tupleColumn2array(tuple, evaluator, filt=None):
         evaluator: IEvaluator object
         filt: IFilter object
     """
-    evaluator.initialize(tuple)
-    if filt:
-        filt.initialize(tuple)
-    tuple.start()
+    return tupleColumns2arrays(tuple, [evaluator], filt)[evaluator.expression()]
+
+
+def _aidaBinIndices(values, edges):
+    """ Returns the AIDA bin index of each value for the given bin edges:
+        0 .. n-1 inside, -2 for underflow and -1 for overflow.
+        Used as an index into an array with n+2 entries this puts the underflow and overflow at the end.
+        Equal bins are found by division, corrected by one bin where rounding put a value next to its bin,
+        which gives the same as the bisection of other edges in a fraction of the time.
+    """
+    n = len(edges) - 1
+    width = (edges[-1] - edges[0]) / n
+    if n > 1 and N.all(N.abs(N.diff(edges) - width) <= 1e-9 * abs(width)):
+        indices = N.floor((values - edges[0]) / width)
+        N.clip(indices, 0, n - 1, out=indices)
+        indices = indices.astype(N.intp)
+        indices -= values < edges.take(indices)
+        indices += values >= edges.take(indices + 1)
+    else:
+        indices = N.searchsorted(edges, values, side='right') - 1
+    indices[values < edges[0]] = -2
+    indices[values >= edges[-1]] = -1
+    return indices
+
+
+def _binContents(coordinates, weights, edges):
+    """ Computes the bin contents that filling an AIDA histogram with the weighted points would give.
+        coordinates: one array of values per axis
+        edges: one array of bin edges per axis
+        Returns a dict of arrays with n+2 entries per axis, indexed like the AIDA bins.
+    """
+    shape = tuple(len(e) + 1 for e in edges)
+    positions = N.zeros(len(weights), N.intp)
+    for values, e, size in zip(coordinates, edges, shape):
+        positions = positions * size + _aidaBinIndices(values, e) % size
+    def binSums(w=None):
+        return N.bincount(positions, w, minlength=N.prod(shape)).reshape(shape)
+    contents = {'entries': binSums(), 'heights': binSums(weights), 'errors2': binSums(weights*weights)}
+    for axis, values in zip('XY', coordinates):
+        torques = values * weights
+        contents['torques' + axis] = binSums(torques)
+        contents['inertials' + axis] = binSums(values * torques)
+    return contents
+
+
+# where the paida histograms keep their per-bin sums, one list per axis indexed by the AIDA bin index
+_paidaBinSums = {
+    'entries'   : '_binEntries'
+  , 'heights'   : '_binSumOfWeights'
+  , 'errors2'   : '_binSumOfErrors'
+  , 'torquesX'  : '_binSumOfTorquesX'
+  , 'torquesY'  : '_binSumOfTorquesY'
+  , 'inertialsX': '_binSumOfInertialsX'
+  , 'inertialsY': '_binSumOfInertialsY'}
+
+
+def _writeBinContents(histogram, contents):
+    """ Writes the bin contents into the per-bin sums of the empty paida histogram, for the bins with entries"""
+    sums = [(getattr(histogram, _paidaBinSums[key]), values) for key, values in contents.items()]
+    for index in zip(*N.nonzero(contents['entries'])):
+        for binSums, values in sums:
+            target = binSums
+            for i in index[:-1]:
+                target = target[i]
+            target[index[-1]] = values[index].item()
+
+
+# the public accessors of the histograms, per bin, per bin of an axis and for the whole histogram
+_binAccessors = {1: ['binEntries', 'binHeight', 'binError', 'binMean'],
+                 2: ['binEntries', 'binHeight', 'binError', 'binMeanX', 'binMeanY']}
+_axisAccessors = {1: [], 2: [['binEntriesX', 'binHeightX'], ['binEntriesY', 'binHeightY']]}
+_totalAccessors = {1: ['entries', 'allEntries', 'extraEntries', 'equivalentBinEntries', 'sumBinHeights',
+                       'sumAllBinHeights', 'sumExtraBinHeights', 'minBinHeight', 'maxBinHeight', 'mean', 'rms'],
+                   2: ['entries', 'allEntries', 'extraEntries', 'equivalentBinEntries', 'sumBinHeights',
+                       'sumAllBinHeights', 'sumExtraBinHeights', 'minBinHeight', 'maxBinHeight',
+                       'meanX', 'meanY', 'rmsX', 'rmsY']}
+
+
+def _accessorValues(histogram, bins):
+    """ Returns what the public accessors of the histogram give for the bins and in total,
+        an accessor that raises gives the class of its exception
+    """
+    dimension = len(bins[0])
+    calls = [(name, index) for index in bins for name in _binAccessors[dimension]]
+    for axis, names in enumerate(_axisAccessors[dimension]):
+        calls += [(name, (i,)) for i in sorted(set(index[axis] for index in bins)) for name in names]
+    calls += [(name, ()) for name in _totalAccessors[dimension]]
     values = []
-    # premature optimization: I can save an if in the loop...
-    if filt:
-        while tuple.next():
-            if filt.accept():
-                values.append(evaluator.evaluateDouble())
+    for name, args in calls:
+        try:
+            values.append(getattr(histogram, name)(*args))
+        except Exception, e:
+            values.append(e.__class__)
+    return values
+
+
+def _sameValues(values, others):
+    for value, other in zip(values, others):
+        if isinstance(value, (int, long, float)) and isinstance(other, (int, long, float)):
+            if not N.allclose(value, other, rtol=1e-10, atol=1e-12):
+                return False
+        elif value != other:
+            return False
+    return len(values) == len(others)
+
+
+def _probePoints(edges):
+    """ Weighted points in the first, second and last bins, on the edges, in the underflow and the overflow of each axis,
+        and the AIDA indices of the bins they fall in
+    """
+    axes = []
+    for e in edges:
+        centers = 0.5 * (e[:-1] + e[1:])
+        axes.append(sorted(set([e[0] - 1.0, e[0], centers[0], centers[min(1, len(centers) - 1)], e[min(1, len(e) - 1)],
+                                centers[-1], e[-1], e[-1] + 1.0])))
+    grid = N.array(list(itertools.product(*axes)), N.float64)
+    coordinates = [N.repeat(grid[:, axis], 3) for axis in range(len(edges))]
+    weights = N.tile([1.0, 2.5, 0.75], len(grid))
+    indices = [_aidaBinIndices(values, e) for values, e in zip(coordinates, edges)]
+    bins = sorted(set(tuple(int(i) for i in index) for index in zip(*indices)))
+    return coordinates, weights, bins
+
+
+def _fillPoints(histogram, coordinates, weights):
+    fill = histogram.fill
+    for point in zip(*[values.tolist() for values in coordinates] + [weights.tolist()]):
+        fill(*point)
+
+
+# whether writing the bin sums gives the same histogram as fill(), for each histogram class and dimension
+_bulkWrites = {}
+
+
+def _bulkWriteMatches(histogram, edges):
+    """ Fills a few points into the empty histogram with fill() and writes the same points as bin sums,
+        and compares all the public accessors of the two. The histogram is empty again afterwards.
+        This finds out whether the paida histograms keep their sums where _paidaBinSums says,
+        and no other totals that the bin sums would not update.
+    """
+    coordinates, weights, bins = _probePoints(edges)
+    _fillPoints(histogram, coordinates, weights)
+    filled = _accessorValues(histogram, bins)
+    histogram.reset()
+    try:
+        _writeBinContents(histogram, _binContents(coordinates, weights, edges))
+        written = _accessorValues(histogram, bins)
+    except (AttributeError, TypeError, IndexError, KeyError):
+        written = None
+    histogram.reset()
+    return written is not None and _sameValues(filled, written)
+
+
+def _fillHistogram(histogram, coordinates, weights, edges):
+    """ Fills the new paida histogram with all points.
+        The bin sums are computed by numpy and written into the histogram in one go
+        where that was found to give what fill() gives, otherwise each point goes through fill().
+    """
+    key = (histogram.__class__, len(edges))
+    if key not in _bulkWrites:
+        _bulkWrites[key] = _bulkWriteMatches(histogram, edges)
+    if _bulkWrites[key]:
+        _writeBinContents(histogram, _binContents(coordinates, weights, edges))
     else:
-        while tuple.next():
-            values.append(evaluator.evaluateDouble())
-    return N.array(values)
+        _fillPoints(histogram, coordinates, weights)
+    return histogram
+
+
+def _weightsFor(data, weights):
+    if weights is None:
+        return N.ones(len(data))
+    return N.asarray(weights, N.float64).ravel()
+
+
+def _binEdges(values, bins, range=None):
+    """ Returns the bin edges for the values,
+        bins is either the number of bins or a sequence of edges like in numpy.histogram.
+        Without a range the bins reach just above the largest value, so that it is not counted as overflow.
+    """
+    if not N.isscalar(bins):
+        return N.asarray(bins, N.float64)
+    if range is None:
+        range = (values.min(), N.nextafter(values.max(), N.inf))
+    return N.linspace(range[0], range[1], bins + 1)
 
 
 class PAIDA(object):
     """ convenience class to convert numpy arrays to AIDA objects
         This is a prime candidate for a singleton/borg/whatever
+        The factories are only created when they are first used,
+        the ones that belong to a tree are cached for each tree.
     """
 
     def __init__(self):
-        self.af = IAnalysisFactory.create()
-        self.treeFactory = self.af.createTreeFactory()
-        #self.tree = self.treeFactory.create()
-        #self.histogramFactory = self.af.createHistogramFactory(self.tree)
-        #self.fitFactory = self.af.createFitFactory()
-        #self.tupleFactory = self.af.createTupleFactory(self.tree)
-        #self.dataPointSetFactory = self.af.createDataPointSetFactory(self.tree)
+        self._analysisFactory = None
+        self._treeFactory = None
+        self._tree = None
+        self._fitFactory = None
+        self._factories = {}
+
+
+    def _getAnalysisFactory(self):
+        if self._analysisFactory is None:
+            self._analysisFactory = _importPaida().IAnalysisFactory.create()
+        return self._analysisFactory
+
+    af = property(_getAnalysisFactory, doc="The IAnalysisFactory")
+
+    def _getTreeFactory(self):
+        if self._treeFactory is None:
+            self._treeFactory = self.af.createTreeFactory()
+        return self._treeFactory
+
+    treeFactory = property(_getTreeFactory, doc="The ITreeFactory")
+
+    def _getTree(self):
+        if self._tree is None:
+            self._tree = self.treeFactory.create()
+        return self._tree
+
+    tree = property(_getTree, doc="The in-memory ITree that the factories use by default")
 
+    def _getFitFactory(self):
+        if self._fitFactory is None:
+            self._fitFactory = self.af.createFitFactory()
+        return self._fitFactory
 
-    def hist1D(self, data, bins=10, label='data'):
+    fitFactory = property(_getFitFactory, doc="The IFitFactory")
+
+
+    def getFactory(self, kind, tree=None):
+        """ Returns the factory of the given kind for the tree, creating it on first use.
+            kind: 'histogram', 'tuple', 'dataPointSet' or 'function'
+            tree: ITree that the factory creates its objects in, by default self.tree
+        """
+        if tree is None:
+            tree = self.tree
+        # keyed by id, the tree is kept with its factory so that the id stays unique
+        key = (kind, id(tree))
+        if key not in self._factories:
+            create = getattr(self.af, 'create%s%sFactory' % (kind[0].upper(), kind[1:]))
+            self._factories[key] = (tree, create(tree))
+        return self._factories[key][1]
+
+    histogramFactory = property(lambda self: self.getFactory('histogram'), doc="The IHistogramFactory of self.tree")
+
+    tupleFactory = property(lambda self: self.getFactory('tuple'), doc="The ITupleFactory of self.tree")
+
+    dataPointSetFactory = property(lambda self: self.getFactory('dataPointSet'), doc="The IDataPointSetFactory of self.tree")
+
+    functionFactory = property(lambda self: self.getFactory('function'), doc="The IFunctionFactory of self.tree")
+
+
+    def hist1D(self, data, bins=10, label='data', weights=None, range=None):
         """ Calculates a histogram much like pylab.hist, only with the Paida methods
             Meant as an in-situ replacement for pylab.hist, because the Paida histogramming methods are much more powerful
-            Returns a Paida cloud that has been converted to a histogram
+            bins: number of bins or a sequence of bin edges
+            range: (lower, upper) for a number of bins. By default the bins span all data.
+            The bin contents are computed with numpy, so this is fast for large arrays.
+            Returns an IHistogram1D
         """
-        cloud = self.histogramFactory.createCloud1D(label)
-        map(cloud.fill, data)
-        cloud.convert(bins)
-        return cloud.histogram()
+        data = N.asarray(data, N.float64).ravel()
+        weights = _weightsFor(data, weights)
+        edges = _binEdges(data, bins, range)
+        histogram = self.histogramFactory.createHistogram1D(label, label, list(edges))
+        return _fillHistogram(histogram, [data], weights, [edges])
 
 
-    def hist2D(self, data, xbins=10, ybins=10, label='data'):
-        """ creates a IHistogram2D from the given array"""
-        cloud = self.histogramFactory.createCloud2D(label)
-        for row in data:
-            cloud.fill(row[0], row[1])
-        cloud.convert(xbins, ybins)
-        return cloud.histogram()
+    def hist2D(self, data, xbins=10, ybins=10, label='data', weights=None):
+        """ creates a IHistogram2D from the given (N, 2) array
+            xbins, ybins: number of bins or a sequence of bin edges for each axis
+        """
+        data = N.asarray(data, N.float64)
+        weights = _weightsFor(data, weights)
+        edges = [_binEdges(data[:, 0], xbins), _binEdges(data[:, 1], ybins)]
+        histogram = self.histogramFactory.createHistogram2D(label, label, list(edges[0]), list(edges[1]))
+        return _fillHistogram(histogram, [data[:, 0], data[:, 1]], weights, edges)
 
 
-    def cloud1D(self, data, label='data'):
+    def cloud1D(self, data, label='data', weights=None):
         """ Creates a cloud1D from the given array"""
+        data = N.asarray(data, N.float64).ravel()
+        weights = _weightsFor(data, weights)
         cloud = self.histogramFactory.createCloud1D(label)
-        cloud._entryList[0] = data
-        cloud._entryList[1] = N.ones_like(data)
-        cloud._sumOfWeights = len(data)
-        cloud._sumOfTorques[0] = data
-        cloud._sumOfInertials[0] = data**2
-        cloud._lowerEdges = [N.min(data), 0.0, 0.0]
-        cloud._upperEdges = [N.max(data), 0.0, 0.0]
+        # A cloud keeps every entry, and may turn itself into a histogram as it grows,
+        # so there are no sums to write in one go as for a histogram: every entry goes through fill().
+        for x, w in zip(data.tolist(), weights.tolist()):
+            cloud.fill(x, w)
+        return cloud
 
     
     def open(self, filename, option='r'):
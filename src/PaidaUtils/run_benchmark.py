@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Measures the cold start of a job that uses PaidaUtils.
+    Every measurement runs in a fresh interpreter, the best of several runs is reported.
+    'eager' does what importing this module used to do: select the batch GUI engine,
+    import paida and create the analysis and tree factories.
+"""
+import subprocess
+import sys
+
+runs = 5
+
+snippets = [
+    ('eager import', """
+import paida.paida_gui.PGuiSelector
+paida.paida_gui.PGuiSelector.setGuiEngineName('batch')
+from paida import IAnalysisFactory
+import numpy
+af = IAnalysisFactory.create()
+af.createTreeFactory()
+""")
+  , ('lazy import', """
+import paidaUtils
+""")
+  , ('lazy import + histogram factory', """
+import paidaUtils
+paidaUtils.paida.histogramFactory
+""")]
+
+timer = """
+import time
+start = time.time()
+%s
+print time.time() - start
+"""
+
+for name, snippet in snippets:
+    times = []
+    for x in xrange(runs):
+        process = subprocess.Popen([sys.executable, '-c', timer % snippet], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            # e.g. paida is not installed: report the error instead of a time
+            break
+        times.append(float(output.split()[-1]))
+    if times:
+        print '%s: %.3f s' % (name, min(times))
+    else:
+        print '%s: failed, %s' % (name, error.strip().splitlines()[-1])
@@ -1,4 +1,6 @@
-from Geometry.geometry import Momentum
+from Geometry.geometry import Momentum, Frame, lorentzInverse, makeBoostMatrix
+from Geometry.hep import lab
+import numpy as N
 from math import sqrt
 
 def testBoost():
@@ -39,5 +41,35 @@ def testBoost():
     assert theSum.y < 1e-4
     assert theSum.z < 1e-4
     
+def testLorentzInverse():
+    """ The closed-form inverse of a composed boost and rotation must agree with numerical inversion
+    """
+    exact = Frame(lab.makeBoost(0.1, -0.3, 0.5), lorentz=False)
+    frame = Frame(lab.makeBoost(0.1, -0.3, 0.5))
+    transformation = frame.makeRotation(0.3, 1.2, -0.7) * frame.makeBoost(0.6, 0.2, 0.1)
+    assert N.allclose(lorentzInverse(transformation), transformation.I)
+    p = Momentum(13, 0.0, 2.3, 4.5)
+    assert N.allclose(frame.coordinatesOf(p)._coordinates, exact.coordinatesOf(p)._coordinates)
+    assert N.allclose(Frame(transformation).coordinatesOf(p)._coordinates,
+                      Frame(transformation, lorentz=False).coordinatesOf(p)._coordinates)
+
+def testScalarOperations():
+    """ The matrix-free fast paths must agree with the matrix representations
+    """
+    p = Momentum(13, 0.0, 2.3, 4.5)
+    q = Momentum(5.279, 1.1, 2.2, 3.3)
+    assert isinstance(p + q, Momentum)
+    assert abs(p.dot(q) - N.dot(p.asarray() * [1, -1, -1, -1], q.asarray())) < 1e-12
+    assert abs(p.mass**2 - p.dot(p)) < 1e-9
+    boosted = p.boost(0.1, -0.3, 0.5)
+    assert N.allclose(boosted.asarray(), N.dot(makeBoostMatrix(0.1, -0.3, 0.5).A, p.asarray()))
+    rotated = p.rotate(0.3, 1.2, -0.7)
+    assert N.allclose(rotated.asarray(), N.dot(lab.makeRotation(0.3, 1.2, -0.7).A, p.asarray()))
+    assert abs(rotated.v3().mag() - p.v3().mag()) < 1e-12
+    assert list(-p) == [-13, -0.0, -2.3, -4.5]
+    assert p.e == 13
+
 if __name__ == '__main__':
-    testBoost()
\ No newline at end of file
+    testBoost()
+    testLorentzInverse()
+    testScalarOperations()
\ No newline at end of file
@@ -0,0 +1,150 @@
+from PaidaUtils import columnCache
+from PaidaUtils.columnCache import ColumnCache, _Lock
+from testPaidaUtils import makeTuple, expected, _Evaluator, _Filter
+import numpy as N
+import os
+import shutil
+import tempfile
+
+
+class _Trees(object):
+    """ A tree factory that opens a stub tuple and counts how often it does """
+    def __init__(self, tuple):
+        self.tuple = tuple
+        self.opened = 0
+
+    def create(self, fileName, readOnly=True):
+        self.opened += 1
+        return self
+
+    def find(self, tupleName):
+        return self.tuple
+
+    def close(self):
+        pass
+
+
+class _Paida(object):
+    def __init__(self, tuple):
+        self.treeFactory = _Trees(tuple)
+
+
+class _Setup(object):
+    """ A cache in a fresh directory, a file for it to key on and a tuple to extract from """
+    def __init__(self, maxBytes=1 << 32):
+        self.directory = tempfile.mkdtemp(prefix='testColumnCache')
+        self.fileName = os.path.join(self.directory, 'data.aida')
+        open(self.fileName, 'w').write('tuple')
+        self.tuple = makeTuple(500)
+        self.paida = _Paida(self.tuple)
+        self.cache = ColumnCache(os.path.join(self.directory, 'cache'), maxBytes)
+        self._paida, columnCache.paida = columnCache.paida, self.paida
+
+    def entries(self):
+        return sorted(name for name in os.listdir(self.cache.directory) if name.endswith('.npy'))
+
+    def close(self):
+        columnCache.paida = self._paida
+        shutil.rmtree(self.directory)
+
+
+def testRoundTrip():
+    """ The first request extracts, the second reads back the mapped files """
+    setup = _Setup()
+    try:
+        cache = setup.cache
+        first = cache.columns(setup.fileName, 't', ['x', _Evaluator()])
+        assert setup.paida.treeFactory.opened == 1
+        assert len(setup.entries()) == 2
+        second = cache.columns(setup.fileName, 't', ['x', _Evaluator()])
+        assert setup.paida.treeFactory.opened == 1
+        reference = expected(setup.tuple, ['x', 'x*y'])
+        for name in reference:
+            assert N.allclose(first[name], reference[name])
+            assert N.array_equal(second[name], first[name])
+            assert isinstance(second[name], N.memmap) and not second[name].flags.writeable
+        # only the missing column is extracted
+        cache.columns(setup.fileName, 't', ['x', 'n'])
+        assert setup.paida.treeFactory.opened == 2
+        assert len(setup.entries()) == 3
+        assert N.array_equal(cache.column(setup.fileName, 't', 'n'), expected(setup.tuple, ['n'])['n'])
+        assert setup.paida.treeFactory.opened == 2
+    finally:
+        setup.close()
+
+
+def testKey():
+    """ A changed file, another tuple, column or filter make another entry """
+    setup = _Setup()
+    try:
+        cache = setup.cache
+        key = cache.key(setup.fileName, 't', 'x')
+        assert cache.key(setup.fileName, 't', 'x') == key
+        assert cache.key(setup.fileName, 'u', 'x') != key
+        assert cache.key(setup.fileName, 't', 'y') != key
+        assert cache.key(setup.fileName, 't', _Evaluator()) != key
+        filtered = cache.key(setup.fileName, 't', 'x', _Filter())
+        assert filtered != key
+        status = os.stat(setup.fileName)
+        os.utime(setup.fileName, (status.st_atime, status.st_mtime + 10))
+        assert cache.key(setup.fileName, 't', 'x') != key
+        assert cache.key(setup.fileName, 't', 'x', _Filter()) != filtered
+
+        # a filtered column is its own entry with the accepted rows only
+        column = cache.column(setup.fileName, 't', 'x', _Filter())
+        assert N.allclose(column, expected(setup.tuple, ['x'], lambda x: x > 0)['x'])
+        assert len(cache.column(setup.fileName, 't', 'x')) == 500
+    finally:
+        setup.close()
+
+
+def testEvictionOrder():
+    """ The least recently used entries go first, the ones in keep last """
+    setup = _Setup()
+    try:
+        cache = setup.cache
+        keys = ['%040d' % i for i in range(5)]
+        for i, key in enumerate(keys):
+            cache._store(key, N.zeros(1000))
+            os.utime(cache._path(key), (1000000 + i, 1000000 + i))
+        size = os.path.getsize(cache._path(keys[0]))
+        # using an entry makes it the most recent one
+        assert cache._load(keys[0]) is not None
+        cache.maxBytes = 3 * size
+        cache.evict()
+        assert setup.entries() == [key + '.npy' for key in [keys[0], keys[3], keys[4]]]
+        cache.maxBytes = size
+        cache.evict(keep=[keys[3]])
+        assert setup.entries() == [keys[3] + '.npy']
+    finally:
+        setup.close()
+
+
+def testClearKeepsLocks():
+    """ clear removes all entries, but not the lock files that other jobs may hold """
+    setup = _Setup()
+    try:
+        cache = setup.cache
+        cache.columns(setup.fileName, 't', ['x', 'y'])
+        key = cache.key(setup.fileName, 't', 'x')
+        lock = _Lock(cache._path(key, '.lock'))
+        lock.acquire()
+        try:
+            inode = os.stat(lock.path).st_ino
+            cache.clear()
+            assert setup.entries() == []
+            assert os.stat(lock.path).st_ino == inode
+        finally:
+            lock.release()
+        assert cache.maxBytes == 1 << 32
+        cache.columns(setup.fileName, 't', ['x'])
+        assert setup.paida.treeFactory.opened == 2
+    finally:
+        setup.close()
+
+
+if __name__ == '__main__':
+    testRoundTrip()
+    testKey()
+    testEvictionOrder()
+    testClearKeepsLocks()
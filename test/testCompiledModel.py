@@ -0,0 +1,162 @@
+from unittest import SkipTest
+try:
+    from Fitting.compiledModel import compileCodelet, compileModel, compileConstraints, compileIntegral, legendreIntegral
+except ImportError:
+    raise SkipTest('the Fitting package is not importable')
+import numpy as N
+
+
+def gaussian(x, amplitude, mean, sigma):
+    return amplitude * N.exp(-(x - mean)**2 / (2. * sigma**2))
+
+
+def exponential(x, amplitude, exponent):
+    return amplitude * N.exp(exponent * x)
+
+
+def polynomial(x, *coefficients):
+    return N.polyval(coefficients[::-1], x)
+
+
+def catalogTerm(name):
+    """ The number of parameters and the reference function of a catalog function """
+    if name == 'G':
+        return 3, gaussian
+    elif name == 'E':
+        return 2, exponential
+    return int(name[1:]) + 1, polynomial
+
+
+models = ['G', 'E', 'P0', 'P1', 'P3', 'G+P1', 'E+G', 'G+G+P2']
+
+
+def reference(model, x, parameters):
+    """ The sum of the terms of the model, taking their parameters in order """
+    result = N.zeros_like(x)
+    used = 0
+    for name in model.split('+'):
+        nParameters, function = catalogTerm(name)
+        result += function(x, *parameters[used:used + nParameters])
+        used += nParameters
+    assert used == len(parameters)
+    return result
+
+
+def makeParameters(model, random):
+    """ Random parameters, with positive widths and small exponents """
+    parameters = []
+    for name in model.split('+'):
+        if name == 'G':
+            parameters += [random.uniform(1., 10.), random.uniform(-1., 1.), random.uniform(0.2, 2.)]
+        elif name == 'E':
+            parameters += [random.uniform(1., 10.), random.uniform(-1., 1.)]
+        else:
+            parameters += list(random.uniform(-2., 2., catalogTerm(name)[0]))
+    return parameters
+
+
+def testCatalog():
+    """ Compiled catalog functions and sums of them evaluate on all points at once """
+    random = N.random.RandomState(0)
+    x = random.uniform(-3., 3., (1, 50))
+    for model in models:
+        parameters = makeParameters(model, random)
+        names = ['p%d' % i for i in range(len(parameters))]
+        compiled = compileCodelet('codelet:%s:catalog' % model, names)
+        assert compiled is not None, model
+        # a constant is a scalar, which the fitter broadcasts to the points
+        values = compiled(x, N.array(parameters)) + N.zeros(50)
+        assert N.allclose(values, reference(model, x[0], parameters), rtol=1e-12, atol=0.), model
+        # cached by codelet and parameter names
+        assert compileCodelet('codelet:%s:catalog' % model, names) is compiled
+
+
+def testPaidaCatalog():
+    """ Compiled catalog functions give the values of the paida functions point by point """
+    try:
+        from Fitting.IFitter_chi2_scipy import IFunctionFactory
+    except ImportError:
+        raise SkipTest('paida is not importable')
+    random = N.random.RandomState(1)
+    x = random.uniform(-3., 3., 20)
+    for model in models:
+        function = IFunctionFactory(None).createFunctionByName(model, model, inner=True)
+        parameters = makeParameters(model, random)
+        function.setParameters(parameters)
+        compiled = compileCodelet(function.codeletString(), function.parameterNames())
+        assert compiled is not None, function.codeletString()
+        values = compiled(x[None, :], N.array(parameters)) + N.zeros(len(x))
+        space = function._innerParameterNameSpace
+        for k in range(len(x)):
+            space['x'] = [x[k]]
+            assert N.allclose(values[k], function._getDeriv0Base(space), rtol=1e-12, atol=0.), (model, x[k])
+
+
+def testFallback():
+    """ Codelets and names that cannot be compiled give None, so that the function is evaluated instead """
+    names = ['a', 'm', 's']
+    # verbatim code is written for the name space of its function
+    assert compileCodelet('codelet:f:verbatim:python\na * exp(m * x[0])', names[:2]) is None
+    assert compileCodelet('codelet:a * x[0]:verbatim:python', names[:1]) is None
+    assert compileCodelet('codelet:f:verbatim:java\nreturn a * x[0];', names[:1]) is None
+    # not a codelet, not in the catalog, or the wrong number of parameters
+    for codelet in ['G', 'codelet:Q:catalog', 'codelet:P:catalog', 'codelet:G+:catalog', 'codelet:Gx:catalog']:
+        assert compileCodelet(codelet, names) is None, codelet
+    assert compileCodelet('codelet:G:catalog', names[:2]) is None
+    assert compileCodelet('codelet:G:catalog', names + ['b']) is None
+    assert compileCodelet('codelet:G+E:catalog', names) is None
+    # names that are not identifiers or hide the point array or a function
+    for invalid in [['x', 'm', 's'], ['a', 'exp', 's'], ['a', 'm', '2s'], ['a', 'm', 's-1'], ['a', 'p', 's']]:
+        assert compileCodelet('codelet:G:catalog', invalid) is None, invalid
+    assert compileModel('a * (x[0]', ['a']) is None
+    assert compileModel(None, ['a']) is None
+
+
+def testIntegral():
+    """ The analytic integrals of catalog functions agree with Gauss-Legendre quadrature on any interval """
+    random = N.random.RandomState(2)
+    intervals = [(-3., 3.), (0.5, 1.7), (-2.9, -2.), (1., -1.), (-8., 8.)]
+    for model in models:
+        parameters = makeParameters(model, random)
+        names = ['p%d' % i for i in range(len(parameters))]
+        integral = compileIntegral('codelet:%s:catalog' % model, names)
+        assert integral is not None, model
+        for lower, upper in intervals:
+            expected = legendreIntegral(lambda x: reference(model, x, parameters), lower, upper)
+            assert N.allclose(integral(lower, upper, parameters), expected, rtol=1e-10, atol=1e-12), (model, lower, upper)
+        assert compileIntegral('codelet:%s:catalog' % model, names) is integral
+    # the sign of a width does not matter, and a flat exponential is a constant
+    gaussian = compileIntegral('codelet:G:catalog', ['a', 'm', 's'])
+    assert N.allclose(gaussian(-1., 2., [2., 0.3, -0.5]), gaussian(-1., 2., [2., 0.3, 0.5]), rtol=1e-14)
+    assert N.allclose(gaussian(-30., 30., [2., 0.3, 0.5]), 2. * 0.5 * N.sqrt(2. * N.pi), rtol=1e-14)
+    exponential = compileIntegral('codelet:E:catalog', ['a', 'b'])
+    assert exponential(-1., 2., [2., 0.]) == 6.
+    assert N.allclose(exponential(-1., 2., [2., 1e-9]), 6., rtol=1e-8)
+    # the integral is not known, or the names would hide its bounds
+    assert compileIntegral('codelet:f:verbatim:python\na * x[0]', ['a']) is None
+    assert compileIntegral('codelet:Q:catalog', ['a']) is None
+    assert compileIntegral('codelet:G:catalog', ['a', 'm']) is None
+    assert compileIntegral('codelet:G:catalog', ['a', 'lower', 's']) is None
+    assert compileIntegral('codelet:E:catalog', ['upper', 'b']) is None
+
+
+def testConstraints():
+    """ Constraints run in order on a copy of the parameters """
+    constrain = compileConstraints(['b = 2 * a', 'c = a + b'], ['a', 'b', 'c'])
+    parameters = N.array([1., 0., 0.])
+    assert list(constrain(parameters)) == [1., 2., 3.]
+    assert list(parameters) == [1., 0., 0.]
+    try:
+        compileConstraints(['b = 2 * a'], ['a', 'x'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('names that cannot be compiled must raise ValueError')
+
+
+if __name__ == '__main__':
+    testCatalog()
+    testPaidaCatalog()
+    testFallback()
+    testIntegral()
+    testConstraints()
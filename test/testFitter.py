@@ -0,0 +1,744 @@
+from unittest import SkipTest
+try:
+    from Fitting import IFitter_chi2_scipy
+    from Fitting.IFitter_chi2_scipy import IFitter, IFitData, IFunctionFactory, IRangeSet
+except ImportError:
+    raise SkipTest('the fitter needs paida')
+import numpy as N
+
+
+class _Range(object):
+    """ The range of one axis, a list of (lower, upper) intervals like an IRangeSet """
+    def __init__(self, intervals=None):
+        if intervals is None:
+            intervals = [(IRangeSet._NINF, IRangeSet._PINF)]
+        self._intervals = intervals
+
+    def lowerBounds(self):
+        return [lower for lower, upper in self._intervals]
+
+    def upperBounds(self):
+        return [upper for lower, upper in self._intervals]
+
+    def isInRange(self, value):
+        for lower, upper in self._intervals:
+            if lower <= value <= upper:
+                return True
+        return False
+
+
+class _FitData(IFitData):
+    """ An IFitData connected to a list of points instead of a histogram or a cloud.
+        The data are binned if they have weights.
+    """
+    def __init__(self, centers, weights=None, errorsPlus=None, errorsMinus=None, ranges=None):
+        centers = [list(N.atleast_1d(center)) for center in centers]
+        n = len(centers)
+        self._binned = weights is not None
+        if weights is None:
+            weights = [1.0] * n
+        if errorsPlus is None:
+            errorsPlus = [None] * n
+        if errorsMinus is None:
+            errorsMinus = errorsPlus
+        self._connection = [centers, list(weights), list(errorsPlus), list(errorsMinus)]
+        if ranges is None:
+            ranges = [_Range() for center in centers[0]]
+        self._ranges = ranges
+
+    def dimension(self):
+        return len(self._ranges)
+
+    def range(self, axis):
+        return self._ranges[axis]
+
+
+def makeHistogram(seed=0, mean=0.2, sigma=0.8, background=5.):
+    """ Poisson counts of a gaussian peak on a flat background, with their errors """
+    x = N.linspace(-3., 3., 41)
+    counts = N.random.RandomState(seed).poisson(50. * N.exp(-0.5 * ((x - mean) / sigma)**2) + background).astype(float)
+    errors = N.sqrt(N.maximum(counts, 1.))
+    return _FitData(x, counts, errors, errors)
+
+
+def makeFunction(model, parameters):
+    function = IFunctionFactory(None).createFunctionByName(model, model, inner=True)
+    function.setParameters(parameters)
+    return function
+
+
+def fit(method, engine, data, model, start, configure=None):
+    """ Fits a new function of the catalog model, configure(fitter, parameterNames) can change the settings """
+    fitter = IFitter(method, engine)
+    function = makeFunction(model, start)
+    if configure is not None:
+        configure(fitter, function.parameterNames())
+    return fitter.fit(data, function)
+
+
+def freeCovariance(result, free):
+    return N.array([[result.covMatrixElement(i, j) for j in range(free)] for i in range(free)])
+
+
+def compareResults(result, reference, free, errorTolerance=2e-2):
+    """ The same minimum, parabolic and asymmetric errors within a fraction of the errors.
+        Fixed and constrained parameters have no error, they are checked by the tests.
+    """
+    assert result.fitStatus() == reference.fitStatus() == 0
+    errors = N.array(reference.errors())
+    varied = errors > 0.0
+    assert N.all(N.abs(N.array(result.fittedParameters()) - reference.fittedParameters())[varied] <= 1e-2 * errors[varied])
+    assert abs(result.quality() - reference.quality()) <= 1e-4 * abs(reference.quality())
+    assert N.allclose(result.errors(), errors, rtol=errorTolerance)
+    assert N.allclose(freeCovariance(result, free), freeCovariance(reference, free), rtol=2 * errorTolerance, atol=1e-3 * errors.max()**2)
+    assert N.allclose(result.errorsPlus(), reference.errorsPlus(), rtol=errorTolerance)
+    assert N.allclose(result.errorsMinus(), reference.errorsMinus(), rtol=errorTolerance)
+
+
+def requireMinuit2():
+    if IFitter_chi2_scipy.Minuit is None:
+        raise SkipTest('the pyMinuit2 extension is not built')
+
+
+def testMinuit2Chi2():
+    """ MIGRAD, HESSE and MINOS agree with the minimization and the error scan of PAIDA on a chi2 """
+    requireMinuit2()
+    data = makeHistogram()
+    start = [40., 0., 1., 3.]
+    reference = fit('Chi2', 'PAIDA', data, 'G+P0', start)
+    result = fit('Chi2', 'Minuit2', data, 'G+P0', start)
+    assert result.engineName() == 'Minuit2'
+    assert result.ndf() == reference.ndf() == 41 - 4
+    compareResults(result, reference, 4)
+    # the scanned interval of a gaussian peak is not symmetric, but close to the parabolic error
+    assert N.allclose(result.errorsPlus(), result.errors(), rtol=0.2)
+
+
+def testMinuit2NLL():
+    """ The same for a binned likelihood, with up = 0.5 """
+    requireMinuit2()
+    data = makeHistogram(1)
+    start = [40., 0., 1., 3.]
+    reference = fit('BinnedMaximumLikelihood', 'PAIDA', data, 'G+P0', start)
+    result = fit('BinnedMaximumLikelihood', 'Minuit2', data, 'G+P0', start)
+    compareResults(result, reference, 4)
+
+
+def testMinuit2LimitsAndFixed():
+    """ Fixed parameters keep their value, limits hold and do not matter if they are far from the minimum """
+    requireMinuit2()
+    data = makeHistogram(2)
+    start = [40., 0., 1., 5.]
+    def fixBackground(fitter, names):
+        fitter.fitParameterSettings(names[3]).setFixed(True)
+    reference = fit('Chi2', 'PAIDA', data, 'G+P0', start, fixBackground)
+    result = fit('Chi2', 'Minuit2', data, 'G+P0', start, fixBackground)
+    assert result.fittedParameters()[3] == 5.
+    assert result.errors()[3] == result.errorsPlus()[3] == result.errorsMinus()[3] == 0.0
+    assert result.ndf() == 41 - 3
+    compareResults(result, reference, 3)
+
+    free = fit('Chi2', 'Minuit2', data, 'G+P0', start)
+    def looseBounds(fitter, names):
+        fitter.fitParameterSettings(names[2]).setBounds(0.1, 5.)
+    loose = fit('Chi2', 'Minuit2', data, 'G+P0', start, looseBounds)
+    assert loose.fitStatus() == 0
+    assert N.all(N.abs(N.array(loose.fittedParameters()) - free.fittedParameters()) <= 1e-2 * N.array(free.errors()))
+    assert N.allclose(loose.errors(), free.errors(), rtol=2e-2)
+    # the width of the peak is about 0.8
+    def tightBounds(fitter, names):
+        fitter.fitParameterSettings(names[2]).setBounds(0.3, 0.6)
+    tight = fit('Chi2', 'Minuit2', data, 'G+P0', [40., 0., 0.5, 5.], tightBounds)
+    assert tight.isValid()
+    assert 0.59 < tight.fittedParameters()[2] <= 0.6
+
+
+def testMinuit2Constraints():
+    """ A constrained parameter follows the free ones in both engines """
+    requireMinuit2()
+    data = makeHistogram(3)
+    start = [40., 0., 1., 4.]
+    def constrainBackground(fitter, names):
+        fitter.setConstraint('%s = 0.1 * %s' % (names[3], names[0]))
+    reference = fit('Chi2', 'PAIDA', data, 'G+P0', start, constrainBackground)
+    result = fit('Chi2', 'Minuit2', data, 'G+P0', start, constrainBackground)
+    parameters = result.fittedParameters()
+    assert abs(parameters[3] - 0.1 * parameters[0]) < 1e-12 * parameters[3]
+    assert result.errors()[3] == 0.0
+    compareResults(result, reference, 3)
+
+
+def testMinuit2Exceptions():
+    """ An exception in the objective stops the fit and is raised by fit, and reported by fitMany """
+    requireMinuit2()
+    data = makeHistogram(4)
+    fitter = IFitter('BinnedMaximumLikelihood', 'Minuit2')
+    # evaluated point by point, the log of a negative model raises
+    fitter.setVectorized(False)
+    function = makeFunction('P1', [-1., 0.])
+    try:
+        fitter.fit(data, function)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('the ValueError of the objective must be raised')
+    result, = fitter.fitMany([data], function, processes=1)
+    assert result.fitStatus() == -2 and not result.isValid()
+    assert result.dataDescription().startswith('ValueError')
+    # the fitter is not left in a broken state
+    result = fitter.fit(data, makeFunction('P1', [10., 0.]))
+    assert result.fitStatus() == 0
+
+
+
+class _BaselineFitter(IFitter):
+    """ Scans the asymmetric errors as before the scans were independent tasks:
+        one after the other on the same parameter space, with only the scanned parameter moved at the start.
+    """
+    def _getAsymmetricError(self, evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum, up, parabolicErrors, errorMatrix=None):
+        currentSpace = IFitter_chi2_scipy.copyEvaluatorParameterSpace(evaluatorParameterSpace)
+        errors = []
+        for i, parameterName in enumerate(parameterNames):
+            if i in freeIndices:
+                valuei = currentSpace[parameterName]
+                values = []
+                for shift in [-parabolicErrors[i], parabolicErrors[i]]:
+                    evaluatorParameterSpace[parameterName] = valuei + shift
+                    value, warnflag, mesg = self._asymmetricErrorSearch(evaluatorValue, evaluatorGradient, evaluatorHessian, evaluatorParameterSpace, parameterNames, freeParameterNames, limits, constraints, freeIndices, fixedIndices, minimum + up, i, parameterName)
+                    if warnflag != 0:
+                        return None
+                    values.append(value)
+                errors.append([valuei - min(values), max(values) - valuei])
+            else:
+                errors.append([0.0, 0.0])
+        IFitter_chi2_scipy.updateEvaluatorParameterSpace(currentSpace, evaluatorParameterSpace)
+        return errors
+
+
+def makeSlope(seed=0):
+    """ A peak on a sloped background far from x = 0, so that the parameters of the background are correlated """
+    x = N.linspace(4., 10., 41)
+    counts = N.random.RandomState(seed).poisson(40. * N.exp(-0.5 * ((x - 7.) / 0.6)**2) + 30. - 2. * x).astype(float)
+    errors = N.sqrt(N.maximum(counts, 1.))
+    return _FitData(x, counts, errors, errors)
+
+
+def correlation(result, i, j):
+    return result.covMatrixElement(i, j) / N.sqrt(result.covMatrixElement(i, i) * result.covMatrixElement(j, j))
+
+
+def testAsymmetricErrorsInParallel():
+    """ The error scans give the same errors in a pool of processes as one after the other """
+    data = makeSlope()
+    start = [30., 7., 0.5, 20., -1.]
+    serial = IFitter('Chi2', 'PAIDA', {'processes': 1}).fit(data, makeFunction('G+P1', start))
+    parallel = IFitter('Chi2', 'PAIDA', {'processes': 3}).fit(data, makeFunction('G+P1', start))
+    assert serial.fitStatus() == parallel.fitStatus() == 0
+    assert serial.fittedParameters() == parallel.fittedParameters()
+    assert serial.errorsPlus() == parallel.errorsPlus()
+    assert serial.errorsMinus() == parallel.errorsMinus()
+    assert None not in serial.errorsPlus()
+
+
+def testAsymmetricErrorsCorrelated():
+    """ The independent scans find the errors of the baseline scans on a correlated fit """
+    data = makeSlope(1)
+    start = [30., 7., 0.5, 20., -1.]
+    result = IFitter('Chi2', 'PAIDA').fit(data, makeFunction('G+P1', start))
+    baseline = _BaselineFitter('Chi2', 'PAIDA').fit(data, makeFunction('G+P1', start))
+    assert result.fitStatus() == baseline.fitStatus() == 0
+    assert correlation(result, 3, 4) < -0.9
+    assert result.fittedParameters() == baseline.fittedParameters()
+    assert N.allclose(result.errorsPlus(), baseline.errorsPlus(), rtol=1e-3)
+    assert N.allclose(result.errorsMinus(), baseline.errorsMinus(), rtol=1e-3)
+    # the chi2 of a line is a parabola, its errors are the parabolic ones
+    line = IFitter('Chi2', 'PAIDA').fit(data, makeFunction('P1', [20., -1.]))
+    assert correlation(line, 0, 1) < -0.9
+    assert N.allclose(line.errorsPlus(), line.errors(), rtol=1e-3)
+    assert N.allclose(line.errorsMinus(), line.errors(), rtol=1e-3)
+
+
+
+def testFitManyOrder():
+    """ fitMany gives the results of fit for each dataset, in order, also from a pool of processes """
+    datasets = [makeHistogram(seed, mean=0.3 * (seed - 3)) for seed in range(7)]
+    fitter = IFitter('Chi2', 'PAIDA')
+    function = makeFunction('G+P0', [40., 0., 1., 3.])
+    single = [fitter.fit(data, function) for data in datasets]
+    for processes in [1, 3]:
+        results = fitter.fitMany(datasets, function, processes=processes)
+        assert len(results) == len(datasets)
+        for result, reference in zip(results, single):
+            assert result.fitStatus() == reference.fitStatus() == 0
+            assert N.allclose(result.fittedParameters(), reference.fittedParameters(), rtol=1e-9)
+            assert N.allclose(result.errors(), reference.errors(), rtol=1e-9)
+            assert N.allclose(result.errorsPlus(), reference.errorsPlus(), rtol=1e-9)
+            assert result.fittedFunction().parameters() == result.fittedParameters()
+        # the means increase with the index of the dataset
+        means = [result.fittedParameters()[1] for result in results]
+        assert means == sorted(means)
+
+
+def testFitManyFailure():
+    """ A dataset whose fit raises gets status -2 and the exception, the other fits are not affected """
+    good = makeHistogram(5)
+    bad = makeHistogram(6)
+    # the line is negative at these points, and the log of the likelihood raises
+    bad._connection[0] = [[x - 20.] for x, in bad._connection[0]]
+    fitter = IFitter('BinnedMaximumLikelihood', 'PAIDA')
+    fitter.setVectorized(False)
+    function = makeFunction('G+P1', [40., 0., 1., 5., 0.5])
+    reference = fitter.fit(good, function)
+    assert reference.fitStatus() == 0
+    for processes in [1, 2]:
+        results = fitter.fitMany([good, bad, good], function, processes=processes)
+        assert [result.fitStatus() for result in results] == [0, -2, 0]
+        failed = results[1]
+        assert not failed.isValid()
+        assert failed.dataDescription().startswith('ValueError: ')
+        assert failed.fittedFunction() is None
+        assert failed.fittedParameterNames() == function.parameterNames()
+        for result in results[::2]:
+            assert N.allclose(result.fittedParameters(), reference.fittedParameters(), rtol=1e-9)
+
+
+def testFitManyFunction():
+    """ The function that fitMany is given is not changed, each result has its own fitted function """
+    datasets = [makeHistogram(seed) for seed in range(4)]
+    fitter = IFitter('Chi2', 'PAIDA')
+    start = [40., 0., 1., 3.]
+    function = makeFunction('G+P0', start)
+    names = sorted(function._innerParameterNameSpace.keys())
+    for processes in [1, 2]:
+        results = fitter.fitMany(datasets, function, processes=processes)
+        assert function.parameters() == start
+        assert sorted(function._innerParameterNameSpace.keys()) == names
+        fitted = [result.fittedFunction() for result in results]
+        assert len(set([id(f) for f in fitted + [function]])) == len(fitted) + 1
+        assert fitted[0].parameters() != fitted[1].parameters()
+
+
+def makeEntries(generate, fitRange, n=4000, seed=0):
+    """ Unbinned data from generate(random, size), with the fit range of the first axis restricted to fitRange """
+    x = generate(N.random.RandomState(seed), n)
+    return _FitData(x, ranges=[_Range([fitRange])]), x[(fitRange[0] <= x) & (x <= fitRange[1])]
+
+
+def truncatedMaximum(logPdf, start, x):
+    """ The parameters where the log likelihood of the normalized PDF of x is largest """
+    from scipy.optimize import fmin
+    return fmin(lambda parameters: -N.sum(logPdf(x, parameters)), start, xtol=1e-10, ftol=1e-12, maxiter=10000, disp=False)
+
+
+def fitNormalized(data, model, start, fixed):
+    fitter = IFitter('UnbinnedMaximumLikelihood', 'SimplePAIDA')
+    fitter.setNormalizePDF(True)
+    function = makeFunction(model, start)
+    for i in fixed:
+        fitter.fitParameterSettings(function.parameterNames()[i]).setFixed(True)
+    return fitter.fit(data, function)
+
+
+def testNormalizedGaussian():
+    """ A normalized fit of a gaussian on part of its range finds the parameters the entries were drawn with """
+    from scipy.special import erf
+    fitRange = (-0.5, 1.5)
+    data, x = makeEntries(lambda random, n: random.normal(0.3, 0.7, n), fitRange)
+    result = fitNormalized(data, 'G', [1., 0., 1.], [0])
+    assert result.fitStatus() == 0
+    mean, sigma = result.fittedParameters()[1:]
+    errors = result.errors()[1:]
+    assert abs(mean - 0.3) < 4. * errors[0] and abs(sigma - 0.7) < 4. * errors[1]
+    def logPdf(x, parameters):
+        mean, sigma = parameters
+        norm = 0.5 * (erf((fitRange[1] - mean) / (N.sqrt(2.) * sigma)) - erf((fitRange[0] - mean) / (N.sqrt(2.) * sigma)))
+        return -0.5 * ((x - mean) / sigma)**2 - N.log(N.sqrt(2. * N.pi) * sigma * norm)
+    expected = truncatedMaximum(logPdf, [0.3, 0.7], x)
+    assert N.allclose([mean, sigma], expected, rtol=0., atol=1e-2 * min(errors))
+    # the minimum is the -log likelihood of the normalized PDF
+    assert abs(result._minimum + N.sum(logPdf(x, [mean, sigma]))) < 1e-8 * len(x)
+
+
+def testNormalizedExponential():
+    """ The same for an exponential decay, where the lower bound of the range cuts most of the entries """
+    fitRange = (0.5, 3.)
+    data, x = makeEntries(lambda random, n: random.exponential(1. / 1.5, n), fitRange, 20000)
+    result = fitNormalized(data, 'E', [1., -1.], [0])
+    assert result.fitStatus() == 0
+    slope = result.fittedParameters()[1]
+    error = result.errors()[1]
+    assert abs(slope + 1.5) < 4. * error
+    def logPdf(x, parameters):
+        slope, = parameters
+        return slope * x - N.log((N.exp(slope * fitRange[1]) - N.exp(slope * fitRange[0])) / slope)
+    assert abs(slope - truncatedMaximum(logPdf, [-1.5], x)[0]) < 1e-2 * error
+
+
+def testNormalizationOff():
+    """ Without normalization the likelihood is that of the function as it is, and fits that are not unbinned ignore it """
+    data, x = makeEntries(lambda random, n: random.normal(0.3, 0.7, n), (-3., 3.), 2000)
+    # a gaussian with unit integral, whose maximum likelihood is at the mean and spread of the entries
+    start = [1., 0., 1.]
+    results = []
+    for normalize in [None, False]:
+        fitter = IFitter('UnbinnedMaximumLikelihood', 'SimplePAIDA')
+        if normalize is not None:
+            fitter.setNormalizePDF(normalize)
+        assert not fitter.isNormalizePDF()
+        names = makeFunction('G', start).parameterNames()
+        fitter.setConstraint('%s = 1.0 / (sqrt(2.0 * pi) * %s)' % (names[0], names[2]))
+        results.append(fitter.fit(data, makeFunction('G', start)))
+    result = results[0]
+    assert result.fitStatus() == 0
+    assert result.fittedParameters() == results[1].fittedParameters()
+    mean, sigma = result.fittedParameters()[1:]
+    assert N.allclose([mean, sigma], [x.mean(), x.std()], rtol=0., atol=1e-2 * min(result.errors()[1:]))
+    pdf = N.exp(-0.5 * ((x - mean) / sigma)**2) / (N.sqrt(2. * N.pi) * sigma)
+    assert abs(result._minimum + N.sum(N.log(pdf))) < 1e-8 * len(x)
+    # binned fits are not normalized
+    data = makeHistogram(7)
+    for method in ['Chi2', 'BinnedMaximumLikelihood']:
+        fitter = IFitter(method, 'SimplePAIDA')
+        reference = fitter.fit(data, makeFunction('G+P0', [40., 0., 1., 3.]))
+        fitter.setNormalizePDF(True)
+        result = fitter.fit(data, makeFunction('G+P0', [40., 0., 1., 3.]))
+        assert result.fittedParameters() == reference.fittedParameters()
+        assert result.quality() == reference.quality()
+
+
+def baselineInRangeData(fitMethodName, fitData):
+    """ The in-range data as they were selected before the masks, one point after the other """
+    inRangeData = []
+    centers, weights, errorsP, errorsM = fitData._connection
+    for i, center in enumerate(centers):
+        if not all([fitData.range(axis).isInRange(center[axis]) for axis in range(fitData.dimension())]):
+            continue
+        if fitMethodName == 'Chi2':
+            errors = []
+            for error in [errorsP[i], errorsM[i]]:
+                if error is None or error == 0.0:
+                    if not weights[i] > 0.0:
+                        break
+                    error = weights[i]
+                errors.append(error)
+            else:
+                inRangeData.append([center, weights[i]] + errors)
+        elif fitMethodName == 'CleverChi2':
+            if weights[i] != 0.0:
+                inRangeData.append([center, weights[i]])
+        elif fitMethodName == 'UnbinnedMaximumLikelihood':
+            inRangeData.append([center])
+        else:
+            inRangeData.append([center, weights[i]])
+    return inRangeData
+
+
+inRangeMethods = ['Chi2', 'CleverChi2', 'LeastSquares', 'BinnedMaximumLikelihood', 'UnbinnedMaximumLikelihood']
+
+
+def makeMixedPoints():
+    """ Points on a grid, some exactly on the bounds of the ranges, with every kind of weight and error """
+    x = [-2., -1., -0.5, 0., 0.5, 1., 1.5, 2., 3., 4.]
+    y = [-1., 0., 1.]
+    centers = [[a, b] for a in x for b in y]
+    n = len(centers)
+    weights = [[2., 0., -1., 0.5][i % 4] for i in range(n)]
+    errorsP = [[None, 0., 1.5, float('nan'), 0.3][i % 5] for i in range(n)]
+    errorsM = [[0.2, None, 0., 0.7, 0.][i % 6 % 5] for i in range(n)]
+    ranges = [_Range([(IRangeSet._NINF, -1.), (-0.5, 0.5), (1.5, 3.)]), _Range([(0., 1.)])]
+    return _FitData(centers, weights, errorsP, errorsM, ranges)
+
+
+def testInRangeData():
+    """ The masks select the points of the per-point range check, with the same replaced and excluded errors """
+    data = makeMixedPoints()
+    for method in inRangeMethods:
+        inRangeData = IFitter(method, 'SimplePAIDA')._getInRangeData(data)
+        expected = baselineInRangeData(method, data)
+        # nan errors are kept, and equal here
+        N.testing.assert_equal(list(inRangeData), expected)
+        arrays = inRangeData.arrays
+        N.testing.assert_equal(arrays['x'], N.array([binData[0] for binData in expected]).T)
+        assert arrays['x'].flags['C_CONTIGUOUS']
+        for name, k in [('values', 1), ('errorsP', 2), ('errorsM', 3)]:
+            if len(expected[0]) > k:
+                N.testing.assert_equal(arrays[name], [binData[k] for binData in expected])
+            else:
+                assert name not in arrays
+    # points on a bound are in the range, points between the intervals are not
+    unbinned = IFitter('UnbinnedMaximumLikelihood', 'SimplePAIDA')._getInRangeData(data)
+    assert sorted(set([center[0] for center, in unbinned])) == [-2., -1., -0.5, 0., 0.5, 1.5, 2., 3.]
+    assert sorted(set([center[1] for center, in unbinned])) == [0., 1.]
+    # missing and zero errors are replaced by the weight if it is positive, otherwise the point is excluded
+    chi2 = IFitter('Chi2', 'SimplePAIDA')._getInRangeData(data)
+    replaced = excluded = 0
+    for i, center in enumerate(data._connection[0]):
+        if not center in [binData[0] for binData in unbinned]:
+            continue
+        weight, errorP, errorM = data._connection[1][i], data._connection[2][i], data._connection[3][i]
+        missing = [error is None or error == 0. for error in [errorP, errorM]]
+        if weight > 0.0 or not any(missing):
+            expected = [errorP, errorM]
+            for k in range(2):
+                if missing[k]:
+                    expected[k] = weight
+                    replaced += 1
+            N.testing.assert_equal(chi2[[binData[0] for binData in chi2].index(center)], [center, weight] + expected)
+        else:
+            assert not center in [binData[0] for binData in chi2]
+            excluded += 1
+    assert replaced > 5 and excluded > 5
+    # nothing in range
+    data = _FitData([-2., -1.], [1., 1.], ranges=[_Range([(0., 1.)])])
+    for method in inRangeMethods:
+        assert list(IFitter(method, 'SimplePAIDA')._getInRangeData(data)) == []
+
+
+def testInRangeCache():
+    """ The in-range data are kept on the data until the range, the fit method or the connection changes """
+    data = makeHistogram(8)
+    fitter = IFitter('Chi2', 'SimplePAIDA')
+    first = fitter._getInRangeData(data)
+    assert len(first) == 41
+    assert fitter._getInRangeData(data) is first
+    assert IFitter('Chi2', 'PAIDA')._getInRangeData(data) is first
+    # another fit method
+    fitter.setFitMethod('CleverChi2')
+    clever = fitter._getInRangeData(data)
+    assert clever is not first and len(clever[0]) == 2
+    fitter.setFitMethod('Chi2')
+    again = fitter._getInRangeData(data)
+    assert again is not clever and again == first
+    # another range, also when the range object is changed in place
+    data._ranges = [_Range([(-1., 1.)])]
+    narrow = fitter._getInRangeData(data)
+    assert len(narrow) == len([x for x, in data._connection[0] if -1. <= x <= 1.]) < 41
+    data._ranges[0]._intervals = [(-1., 0.)]
+    assert len(fitter._getInRangeData(data)) < len(narrow)
+    # other points, and refits see the new range
+    data._ranges = [_Range()]
+    data._connection = [[[x + 1.] for x, in data._connection[0]]] + data._connection[1:]
+    shifted = fitter._getInRangeData(data)
+    assert [center for center, weight, errorP, errorM in shifted] == data._connection[0]
+    start = [40., 0., 1., 3.]
+    full = fitter.fit(data, makeFunction('G+P0', start))
+    data._ranges = [_Range([(-1., 3.)])]
+    part = fitter.fit(data, makeFunction('G+P0', start))
+    assert full.ndf() == 41 - 4 and part.ndf() == len(fitter._getInRangeData(data)) - 4 < full.ndf()
+
+
+perPointValues = {'LeastSquares': '_leastSquaresValue', 'Chi2': '_chi2Value', 'CleverChi2': '_cleverChi2Value',
+                  'BinnedMaximumLikelihood': '_binnedMaximumLikelihoodValue',
+                  'UnbinnedMaximumLikelihood': '_unbinnedMaximumLikelihoodValue'}
+
+
+def makeObjectiveData(method):
+    """ Entries for the unbinned fit, otherwise a histogram; its Chi2 errors below the points are smaller than above """
+    if method == 'UnbinnedMaximumLikelihood':
+        return _FitData(N.random.RandomState(3).normal(0.2, 0.8, 300))
+    centers, counts, errors = makeHistogram(3)._connection[:3]
+    return _FitData(centers, counts, errors, [0.5 * error + 0.3 for error in errors])
+
+
+# away from the minimum, so that the model is above some points and below others
+objectiveParameters = [[45., 0.1, 0.9, 4.], [30., -0.4, 1.3, 7.]]
+
+
+class _CompiledFitter(IFitter):
+    """ A fitter that takes compiled as the compiled model of any function """
+    def __init__(self, method, compiled):
+        IFitter.__init__(self, method, 'SimplePAIDA')
+        self._compiled = compiled
+
+    def _getCompiledModel(self, function):
+        return self._compiled
+
+
+def evaluateObjective(fitter, data, parameters):
+    """ The value of the evaluator of the fitter for G+P0 at parameters, and the per-point value """
+    function = makeFunction('G+P0', parameters)
+    fitter._setEvaluationState(function, fitter._getInRangeData(data))
+    space = IFitter_chi2_scipy.copyEvaluatorParameterSpace(function._innerParameterNameSpace)
+    evaluatorValue = fitter._getEvaluator(fitter.engineName(), fitter.fitMethodName())[0]
+    return evaluatorValue(space), getattr(fitter, perPointValues[fitter.fitMethodName()])(space)
+
+
+def checkObjective(method, vectorized):
+    data = makeObjectiveData(method)
+    fitter = IFitter(method, 'SimplePAIDA')
+    fitter.setVectorized(vectorized)
+    for parameters in objectiveParameters:
+        value, expected = evaluateObjective(fitter, data, parameters)
+        assert fitter._vectorizedModel == vectorized
+        assert (fitter._compiledModel is not None) == vectorized
+        assert N.allclose(value, expected, rtol=1e-10, atol=0.), (method, vectorized, value, expected)
+    if method == 'Chi2':
+        arrays = fitter._inRangeArrays
+        difference = fitter._modelValues(makeFunction('G+P0', parameters)._innerParameterNameSpace) - arrays['values']
+        assert N.any(difference > 0.) and N.any(difference < 0.)
+        assert N.all(arrays['errorsP'] != arrays['errorsM'])
+    if not vectorized:
+        return
+    # a compiled model that gives other values or fails is dropped for the codelet evaluated on arrays
+    for compiled in [None, lambda x, parameters: N.ones(x.shape[1]), lambda x, parameters: x[1],
+                     lambda x, parameters: N.ones(3)]:
+        fitter = _CompiledFitter(method, compiled)
+        for parameters in objectiveParameters:
+            value, expected = evaluateObjective(fitter, data, parameters)
+            assert fitter._vectorizedModel and fitter._compiledModel is None
+            assert N.allclose(value, expected, rtol=1e-10, atol=0.), (method, value, expected)
+
+
+def testVectorizedObjective():
+    """ The objective of each fit method on the in-range arrays equals the sum over the points """
+    for method in inRangeMethods:
+        for vectorized in [True, False]:
+            yield checkObjective, method, vectorized
+
+
+def setDerivativeState(method, parameters):
+    """ A vectorized fitter evaluating G+P0 on the objective data of the method, and the parameter space """
+    fitter = IFitter(method, 'SimplePAIDA')
+    function = makeFunction('G+P0', parameters)
+    fitter._setEvaluationState(function, fitter._getInRangeData(makeObjectiveData(method)))
+    return fitter, IFitter_chi2_scipy.copyEvaluatorParameterSpace(function._innerParameterNameSpace)
+
+
+def checkDerivatives(method):
+    perPointGradient = getattr(IFitter, perPointValues[method].replace('Value', 'Gradient'))
+    perPointHessian = getattr(IFitter, perPointValues[method].replace('Value', 'Hessian'))
+    for parameters in objectiveParameters:
+        fitter, space = setDerivativeState(method, parameters)
+        assert fitter._vectorizedDerivatives
+        value, gradient, hessian = fitter._getEvaluator('SimplePAIDA', method)
+        assert gradient == fitter._gradientVectorized and hessian == fitter._hessianVectorized
+        n = len(parameters)
+        gradients = N.array([gradient(space, i) for i in range(n)])
+        hessians = N.array([[hessian(space, i, j) for j in range(n)] for i in range(n)])
+        expectedGradients = N.array([perPointGradient(fitter, space, i) for i in range(n)])
+        expectedHessians = N.array([[perPointHessian(fitter, space, i, j) for j in range(n)] for i in range(n)])
+        assert N.allclose(gradients, expectedGradients, rtol=1e-8, atol=1e-8 * N.abs(expectedGradients).max()), method
+        # second derivatives that paida takes numerically differ by the rounding of the values on arrays
+        assert N.allclose(hessians, expectedHessians, rtol=1e-6, atol=1e-6 * N.abs(expectedHessians).max()), method
+        assert N.all(hessians == hessians.T)
+        # the Chi2 weights change where the model crosses a point, and those of CleverChi2 are held fixed
+        # like in the loops, so only the gradients of the other methods are those of the value
+        if method in ['Chi2', 'CleverChi2']:
+            continue
+        steps = 1e-6 * N.maximum(N.abs(parameters), 1.)
+        differences = []
+        for i, name in enumerate(makeFunction('G+P0', parameters).parameterNames()):
+            values = []
+            for sign in [1., -1.]:
+                shifted = dict(space)
+                shifted[name] = space[name] + sign * steps[i]
+                values.append(value(shifted))
+            differences.append((values[0] - values[1]) / (2. * steps[i]))
+        assert N.allclose(gradients, differences, rtol=1e-4, atol=1e-6 * N.abs(gradients).max()), method
+
+
+def testVectorizedDerivatives():
+    """ The gradient and Hessian of each fit method on the in-range arrays equal the sums over the points """
+    for method in inRangeMethods:
+        yield checkDerivatives, method
+
+
+def testDerivativeCache():
+    """ The model derivatives are computed once for all elements at the same parameters, and again when they change """
+    fitter, space = setDerivativeState('BinnedMaximumLikelihood', objectiveParameters[0])
+    function = fitter._function
+    def derivatives(parameterNameSpace):
+        gradients = [fitter._gradientVectorized(parameterNameSpace, i) for i in range(4)]
+        return gradients, [[fitter._hessianVectorized(parameterNameSpace, i, j) for j in range(4)] for i in range(4)]
+    expected = derivatives(space)
+    cache = fitter._derivativeCache
+    assert cache['key'] == tuple(objectiveParameters[0])
+    assert sorted(cache['first'].keys()) == range(4)
+    assert sorted(cache['hessian'].keys()) == [(i, j) for i in range(4) for j in range(4)]
+    calls = []
+    deriv1, deriv2 = function._getDeriv1Base, function._getDeriv2Base
+    def countingDeriv1(parameterNameSpace, i):
+        calls.append(i)
+        return deriv1(parameterNameSpace, i)
+    def countingDeriv2(parameterNameSpace, i, j):
+        calls.append((i, j))
+        return deriv2(parameterNameSpace, i, j)
+    function._getDeriv1Base, function._getDeriv2Base = countingDeriv1, countingDeriv2
+    # the same parameters, also in another name space
+    assert derivatives(space) == derivatives(dict(space)) == expected
+    assert fitter._derivativeCache is cache and calls == []
+    # other parameters
+    name = function.parameterNames()[1]
+    space[name] += 0.2
+    gradient = fitter._gradientVectorized(space, 0)
+    assert fitter._derivativeCache is not cache and len(calls) > 0
+    assert fitter._derivativeCache['key'][1] == objectiveParameters[0][1] + 0.2
+    assert N.allclose(gradient, fitter._binnedMaximumLikelihoodGradient(space, 0), rtol=1e-8)
+    assert gradient != expected[0][0]
+    # a new evaluation state starts without derivatives
+    fitter._setEvaluationState(function, fitter._inRangeData)
+    assert fitter._derivativeCache is None
+
+
+def breakDerivatives(function, order, broken):
+    """ Replaces the derivatives of the given order of the function on arrays by broken(derivatives) """
+    if order == 1:
+        original = function._getDeriv1Base
+    else:
+        original = function._getDeriv2Base
+    def derivative(parameterNameSpace, *indices):
+        values = original(parameterNameSpace, *indices)
+        if N.ndim(parameterNameSpace['x']) == 2:
+            return broken(N.asarray(values))
+        return values
+    if order == 1:
+        function._getDeriv1Base = derivative
+    else:
+        function._getDeriv2Base = derivative
+
+
+def testVectorizedDerivativesRejected():
+    """ Derivatives that do not broadcast to the points, fail or differ on arrays are evaluated point by point """
+    fitter, space = setDerivativeState('Chi2', objectiveParameters[0])
+    function = fitter._function
+    for order in [1, 2]:
+        for broken in [lambda values: values[:3], lambda values: values.reshape((-1, 1)), lambda values: values[None],
+                       lambda values: 1.01 * values, lambda values: values[10]]:
+            clone = makeFunction('G+P0', objectiveParameters[0])
+            breakDerivatives(clone, order, broken)
+            fitter._setEvaluationState(clone, fitter._inRangeData)
+            assert fitter._vectorizedModel and not fitter._vectorizedDerivatives
+            value, gradient, hessian = fitter._getEvaluator('SimplePAIDA', 'Chi2')
+            assert value == fitter._valueVectorized
+            assert gradient == fitter._chi2Gradient and hessian == fitter._chi2Hessian
+    # constraints are applied point by point
+    fitter.setConstraint('%s = 0.1 * %s' % tuple(function.parameterNames()[3::-3]))
+    fitter._setEvaluationState(function, fitter._inRangeData)
+    assert fitter._vectorizedModel and not fitter._vectorizedDerivatives
+    fitter.resetConstraints()
+    fitter._setEvaluationState(function, fitter._inRangeData)
+    assert fitter._vectorizedDerivatives
+
+
+if __name__ == '__main__':
+    testMinuit2Chi2()
+    testMinuit2NLL()
+    testMinuit2LimitsAndFixed()
+    testMinuit2Constraints()
+    testMinuit2Exceptions()
+    testAsymmetricErrorsInParallel()
+    testAsymmetricErrorsCorrelated()
+    testFitManyOrder()
+    testFitManyFailure()
+    testFitManyFunction()
+    testNormalizedGaussian()
+    testNormalizedExponential()
+    testNormalizationOff()
+    testInRangeData()
+    testInRangeCache()
+    for test in testVectorizedObjective():
+        test[0](*test[1:])
+    for test in testVectorizedDerivatives():
+        test[0](*test[1:])
+    testDerivativeCache()
+    testVectorizedDerivativesRejected()
@@ -0,0 +1,66 @@
+from Geometry.geometry import ThreeVector, Momentum, MomentumArray
+from Geometry.hep import angles, cosAngle, openingAngle, azimuth, cos_azimuth, twoBodyDecayMomentum
+from math import sqrt, atan2, acos, pi
+import numpy as N
+
+def makeMomenta(n):
+    p = N.random.uniform(-2., 2., (n, 3))
+    mass = N.random.uniform(0.1, 5., n)
+    return N.column_stack([N.sqrt(mass**2 + (p**2).sum(axis=1)), p])
+
+
+def testAngles():
+    """ Arrays of vectors must give the same angles as one vector at a time
+    """
+    momenta = makeMomenta(100)
+    v3 = MomentumArray(momenta).v3()
+    theta, phi = angles(v3)
+    cosines = cosAngle(v3, v3[0])
+    opening = openingAngle(momenta[:, 1:])
+    for i in range(len(momenta)):
+        x, y, z = momenta[i, 1:]
+        assert abs(theta[i] - atan2(sqrt(x*x + y*y), z)) < 1e-12
+        assert abs(phi[i] - atan2(y, x)) < 1e-12
+        assert abs(cosines[i] - cosAngle(v3[i], v3[0])) < 1e-12
+        assert abs(opening[i] - acos(z / sqrt(x*x + y*y + z*z))) < 1e-12
+    assert abs(openingAngle(ThreeVector(1, 0, 0)) - pi / 2) < 1e-12
+
+
+def testAzimuth():
+    momenta = makeMomenta(20)
+    parent = Momentum(5.279, 1.1, 2.2, 3.3)
+    frame = parent.restFrame
+    azimuths = azimuth(momenta, frame)
+    cosines = cos_azimuth(MomentumArray(momenta), frame)
+    for i in range(len(momenta)):
+        assert abs(azimuths[i] - azimuth(Momentum(momenta[i]), frame)) < 1e-12
+        assert abs(cosines[i] - cos_azimuth(Momentum(momenta[i]), frame)) < 1e-12
+        # a single four-vector as a plain array
+        assert abs(azimuths[i] - azimuth(momenta[i], frame)) < 1e-12
+        assert abs(cosines[i] - cos_azimuth(list(momenta[i]), frame)) < 1e-12
+    # one rest frame per candidate
+    parents = makeMomenta(20)
+    perCandidate = azimuth(momenta, MomentumArray(parents).restFrame)
+    for i in range(len(momenta)):
+        assert abs(perCandidate[i] - azimuth(Momentum(momenta[i]), Momentum(parents[i]).restFrame)) < 1e-12
+
+
+def testTwoBodyDecayMomentum():
+    assert abs(twoBodyDecayMomentum(3., 1., 1.) - sqrt(5.) / 2) < 1e-12
+    try:
+        twoBodyDecayMomentum(1., 1., 1.)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a decay below threshold must raise')
+    hypotheses = N.array([0.14, 0.494, 0.938, 5.2])
+    momenta = twoBodyDecayMomentum(5.279, 0.14, hypotheses)
+    assert list(momenta.mask) == [False, False, False, True]
+    for m, p in zip(hypotheses[:3], momenta[:3]):
+        assert abs(p - twoBodyDecayMomentum(5.279, 0.14, m)) < 1e-12
+
+
+if __name__ == '__main__':
+    testAngles()
+    testAzimuth()
+    testTwoBodyDecayMomentum()
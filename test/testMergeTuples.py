@@ -0,0 +1,348 @@
+from PaidaUtils import paidaUtils, mergeTuples
+from testPaidaUtils import PTypes
+import numpy as N
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import tempfile
+
+
+class _StoredTuple(object):
+    """ An ITuple of a stub tree, with its rows.
+        A pool process that reads row killAt is killed, as if it ran out of memory.
+    """
+    def __init__(self, title, names, types, rows, killAt=None):
+        self._title = title
+        self._names = names
+        self._types = types
+        self._rows = rows
+        self._killAt = killAt
+        self._row = -1
+
+    def title(self):
+        return self._title
+
+    def columns(self):
+        return len(self._names)
+
+    def columnName(self, index):
+        return self._names[index]
+
+    def findColumn(self, name):
+        return self._names.index(name)
+
+    def columnType(self, index):
+        return self._types[index]
+
+    def _get(self, index):
+        return self._rows[self._row][index]
+
+    getInt = getLong = getFloat = getDouble = getByte = _get
+
+    def rows(self):
+        return len(self._rows)
+
+    def start(self):
+        self._row = -1
+
+    def next(self):
+        self._row += 1
+        if self._row == self._killAt and multiprocessing.current_process().name != 'MainProcess':
+            os.kill(os.getpid(), signal.SIGKILL)
+        return self._row < len(self._rows)
+
+
+class _NewTuple(object):
+    """ An ITuple that is filled row by row """
+    def __init__(self, title, names, types):
+        self._stored = (title, list(names), list(types))
+        self._rows = []
+        self._row = [None] * len(names)
+
+    def fill(self, index, value):
+        self._row[index] = value
+
+    def addRow(self):
+        self._rows.append(tuple(self._row))
+
+    def stored(self):
+        return self._stored + (self._rows, None)
+
+
+class _ChainedTuple(object):
+    """ The rows of several tuples one after the other """
+    def __init__(self, title, tuples):
+        self._title = title
+        self._tuples = tuples
+
+    def stored(self):
+        first = self._tuples[0]
+        return (self._title, first._names, first._types, sum([t._rows for t in self._tuples], []), None)
+
+
+class _Tree(object):
+    """ An ITree kept in a file as a pickle of its tuples, written on commit """
+    def __init__(self, fileName, readOnly=False, createNew=False):
+        self._fileName = fileName
+        self._readOnly = readOnly
+        self._tuples = {}
+        self._stored = {}
+        if not createNew:
+            self._stored = pickle.load(open(fileName, 'rb'))
+
+    def find(self, name):
+        return _StoredTuple(*self._stored[name])
+
+    def commit(self):
+        assert not self._readOnly
+        stored = dict((name, t.stored()) for name, t in self._tuples.items())
+        pickle.dump(stored, open(self._fileName, 'wb'), 2)
+
+    def close(self):
+        pass
+
+
+class _TreeFactory(object):
+    def create(self, fileName, readOnly=False, createNew=False):
+        return _Tree(fileName, readOnly, createNew)
+
+
+class _TupleFactory(object):
+    def __init__(self, tree):
+        self._tree = tree
+
+    def create(self, name, title, names, types):
+        self._tree._tuples[name] = _NewTuple(title, names, types)
+        return self._tree._tuples[name]
+
+    def createChained(self, name, title, tuples):
+        self._tree._tuples[name] = _ChainedTuple(title, tuples)
+        return self._tree._tuples[name]
+
+
+class _AnalysisFactory(object):
+    def createTreeFactory(self):
+        return _TreeFactory()
+
+    def createTupleFactory(self, tree):
+        return _TupleFactory(tree)
+
+
+names = ['n', 'x', 'y']
+
+
+def writeInput(fileName, n, seed, killAt=None):
+    """ A tree with a tuple 'events' of n rows, whose float column holds values a float keeps exactly """
+    random = N.random.RandomState(seed)
+    rows = zip(random.randint(-1000, 1000, n).tolist(), random.normal(size=n).tolist(),
+               random.normal(size=n).astype(N.float32).tolist())
+    stored = {'events': ('events %d' % seed, names, [PTypes.Integer, PTypes.Double, PTypes.Float], rows, killAt)}
+    pickle.dump(stored, open(fileName, 'wb'), 2)
+    return rows
+
+
+def readRows(fileName):
+    return pickle.load(open(fileName, 'rb'))['events'][3]
+
+
+def runWithStubTrees(test):
+    """ Runs test(directory) with the paida of mergeTuples replaced by stub trees in a temporary directory """
+    directory = tempfile.mkdtemp()
+    original = mergeTuples.paida
+    mergeTuples.paida = paidaUtils.PAIDA()
+    mergeTuples.paida._analysisFactory = _AnalysisFactory()
+    try:
+        test(directory)
+    finally:
+        mergeTuples.paida = original
+        shutil.rmtree(directory)
+
+
+def makeInputs(directory, sizes, killAt={}):
+    inputs = [os.path.join(directory, 'input%d.aida' % i) for i in range(len(sizes))]
+    for i, (fileName, n) in enumerate(zip(inputs, sizes)):
+        writeInput(fileName, n, i, killAt.get(i))
+    return inputs
+
+
+def chainedRows(inputs, directory):
+    """ The rows of the chain of the inputs, as getChain writes them """
+    fileName = os.path.join(directory, 'chain.aida')
+    tree = mergeTuples.getChain('events', inputs, fileName)
+    tree.commit()
+    tree.close()
+    rows = readRows(fileName)
+    os.remove(fileName)
+    return rows
+
+
+class _Deadlock(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise _Deadlock()
+
+
+def withinSeconds(seconds, function, *args):
+    """ Calls function, and raises _Deadlock if it does not return in time """
+    previous = signal.signal(signal.SIGALRM, _alarm)
+    signal.alarm(seconds)
+    try:
+        return function(*args)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def testMergeFiles():
+    """ mergeFiles writes the rows of the inputs in order, read here or in a pool of processes """
+    def test(directory):
+        inputs = makeInputs(directory, [13, 0, 40, 7, 25])
+        chained = chainedRows(inputs, directory)
+        assert len(chained) == 85
+        for processes in [None, 1, 2, 8]:
+            target = os.path.join(directory, 'merged%s.aida' % processes)
+            messages = []
+            total = withinSeconds(60, mergeTuples.mergeFiles, 'events', inputs, target, 6, processes, messages.append)
+            assert total == 85
+            assert readRows(target) == chained
+            assert len(messages) == len(inputs) + 1
+            assert messages[1].startswith('[2/5] %s: 0 rows' % inputs[1])
+            assert messages[-1].startswith('%s: 85 rows' % target)
+    runWithStubTrees(test)
+
+
+def testMoreInputsThanProcesses():
+    """ The bounded queues of the readers do not block when there are more inputs than processes,
+        and inputs whose chunks are not read are skipped
+    """
+    def test(directory):
+        inputs = makeInputs(directory, [50] * 9)
+        chained = chainedRows(inputs, directory)
+        for processes in [2, 3]:
+            target = os.path.join(directory, 'merged%d.aida' % processes)
+            # each input has 13 chunks, many more than a queue holds
+            withinSeconds(60, mergeTuples.mergeFiles, 'events', inputs, target, 4, processes, mergeTuples._quiet)
+            assert readRows(target) == chained
+        def readSome():
+            rows = []
+            for i, chunks in enumerate(mergeTuples._streamedInputs(inputs, 'events', 4, 2)):
+                if i % 3 == 0:
+                    for chunk in chunks:
+                        rows += zip(*[chunk[name].tolist() for name in names])
+            return rows
+        assert withinSeconds(60, readSome) == chained[:50] + chained[150:200] + chained[300:350]
+    runWithStubTrees(test)
+
+
+_mergeFiles = mergeTuples.mergeFiles
+_mergeLog = []
+
+
+def recordMerge(tupleName, listOfTrees, targetName, *args, **options):
+    """ mergeFiles, which also writes its inputs and target to the log file, also from a pool process """
+    log = open(_mergeLog[0], 'a')
+    log.write(repr((list(listOfTrees), targetName)) + '\n')
+    log.close()
+    return _mergeFiles(tupleName, listOfTrees, targetName, *args, **options)
+
+
+def testParallelMerge():
+    """ parallelMerge merges groups of fanIn files into intermediate files until fanIn are left """
+    def test(directory):
+        inputs = makeInputs(directory, [3 * i for i in range(11)])
+        chained = chainedRows(inputs, directory)
+        target = os.path.join(directory, 'merged.aida')
+        _mergeLog[:] = [os.path.join(directory, 'merges.log')]
+        mergeTuples.mergeFiles = recordMerge
+        try:
+            total = withinSeconds(120, mergeTuples.parallelMerge, 'events', inputs, target, 2, 3, 5, mergeTuples._quiet)
+        finally:
+            mergeTuples.mergeFiles = _mergeFiles
+        assert total == len(chained) == 165
+        assert readRows(target) == chained
+        merges = [eval(line) for line in open(_mergeLog[0])]
+        os.remove(_mergeLog[0])
+        levels = {}
+        for listOfTrees, targetName in merges[:-1]:
+            name = os.path.basename(targetName)
+            levels.setdefault(int(name[5]), []).append((listOfTrees, name))
+        for level in levels.values():
+            level.sort(key=lambda merge: int(merge[1].split('_')[1].split('.')[0]))
+        workDir = os.path.dirname(merges[0][1])
+        def intermediate(level, i):
+            return os.path.join(workDir, 'level%d_%d.aida' % (level, i))
+        # 11 inputs in groups of 3, then 4 intermediate files in groups of 3, then the last 2 into the target
+        assert levels[0] == [(inputs[0:3], 'level0_0.aida'), (inputs[3:6], 'level0_1.aida'),
+                             (inputs[6:9], 'level0_2.aida'), (inputs[9:11], 'level0_3.aida')]
+        assert levels[1] == [([intermediate(0, i) for i in range(3)], 'level1_0.aida'),
+                             ([intermediate(0, 3)], 'level1_1.aida')]
+        assert merges[-1] == ([intermediate(1, 0), intermediate(1, 1)], target)
+        # the intermediate files are gone
+        assert not os.path.exists(workDir)
+        assert sorted(os.listdir(directory)) == sorted([os.path.basename(name) for name in inputs] + ['merged.aida'])
+        # few inputs are merged at once
+        target = os.path.join(directory, 'direct.aida')
+        assert withinSeconds(60, mergeTuples.parallelMerge, 'events', inputs[:4], target, 2, 4, 5, mergeTuples._quiet) == 18
+        assert readRows(target) == chained[:18]
+    runWithStubTrees(test)
+
+
+def testRefuseToOverwrite():
+    """ An existing target is left alone """
+    def test(directory):
+        inputs = makeInputs(directory, [5, 5])
+        target = os.path.join(directory, 'existing.aida')
+        open(target, 'w').write('keep')
+        for merge, args in [(mergeTuples.getChain, ()), (mergeTuples.mergeFiles, ()), (mergeTuples.mergeFiles, (4, 2)),
+                            (mergeTuples.parallelMerge, (2,))]:
+            try:
+                merge('events', inputs, target, *args)
+            except SystemError, e:
+                assert 'target file exists' in str(e)
+            else:
+                raise AssertionError('%s must refuse to overwrite the target' % merge.__name__)
+            assert open(target).read() == 'keep'
+        try:
+            mergeTuples.parallelMerge('events', inputs, os.path.join(directory, 'new.aida'), 2, 1)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('a fanIn of 1 must raise ValueError')
+    runWithStubTrees(test)
+
+
+def testReaderDies():
+    """ A reading process that is killed makes the merge raise instead of waiting forever """
+    def test(directory):
+        inputs = makeInputs(directory, [20, 20, 20, 20], {2: 5})
+        try:
+            withinSeconds(60, mergeTuples.mergeFiles, 'events', inputs, os.path.join(directory, 'merged.aida'),
+                          4, 2, mergeTuples._quiet)
+        except RuntimeError, e:
+            assert 'died' in str(e)
+        else:
+            raise AssertionError('the merge must raise when a reader dies')
+        # a process that merges a group
+        try:
+            withinSeconds(60, mergeTuples.parallelMerge, 'events', inputs, os.path.join(directory, 'parallel.aida'),
+                          2, 2, 4, mergeTuples._quiet)
+        except RuntimeError, e:
+            assert 'died' in str(e)
+        else:
+            raise AssertionError('the merge must raise when a process merging a group dies')
+        # read in this process, the input is fine
+        total = mergeTuples.mergeFiles('events', inputs, os.path.join(directory, 'serial.aida'), 4, None, mergeTuples._quiet)
+        assert total == 80
+    runWithStubTrees(test)
+
+
+if __name__ == '__main__':
+    testMergeFiles()
+    testMoreInputsThanProcesses()
+    testParallelMerge()
+    testRefuseToOverwrite()
+    testReaderDies()
@@ -0,0 +1,129 @@
+from unittest import SkipTest
+try:
+    from Fitting.pyMinuit2 import Minuit
+except ImportError:
+    raise SkipTest('the pyMinuit2 extension is not built')
+import numpy as N
+
+
+def makeLine():
+    """ A straight line with gaussian errors, its chi2 and the exact solution of the linear fit """
+    random = N.random.RandomState(1)
+    x = N.linspace(-1., 3., 20)
+    errors = random.uniform(0.5, 1.5, len(x))
+    y = 2. - 0.7 * x + errors * random.normal(size=len(x))
+    def chi2(values):
+        a, b = values
+        return float(N.sum(((y - a - b * x) / errors)**2))
+    design = N.column_stack([N.ones_like(x), x]) / errors[:, None]
+    covariance = N.linalg.inv(N.dot(design.T, design))
+    solution = N.dot(covariance, N.dot(design.T, y / errors))
+    return chi2, solution, covariance
+
+
+def testMigradHesse():
+    """ The minimum and covariance of a chi2 that is quadratic in the parameters """
+    chi2, solution, covariance = makeLine()
+    minuit = Minuit(chi2, ['a', 'b'], [0., 0.], up=1.0)
+    assert minuit.migrad()
+    assert N.allclose(minuit.values, solution, rtol=0., atol=1e-3 * N.sqrt(covariance.diagonal()).min())
+    assert abs(minuit.fval - chi2(solution)) < 1e-3
+    assert minuit.hesse()
+    assert N.allclose(minuit.covariance, covariance, rtol=1e-3)
+    assert N.allclose(minuit.errors, N.sqrt(covariance.diagonal()), rtol=1e-3)
+    # the errors of a quadratic function are symmetric
+    for i in range(2):
+        lower, upper, valid = minuit.minos(i)
+        assert valid
+        assert N.allclose([-lower, upper], N.sqrt(covariance[i, i]), rtol=1e-3)
+
+
+def testMinosNLL():
+    """ MINOS on the -log likelihood of exponential decay times, where the interval is asymmetric """
+    times = N.random.RandomState(2).exponential(0.5, 20)
+    n, total = len(times), times.sum()
+    def nll(values):
+        return -n * N.log(values[0]) + values[0] * total
+    rate = n / total
+    minuit = Minuit(nll, ['rate'], [1.], limits=[(1e-6, None)], up=0.5)
+    assert minuit.migrad()
+    assert abs(minuit.values[0] - rate) < 1e-3 * rate
+    minuit.hesse()
+    assert abs(minuit.errors[0] - rate / N.sqrt(n)) < 1e-2 * rate / N.sqrt(n)
+    lower, upper, valid = minuit.minos(0)
+    assert valid
+    # where the -log likelihood rises by up, found by bisection on each side
+    def crossing(inside, outside):
+        for i in range(100):
+            middle = 0.5 * (inside + outside)
+            if nll([middle]) - nll([rate]) < 0.5:
+                inside = middle
+            else:
+                outside = middle
+        return middle
+    assert abs(rate + lower - crossing(rate, 0.1 * rate)) < 1e-3 * rate
+    assert abs(rate + upper - crossing(rate, 10. * rate)) < 1e-3 * rate
+    assert upper > -lower
+
+
+def testLimitsAndFixed():
+    """ A limit that is reached and a fixed parameter, which is not part of the covariance """
+    chi2, solution, covariance = makeLine()
+    minuit = Minuit(chi2, ['a', 'b'], [0., -0.1], limits=[(None, None), (-0.5, 1.)], up=1.0)
+    minuit.migrad()
+    assert solution[1] < -0.5
+    assert -0.5 <= minuit.values[1] < -0.5 + 1e-3
+    minuit = Minuit(chi2, ['a', 'b'], [0., -0.5], fixed=[1], up=1.0)
+    assert minuit.migrad()
+    assert minuit.values[1] == -0.5
+    minuit.hesse()
+    assert len(minuit.covariance) == 1
+    # the best a for fixed b
+    a = solution[0] + covariance[0, 1] / covariance[1, 1] * (-0.5 - solution[1])
+    assert abs(minuit.values[0] - a) < 1e-3
+    assert minuit.minos(0)[2]
+
+
+class _Failure(Exception):
+    pass
+
+
+def testExceptions():
+    """ An exception in the function is raised again by migrad, hesse and minos """
+    chi2, solution, covariance = makeLine()
+    for method in ['migrad', 'hesse', 'minos']:
+        calls = []
+        def function(values):
+            if calls == [method]:
+                raise _Failure(method)
+            return chi2(values)
+        minuit = Minuit(function, ['a', 'b'], [0., 0.])
+        try:
+            minuit.hesse()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('hesse must need migrad first')
+        if method != 'migrad':
+            assert minuit.migrad()
+        calls.append(method)
+        try:
+            if method == 'minos':
+                minuit.minos(0)
+            else:
+                getattr(minuit, method)()
+        except _Failure, e:
+            assert str(e) == method
+        else:
+            raise AssertionError('%s must raise the exception of the function' % method)
+        # the minimizer can be used again
+        del calls[:]
+        assert minuit.migrad()
+        assert N.allclose(minuit.values, solution, atol=1e-2)
+
+
+if __name__ == '__main__':
+    testMigradHesse()
+    testMinosNLL()
+    testLimitsAndFixed()
+    testExceptions()
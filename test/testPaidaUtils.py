@@ -0,0 +1,723 @@
+from PaidaUtils import paidaUtils
+from PaidaUtils.paidaUtils import tupleColumns2arrays, tupleColumn2array, iter_chunks
+from unittest import SkipTest
+import numpy as N
+import bisect
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    PTypes = paidaUtils._importPaida().PTypes
+    havePaida = True
+except ImportError:
+    havePaida = False
+    # the column type tokens of paida, for the tests that only need an ITuple
+    class PTypes:
+        Integer, Long, Float, Double, Byte, String = 'int', 'long', 'float', 'double', 'byte', 'string'
+    class _Paida:
+        pass
+    paidaUtils._paidaModule = _Paida()
+    paidaUtils._paidaModule.PTypes = PTypes
+
+
+class _Tuple(object):
+    """ An ITuple with the given columns, a dict of name: (type, values)
+        knownRows: whether rows() gives the number of rows or -1
+    """
+    def __init__(self, columns, knownRows=True):
+        self._names = list(columns)
+        self._types = [columns[name][0] for name in self._names]
+        self._values = [columns[name][1] for name in self._names]
+        self._knownRows = knownRows
+        self._row = -1
+
+    def findColumn(self, name):
+        return self._names.index(name)
+
+    def columnType(self, index):
+        return self._types[index]
+
+    def _get(self, index):
+        return self._values[index][self._row]
+
+    getInt = getLong = getFloat = getDouble = getByte = _get
+
+    def value(self, name):
+        return self._values[self._names.index(name)][self._row]
+
+    def rows(self):
+        if self._knownRows:
+            return len(self._values[0])
+        return -1
+
+    def start(self):
+        self._row = -1
+
+    def next(self):
+        self._row += 1
+        return self._row < len(self._values[0])
+
+
+class _Evaluator(object):
+    """ An IEvaluator for x * y """
+    def initialize(self, tuple):
+        self._tuple = tuple
+
+    def expression(self):
+        return 'x*y'
+
+    def evaluateDouble(self):
+        return self._tuple.value('x') * self._tuple.value('y')
+
+
+class _Filter(object):
+    """ An IFilter for x > 0 """
+    def initialize(self, tuple):
+        self._tuple = tuple
+
+    def expression(self):
+        return 'x>0'
+
+    def accept(self):
+        return self._tuple.value('x') > 0
+
+
+def makeTuple(n, knownRows=True):
+    random = N.random.RandomState(n)
+    return _Tuple({'n': (PTypes.Integer, list(random.randint(-100, 100, n)))
+                 , 'x': (PTypes.Double, list(random.normal(size=n)))
+                 , 'y': (PTypes.Float, list(random.normal(size=n)))
+                 , 'label': (PTypes.String, ['a'] * n)}, knownRows)
+
+
+def expected(tuple, columns, accept=None):
+    """ The columns read row by row """
+    rows = [i for i in range(len(tuple._values[0]))
+            if accept is None or accept(tuple._values[tuple.findColumn('x')][i])]
+    result = {}
+    for name in columns:
+        if name == 'x*y':
+            x, y = [tuple._values[tuple.findColumn(c)] for c in 'xy']
+            result[name] = [x[i] * y[i] for i in rows]
+        else:
+            result[name] = [tuple._values[tuple.findColumn(name)][i] for i in rows]
+    return result
+
+
+def checkColumns(arrays, reference):
+    assert sorted(arrays.keys()) == sorted(reference.keys())
+    for name in reference:
+        assert len(arrays[name]) == len(reference[name])
+        assert N.allclose(arrays[name], N.asarray(reference[name], arrays[name].dtype), rtol=1e-6)
+
+
+def testColumns():
+    """ Named columns keep their type, evaluators are doubles named by their expression """
+    for knownRows in [True, False]:
+        tuple = makeTuple(1000, knownRows)
+        arrays = tupleColumns2arrays(tuple, ['n', 'x', 'y', _Evaluator()], chunksize=64)
+        assert arrays['n'].dtype == N.int32
+        assert arrays['x'].dtype == N.float64
+        assert arrays['y'].dtype == N.float32
+        assert arrays['x*y'].dtype == N.float64
+        checkColumns(arrays, expected(tuple, ['n', 'x', 'y', 'x*y']))
+        assert N.allclose(tupleColumn2array(tuple, _Evaluator()), arrays['x*y'])
+
+
+def testFilter():
+    for knownRows in [True, False]:
+        tuple = makeTuple(1000, knownRows)
+        arrays = tupleColumns2arrays(tuple, ['n', 'x', _Evaluator()], _Filter(), chunksize=64)
+        reference = expected(tuple, ['n', 'x', 'x*y'], lambda x: x > 0)
+        assert 0 < len(reference['x']) < 1000
+        checkColumns(arrays, reference)
+
+
+def testStructured():
+    for knownRows in [True, False]:
+        tuple = makeTuple(300, knownRows)
+        array = tupleColumns2arrays(tuple, ['n', 'y', _Evaluator()], _Filter(), chunksize=64, structured=True)
+        assert array.dtype.names == ('n', 'y', 'x*y')
+        assert array.dtype['n'] == N.int32 and array.dtype['y'] == N.float32
+        reference = expected(tuple, ['n', 'y', 'x*y'], lambda x: x > 0)
+        checkColumns(dict((name, array[name]) for name in array.dtype.names), reference)
+
+
+def testChunkBoundaries():
+    """ Whole tuples read in chunks, at exact multiples of the chunk size and empty """
+    for n in [0, 1, 63, 64, 65, 128, 200]:
+        tuple = makeTuple(n)
+        for knownRows in [True, False]:
+            for structured in [False, True]:
+                arrays = tupleColumns2arrays(makeTuple(n, knownRows), ['n', 'x'], chunksize=64, structured=structured)
+                if structured:
+                    arrays = dict((name, arrays[name]) for name in arrays.dtype.names)
+                checkColumns(arrays, expected(tuple, ['n', 'x']))
+
+
+def testBadColumns():
+    tuple = makeTuple(10)
+    for columns, error in [(['label'], TypeError), (['x', 'x'], ValueError)]:
+        try:
+            tupleColumns2arrays(tuple, columns)
+        except error:
+            pass
+        else:
+            raise AssertionError('%s must raise %s' % (columns, error.__name__))
+
+
+def joinChunks(chunks, names):
+    return dict((name, N.concatenate([chunk[name] for chunk in chunks] or [N.empty(0)])) for name in names)
+
+
+def testIterChunkSizes():
+    """ iter_chunks gives blocks of chunksize rows and a shorter last one, with the rows of the tuple in order """
+    for n in [0, 1, 63, 64, 65, 128, 200]:
+        for knownRows in [True, False]:
+            tuple = makeTuple(n, knownRows)
+            chunks = list(iter_chunks(tuple, ['n', 'y', _Evaluator()], chunksize=64))
+            sizes = [len(chunk['n']) for chunk in chunks]
+            assert sizes == [64] * (n // 64) + [n % 64] * (n % 64 > 0), (n, sizes)
+            for chunk in chunks:
+                assert sorted(chunk.keys()) == ['n', 'x*y', 'y']
+                assert chunk['n'].dtype == N.int32 and chunk['y'].dtype == N.float32 and chunk['x*y'].dtype == N.float64
+                assert len(chunk['x*y']) == len(chunk['y']) == len(chunk['n'])
+            checkColumns(joinChunks(chunks, ['n', 'y', 'x*y']), expected(tuple, ['n', 'y', 'x*y']))
+            # chunks are separate arrays, so they can be kept
+            if len(chunks) > 1:
+                assert not N.may_share_memory(chunks[0]['n'], chunks[1]['n'])
+
+
+def testIterLastChunk():
+    """ The last chunk holds the remaining rows only, and an exhausted tuple gives no empty chunk """
+    tuple = makeTuple(130)
+    chunks = list(iter_chunks(tuple, ['n', 'x'], chunksize=64))
+    assert [len(chunk['x']) for chunk in chunks] == [64, 64, 2]
+    reference = expected(tuple, ['n', 'x'])
+    checkColumns(chunks[-1], dict((name, values[128:]) for name, values in reference.items()))
+    # the default chunk size reads a small tuple in one chunk
+    chunks = list(iter_chunks(tuple, ['x']))
+    assert len(chunks) == 1 and len(chunks[0]['x']) == 130
+    assert list(iter_chunks(makeTuple(0), ['x'])) == []
+
+
+def testIterChunksFilter():
+    """ Only the accepted rows count towards a chunk """
+    tuple = makeTuple(1000)
+    chunks = list(iter_chunks(tuple, ['x', _Evaluator()], chunksize=50, filter=_Filter()))
+    reference = expected(tuple, ['x', 'x*y'], lambda x: x > 0)
+    assert [len(chunk['x']) for chunk in chunks[:-1]] == [50] * (len(chunks) - 1)
+    assert 0 < len(chunks[-1]['x']) <= 50
+    assert sum([len(chunk['x']) for chunk in chunks]) == len(reference['x'])
+    checkColumns(joinChunks(chunks, ['x', 'x*y']), reference)
+    assert (joinChunks(chunks, ['x'])['x'] > 0).all()
+    # a filter that rejects every row
+    class _None(_Filter):
+        def accept(self):
+            return False
+    assert list(iter_chunks(tuple, ['x'], chunksize=50, filter=_None())) == []
+
+
+def _zeros(shape):
+    if len(shape) == 1:
+        return [0.0] * shape[0]
+    return [_zeros(shape[1:]) for i in range(shape[0])]
+
+
+class _Histogram(object):
+    """ An IHistogram1D or IHistogram2D that keeps its sums per bin, in nested lists indexed by the AIDA bin index of each axis.
+        Its totals are computed from the bins.
+    """
+    def __init__(self, *edges):
+        self._edges = [list(e) for e in edges]
+        self.fills = 0
+        self.reset()
+
+    def reset(self):
+        shape = [len(e) + 1 for e in self._edges]
+        for name in ['_binEntries', '_binSumOfWeights', '_binSumOfErrors']:
+            setattr(self, name, _zeros(shape))
+        for axis in 'XY'[:len(shape)]:
+            setattr(self, '_binSumOfTorques' + axis, _zeros(shape))
+            setattr(self, '_binSumOfInertials' + axis, _zeros(shape))
+
+    def _index(self, value, edges):
+        if value < edges[0]:
+            return -2
+        if value >= edges[-1]:
+            return -1
+        return bisect.bisect_right(edges, value) - 1
+
+    def fill(self, *point):
+        self.fills += 1
+        coordinates, weight = point[:-1], point[-1]
+        index = [self._index(value, edges) for value, edges in zip(coordinates, self._edges)]
+        def add(table, value):
+            for i in index[:-1]:
+                table = table[i]
+            table[index[-1]] += value
+        add(self._binEntries, 1)
+        add(self._binSumOfWeights, weight)
+        add(self._binSumOfErrors, weight * weight)
+        for axis, value in zip('XY', coordinates):
+            add(getattr(self, '_binSumOfTorques' + axis), value * weight)
+            add(getattr(self, '_binSumOfInertials' + axis), value * value * weight)
+
+    def _bin(self, name, index):
+        table = getattr(self, name)
+        for i in index:
+            table = table[i]
+        return table
+
+    def _bins(self, inRange):
+        if inRange:
+            return itertools.product(*[range(len(e) - 1) for e in self._edges])
+        return itertools.product(*[range(-2, len(e) - 1) for e in self._edges])
+
+    def _sum(self, name, inRange=True):
+        return sum([self._bin(name, index) for index in self._bins(inRange)])
+
+    def binEntries(self, *index):
+        return self._bin('_binEntries', index)
+
+    def binHeight(self, *index):
+        return self._bin('_binSumOfWeights', index)
+
+    def binError(self, *index):
+        return N.sqrt(self._bin('_binSumOfErrors', index))
+
+    def _binMean(self, axis, index):
+        height = self.binHeight(*index)
+        if height == 0.0:
+            raise ZeroDivisionError('empty bin')
+        return self._bin('_binSumOfTorques' + axis, index) / height
+
+    def binMean(self, index):
+        return self._binMean('X', (index,))
+
+    def binMeanX(self, *index):
+        return self._binMean('X', index)
+
+    def binMeanY(self, *index):
+        return self._binMean('Y', index)
+
+    def _axisSum(self, name, axis, i):
+        return sum([self._bin(name, index) for index in self._bins(False) if index[axis] == i])
+
+    def binEntriesX(self, i):
+        return self._axisSum('_binEntries', 0, i)
+
+    def binEntriesY(self, i):
+        return self._axisSum('_binEntries', 1, i)
+
+    def binHeightX(self, i):
+        return self._axisSum('_binSumOfWeights', 0, i)
+
+    def binHeightY(self, i):
+        return self._axisSum('_binSumOfWeights', 1, i)
+
+    def entries(self):
+        return self._sum('_binEntries')
+
+    def allEntries(self):
+        return self._sum('_binEntries', False)
+
+    def extraEntries(self):
+        return self.allEntries() - self.entries()
+
+    def sumBinHeights(self):
+        return self._sum('_binSumOfWeights')
+
+    def sumAllBinHeights(self):
+        return self._sum('_binSumOfWeights', False)
+
+    def sumExtraBinHeights(self):
+        return self.sumAllBinHeights() - self.sumBinHeights()
+
+    def equivalentBinEntries(self):
+        return self.sumBinHeights()**2 / self._sum('_binSumOfErrors')
+
+    def minBinHeight(self):
+        return min([self.binHeight(*index) for index in self._bins(True)])
+
+    def maxBinHeight(self):
+        return max([self.binHeight(*index) for index in self._bins(True)])
+
+    def _mean(self, axis):
+        return self._sum('_binSumOfTorques' + axis) / self.sumBinHeights()
+
+    def _rms(self, axis):
+        return N.sqrt(self._sum('_binSumOfInertials' + axis) / self.sumBinHeights() - self._mean(axis)**2)
+
+    def mean(self):
+        return self._mean('X')
+
+    def rms(self):
+        return self._rms('X')
+
+    def meanX(self):
+        return self._mean('X')
+
+    def meanY(self):
+        return self._mean('Y')
+
+    def rmsX(self):
+        return self._rms('X')
+
+    def rmsY(self):
+        return self._rms('Y')
+
+
+class _CountingHistogram(_Histogram):
+    """ A histogram that counts its entries apart from the bins, which writing the bins does not update """
+    def reset(self):
+        _Histogram.reset(self)
+        self._entries = 0
+
+    def fill(self, *point):
+        _Histogram.fill(self, *point)
+        if self._index(point[0], self._edges[0]) >= 0:
+            self._entries += 1
+
+    def entries(self):
+        return self._entries
+
+
+class _Cloud(object):
+    """ An ICloud1D that keeps its entries """
+    def __init__(self):
+        self._values = []
+        self._weights = []
+
+    def fill(self, value, weight):
+        self._values.append(value)
+        self._weights.append(weight)
+
+    def entries(self):
+        return len(self._values)
+
+    def value(self, i):
+        return self._values[i]
+
+    def weight(self, i):
+        return self._weights[i]
+
+    def sumOfWeights(self):
+        return sum(self._weights)
+
+
+class _HistogramFactory(object):
+    def __init__(self, histogramClass):
+        self._histogramClass = histogramClass
+
+    def createHistogram1D(self, name, title, edges):
+        return self._histogramClass(edges)
+
+    def createHistogram2D(self, name, title, xEdges, yEdges):
+        return self._histogramClass(xEdges, yEdges)
+
+    def createCloud1D(self, name):
+        return _Cloud()
+
+
+class _TreeFactory(object):
+    def create(self, *args, **options):
+        return object()
+
+
+class _AnalysisFactory(object):
+    """ An IAnalysisFactory whose histogram factories make the given histograms, and that counts the factories it creates """
+    def __init__(self, histogramClass=_Histogram):
+        self._histogramClass = histogramClass
+        self.created = []
+
+    def createTreeFactory(self):
+        self.created.append('tree')
+        return _TreeFactory()
+
+    def _create(self, kind, tree):
+        self.created.append((kind, tree))
+        if kind == 'histogram':
+            return _HistogramFactory(self._histogramClass)
+        return object()
+
+    def createHistogramFactory(self, tree):
+        return self._create('histogram', tree)
+
+    def createTupleFactory(self, tree):
+        return self._create('tuple', tree)
+
+    def createDataPointSetFactory(self, tree):
+        return self._create('dataPointSet', tree)
+
+    def createFunctionFactory(self, tree):
+        return self._create('function', tree)
+
+    def createFitFactory(self):
+        self.created.append('fit')
+        return object()
+
+
+def stubConverter(histogramClass=_Histogram):
+    converter = paidaUtils.PAIDA()
+    converter._analysisFactory = _AnalysisFactory(histogramClass)
+    return converter
+
+
+def accessorValues(histogram, bins):
+    """ What the public accessors of a histogram give for each bin and in total """
+    dimension = len(bins[0])
+    if dimension == 1:
+        perBin, totals = ['binEntries', 'binHeight', 'binError', 'binMean'], ['mean', 'rms']
+    else:
+        perBin, totals = ['binEntries', 'binHeight', 'binError', 'binMeanX', 'binMeanY'], ['meanX', 'meanY', 'rmsX', 'rmsY']
+    totals += ['entries', 'allEntries', 'extraEntries', 'sumBinHeights']
+    values = []
+    for index in bins:
+        for name in perBin:
+            if name.startswith('binMean') and histogram.binEntries(*index) == 0:
+                continue
+            values.append(('%s%s' % (name, index), getattr(histogram, name)(*index)))
+    return values + [(name, getattr(histogram, name)()) for name in totals]
+
+
+def compareHistograms(histogram, reference, edges):
+    bins = list(itertools.product(*[range(-2, len(e) - 1) for e in edges]))
+    values = accessorValues(histogram, bins)
+    for (name, value), (referenceName, expected) in zip(values, accessorValues(reference, bins)):
+        assert name == referenceName
+        assert N.allclose(value, expected, rtol=1e-10, atol=1e-12), (name, value, expected)
+    return dict(values)
+
+
+def filledReference(factory, coordinates, weights, edges):
+    """ A histogram filled point by point """
+    if len(edges) == 1:
+        histogram = factory.createHistogram1D('reference', 'reference', list(edges[0]))
+    else:
+        histogram = factory.createHistogram2D('reference', 'reference', list(edges[0]), list(edges[1]))
+    for point in zip(*[list(values) for values in coordinates] + [list(weights)]):
+        histogram.fill(*[float(v) for v in point])
+    return histogram
+
+
+def makeHistogramData(n=2000, seed=3):
+    random = N.random.RandomState(seed)
+    data = random.normal(size=(n, 2))
+    weights = random.uniform(0.1, 2., n)
+    # points exactly on bin edges
+    data[:5, 0] = [-1., 0., 0.5, 1., 2.]
+    return data, weights
+
+
+def checkHistograms(converter):
+    """ hist1D and hist2D give the accessor values of histograms filled point by point """
+    data, weights = makeHistogramData()
+    factory = converter.histogramFactory
+    x, y = data[:, 0], data[:, 1]
+    # a number of bins spanning the data, a range and explicit edges that leave points outside
+    edges = N.linspace(-1., 2., 7)
+    cases = [(converter.hist1D(x, 20, weights=weights), [x], weights, [paidaUtils._binEdges(x, 20)]),
+             (converter.hist1D(x, 6, range=(-1., 2.)), [x], N.ones(len(x)), [edges]),
+             (converter.hist1D(x, list(edges), weights=weights), [x], weights, [edges])]
+    for histogram, coordinates, w, e in cases:
+        values = compareHistograms(histogram, filledReference(factory, coordinates, w, e), e)
+        assert values['allEntries'] == len(x)
+    # without a range the largest value is in the last bin
+    histogram = cases[0][0]
+    assert histogram.extraEntries() == 0 and histogram.binEntries(19) > 0
+    assert cases[1][0].extraEntries() > 0
+    e = [N.linspace(-1., 1., 5), paidaUtils._binEdges(y, 8)]
+    histogram = converter.hist2D(data, list(e[0]), 8, weights=weights)
+    values = compareHistograms(histogram, filledReference(factory, [x, y], weights, e), e)
+    assert values['allEntries'] == len(x) and values['extraEntries'] > 0
+
+
+def testHistograms():
+    """ Histograms that keep sums per bin only are written in one go, with the accessor values of fill() """
+    paidaUtils._bulkWrites.clear()
+    converter = stubConverter()
+    checkHistograms(converter)
+    assert paidaUtils._bulkWrites == {(_Histogram, 1): True, (_Histogram, 2): True}
+    # only the probe went through fill
+    data, weights = makeHistogramData(100000)
+    histogram = converter.hist1D(data[:, 0], 50, weights=weights)
+    assert histogram.fills == 0 and histogram.allEntries() == 100000
+    assert N.allclose(histogram.sumAllBinHeights(), weights.sum(), rtol=1e-12)
+
+
+def testHistogramsWithTotals():
+    """ Histograms that keep totals of their own are filled point by point """
+    paidaUtils._bulkWrites.clear()
+    checkHistograms(stubConverter(_CountingHistogram))
+    assert paidaUtils._bulkWrites == {(_CountingHistogram, 1): False, (_CountingHistogram, 2): False}
+    histogram = stubConverter(_CountingHistogram).hist1D(N.arange(10.), 3)
+    assert histogram.fills == 10 and histogram.entries() == 10
+
+
+def testCloud():
+    """ cloud1D keeps every entry with its weight """
+    data, weights = makeHistogramData(500)
+    cloud = stubConverter().cloud1D(data[:, 0], weights=weights)
+    assert cloud.entries() == 500
+    assert [cloud.value(i) for i in range(500)] == list(data[:, 0])
+    assert [cloud.weight(i) for i in range(500)] == list(weights)
+    cloud = stubConverter().cloud1D(data[:, :1])
+    assert cloud.entries() == 500 and cloud.sumOfWeights() == 500.
+
+
+def testPaidaHistograms():
+    """ The paida histograms and clouds give the accessor values of fill() """
+    if not havePaida:
+        raise SkipTest('paida is not importable')
+    paidaUtils._bulkWrites.clear()
+    converter = paidaUtils.PAIDA()
+    checkHistograms(converter)
+    data, weights = makeHistogramData(500)
+    cloud = converter.cloud1D(data[:, 0], weights=weights)
+    reference = converter.histogramFactory.createCloud1D('reference')
+    for x, w in zip(data[:, 0], weights):
+        reference.fill(float(x), float(w))
+    for name in ['entries', 'sumOfWeights', 'mean', 'rms', 'lowerEdge', 'upperEdge']:
+        assert N.allclose(getattr(cloud, name)(), getattr(reference, name)(), rtol=1e-12), name
+
+
+class _PaidaModule(object):
+    """ What paidaUtils uses of the paida module, with the analysis factories it created """
+    def __init__(self):
+        self.PTypes = PTypes
+        self.analysisFactories = []
+        factories = self.analysisFactories
+        class IAnalysisFactory(object):
+            @staticmethod
+            def create():
+                factories.append(_AnalysisFactory())
+                return factories[-1]
+        self.IAnalysisFactory = IAnalysisFactory
+
+
+def runWithStubPaida(test):
+    """ Runs test(module, imports) with _importPaida replaced by a stub that records its calls in imports """
+    module = _PaidaModule()
+    imports = []
+    def importPaida():
+        imports.append(module)
+        return module
+    original = paidaUtils._importPaida
+    paidaUtils._importPaida = importPaida
+    paidaUtils._typeMapCache.clear()
+    try:
+        test(module, imports)
+    finally:
+        paidaUtils._importPaida = original
+        paidaUtils._typeMapCache.clear()
+
+
+def testTypeMaps():
+    """ The type maps are built once, on first use, and are plain dicts """
+    def test(module, imports):
+        assert imports == []
+        numpy2paida = paidaUtils._numpyTypes2PaidaTypes()
+        assert type(numpy2paida) is dict and len(dict(numpy2paida)) == 5
+        assert numpy2paida[N.float64] == PTypes.Double and numpy2paida[N.int8] == PTypes.Byte
+        paida2numpy = paidaUtils._paidaTypes2numpyTypes()
+        assert dict(paida2numpy) == dict((v, k) for k, v in numpy2paida.items())
+        getters = {}
+        getters.update(paidaUtils._paidaTypeGetters())
+        assert getters[PTypes.Float] == 'getFloat' and PTypes.String not in getters
+        assert paidaUtils._numpyTypes2PaidaTypes() is numpy2paida
+        assert len(imports) == 1
+    runWithStubPaida(test)
+
+
+def testLazyFactories():
+    """ The factories of PAIDA are created when they are first used, and only once """
+    def test(module, imports):
+        converter = paidaUtils.PAIDA()
+        assert imports == [] and module.analysisFactories == []
+        af = converter.af
+        assert module.analysisFactories == [af] and af.created == []
+        assert converter.af is af and len(module.analysisFactories) == 1
+        treeFactory = converter.treeFactory
+        assert converter.treeFactory is treeFactory and af.created == ['tree']
+        tree = converter.tree
+        assert converter.tree is tree
+        fitFactory = converter.fitFactory
+        assert converter.fitFactory is fitFactory and af.created == ['tree', 'fit']
+        # another converter has factories of its own
+        assert paidaUtils.PAIDA().af is not af
+    runWithStubPaida(test)
+
+
+def testGetFactory():
+    """ The factories that belong to a tree are created once for each tree and kind """
+    def test(module, imports):
+        converter = paidaUtils.PAIDA()
+        tree = converter.tree
+        af = converter.af
+        for kind in ['histogram', 'tuple', 'dataPointSet', 'function']:
+            factory = converter.getFactory(kind)
+            assert getattr(converter, kind + 'Factory') is factory
+            assert converter.getFactory(kind, tree) is factory
+        assert af.created[1:] == [(kind, tree) for kind in ['histogram', 'tuple', 'dataPointSet', 'function']]
+        other = converter.treeFactory.create('other.aida')
+        histogramFactory = converter.getFactory('histogram', other)
+        assert histogramFactory is not converter.histogramFactory
+        assert converter.getFactory('histogram', other) is histogramFactory
+        assert af.created[-1] == ('histogram', other) and len(af.created) == 6
+        try:
+            converter.getFactory('cloud')
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError('an unknown kind of factory must raise AttributeError')
+    runWithStubPaida(test)
+
+
+def testImportDoesNotImportPaida():
+    """ Importing PaidaUtils and its modules leaves paida alone, _importPaida imports it with the batch engine """
+    directory = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(directory, 'paida', 'paida_gui'))
+        for package in [['paida'], ['paida', 'paida_gui']]:
+            open(os.path.join(*[directory] + package + ['__init__.py']), 'w').close()
+        open(os.path.join(directory, 'paida', 'paida_gui', 'PGuiSelector.py'), 'w').write(
+            'engine = None\ndef setGuiEngineName(name):\n    global engine\n    engine = name\n')
+        script = '; '.join([
+            'import sys',
+            'from PaidaUtils import paidaUtils, mergeTuples, columnCache',
+            'paidaUtils.paida.hist1D',
+            'assert not [name for name in sys.modules if name.startswith("paida")], sys.modules.keys()',
+            'module = paidaUtils._importPaida()',
+            'assert sys.modules["paida.paida_gui.PGuiSelector"].engine == "batch"',
+            'assert paidaUtils._importPaida() is module'])
+        source = os.path.join(os.path.dirname(os.path.abspath(paidaUtils.__file__)), os.pardir)
+        environment = dict(os.environ, PYTHONPATH=os.pathsep.join([directory, source]))
+        process = subprocess.Popen([sys.executable, '-c', script], env=environment, stderr=subprocess.PIPE)
+        error = process.communicate()[1]
+        assert process.returncode == 0, error
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    testColumns()
+    testFilter()
+    testStructured()
+    testChunkBoundaries()
+    testBadColumns()
+    testIterChunkSizes()
+    testIterLastChunk()
+    testIterChunksFilter()
+    testHistograms()
+    testHistogramsWithTotals()
+    testCloud()
+    testPaidaHistograms()
+    testTypeMaps()
+    testLazyFactories()
+    testGetFactory()
+    testImportDoesNotImportPaida()
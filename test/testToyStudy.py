@@ -0,0 +1,109 @@
+from unittest import SkipTest
+try:
+    from Fitting.toyStudy import ToyStudy
+    from testFitter import IFitter, _FitData, makeHistogram, makeFunction, fit
+except ImportError:
+    raise SkipTest('the fitter needs paida')
+import numpy as N
+
+
+class _Result(object):
+    """ The part of an IFitResult that a toy study reads, for a model that was not fitted """
+    def __init__(self, function):
+        self._function = function
+
+    def fittedFunction(self):
+        return self._function
+
+    def fittedParameters(self):
+        return self._function.parameters()
+
+
+def makeUnbinned(seed=0, n=2000):
+    """ Entries of a unit gaussian on [-3, 3] """
+    x = N.random.RandomState(seed).normal(size=3 * n)
+    return _FitData(x[N.abs(x) <= 3.][:n])
+
+
+def unbinnedStudy(n=2000, seed=0):
+    fitter = IFitter('UnbinnedMaximumLikelihood', 'SimplePAIDA')
+    return ToyStudy(fitter, makeUnbinned(n=n), _Result(makeFunction('G', [1., 0., 1.])), seed)
+
+
+def binnedStudy(seed=0):
+    data = makeHistogram()
+    result = fit('BinnedMaximumLikelihood', 'SimplePAIDA', data, 'G+P0', [40., 0., 1., 3.])
+    assert result.fitStatus() == 0
+    return ToyStudy(IFitter('BinnedMaximumLikelihood', 'SimplePAIDA'), data, result, seed)
+
+
+def testReproducible():
+    """ Each toy depends on the seed and its index only, not on the toys drawn before """
+    for study in [binnedStudy(), unbinnedStudy()]:
+        toys = [study.generate(i)._connection for i in range(3)]
+        assert study.generate(2)._connection == toys[2]
+        assert study.generate(0)._connection == toys[0]
+        assert toys[0] != toys[1]
+        other = study.__class__(study._fitter, study._fitData, _Result(study._function), study._seed + 1)
+        assert other.generate(0)._connection != toys[0]
+    assert len(toys[0][0]) == 2000
+
+
+def testEnvelope():
+    """ A model above the envelope does not cut the toys: they are drawn again, the same way each time """
+    study = unbinnedStudy(20000)
+    study._envelope = 0.3
+    x = N.array(study.generate(0)._connection[0])[:, 0]
+    assert study._envelope == 0.3
+    assert x.min() >= -3. and x.max() <= 3.
+    # a unit gaussian truncated at 3 sigma; the entries of a cut model would spread out much more
+    assert abs(x.std() - 0.9865) < 0.02
+    assert abs(x.mean()) < 0.02
+    assert study.generate(0)._connection[0] == x[:, None].tolist()
+
+
+def testSerialParallel():
+    """ The toys of a pool of processes give the same arrays as the toys run one after the other """
+    study = binnedStudy()
+    serial = study.run(12, processes=1)
+    arrays = [serial.values, serial.errors, serial.minimum, serial.status, serial.pulls]
+    parallel = study.run(12, processes=3)
+    for array, other in zip(arrays, [parallel.values, parallel.errors, parallel.minimum, parallel.status, parallel.pulls]):
+        assert array is not other
+        N.testing.assert_array_equal(array, other)
+    assert N.all(serial.status == 0)
+    assert N.all(N.isfinite(serial.minimum))
+    N.testing.assert_array_equal(serial.residuals, serial.values - serial.parameters)
+
+
+def testPulls():
+    """ The pulls of a likelihood fit of its own toys are distributed like a unit gaussian """
+    study = binnedStudy(1)
+    nToys = 200
+    study.run(nToys)
+    ok = study.status == 0
+    assert ok.sum() >= 0.95 * nToys
+    pulls = study.pulls[ok]
+    assert N.all(N.abs(pulls.mean(axis=0)) < 4. / N.sqrt(ok.sum()))
+    assert N.all(N.abs(pulls.std(axis=0) - 1.) < 0.15)
+
+
+def testMinimumWithoutDegreesOfFreedom():
+    """ A fit with as many points as parameters has no quality, but keeps the value of the minimum """
+    x = N.array([-1., 0., 1.])
+    counts = [5., 9., 5.]
+    errors = [2., 3., 2.]
+    result = fit('Chi2', 'SimplePAIDA', _FitData(x, counts, errors, errors), 'P2', [1., 0., 0.])
+    assert result.fitStatus() == 0
+    assert result.ndf() == 0
+    assert N.isnan(result.quality())
+    assert 0. <= result._minimum < 1e-8
+    assert N.allclose(result.fittedParameters(), [9., 0., -4.], atol=1e-4)
+
+
+if __name__ == '__main__':
+    testReproducible()
+    testEnvelope()
+    testSerialParallel()
+    testPulls()
+    testMinimumWithoutDegreesOfFreedom()
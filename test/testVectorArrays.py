@@ -0,0 +1,96 @@
+from Geometry.geometry import Momentum, MomentumArray, LorentzVectorArray, ThreeVectorArray, FrameArray
+from Geometry.geometry import makeBoostMatrix, makeBoostMatrices
+import numpy as N
+
+def makeMomenta(n):
+    p = N.random.uniform(-2., 2., (n, 3))
+    mass = N.random.uniform(0.1, 5., n)
+    return N.column_stack([N.sqrt(mass**2 + (p**2).sum(axis=1)), p]), mass
+
+
+def testZeroCopy():
+    data, mass = makeMomenta(10)
+    momenta = MomentumArray(data)
+    assert momenta.asarray() is data
+    momenta.px = 0.
+    assert (data[:, 1] == 0.).all()
+    assert N.may_share_memory(momenta.v3().asarray(), data)
+    copied = MomentumArray(data, copy=True)
+    assert not N.may_share_memory(copied.asarray(), data)
+
+
+def testArithmetic():
+    """ The columnar types must agree with the scalar ones
+    """
+    a, massA = makeMomenta(100)
+    b, massB = makeMomenta(100)
+    ma = MomentumArray(a)
+    mb = MomentumArray(b)
+    assert N.allclose(ma.mass, massA)
+    theSum = ma + mb
+    theDifference = ma - mb
+    assert isinstance(theSum, MomentumArray)
+    for i in range(len(ma)):
+        p = Momentum(a[i]) + Momentum(b[i])
+        assert abs(theSum.mass[i] - p.mass) < 1e-9
+        assert abs(theDifference.e[i] - (a[i, 0] - b[i, 0])) < 1e-12
+    assert N.allclose(ma.v3().mag(), N.sqrt((a[:, 1:]**2).sum(axis=1)))
+    assert isinstance(ma[3], Momentum)
+    assert isinstance(ma[3:7], MomentumArray)
+    assert len(ma[3:7]) == 4
+
+
+def testShape():
+    try:
+        LorentzVectorArray(N.zeros((5, 3)))
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('an (N, 3) array is not a valid LorentzVectorArray')
+    assert len(ThreeVectorArray(N.zeros((5, 3)))) == 5
+
+
+def testBatchedBoost():
+    """ One frame for all rows, and one frame per row, must both agree with Frame.coordinatesOf
+    """
+    parents, parentMass = makeMomenta(20)
+    daughters, daughterMass = makeMomenta(20)
+    frame = Momentum(parents[0]).restFrame
+    boosted = frame.coordinatesOfArray(MomentumArray(daughters))
+    assert isinstance(boosted, MomentumArray)
+    assert N.allclose(frame.boostToArray(daughters), boosted.asarray())
+    frames = FrameArray([makeBoostMatrix(*(-p[1:] / p[0])) for p in parents])
+    assert len(frames) == 20
+    boostedRows = frames.coordinatesOf(daughters)
+    for i in range(len(parents)):
+        single = Momentum(parents[i]).restFrame.coordinatesOf(Momentum(daughters[i]))
+        assert N.allclose(boosted[i]._coordinates.A1, frame.coordinatesOf(Momentum(daughters[i]))._coordinates.A1)
+        assert N.allclose(boostedRows[i], single._coordinates.A1)
+    assert N.allclose(frames.makeLorentzVectors(boostedRows), daughters)
+    # each parent is at rest in its own frame
+    atRest = frames.coordinatesOf(parents)
+    assert N.allclose(atRest[:, 1:], 0.)
+    assert N.allclose(atRest[:, 0], parentMass)
+
+
+def testRestFrames():
+    momenta, mass = makeMomenta(50)
+    # a particle at rest needs the zero-boost matrix
+    momenta[0] = mass[0], 0., 0., 0.
+    betas = momenta[:, 1:] / momenta[:, :1]
+    boosts = makeBoostMatrices(betas)
+    for i in range(len(momenta)):
+        assert N.allclose(boosts[i], makeBoostMatrix(*betas[i]))
+    frames = MomentumArray(momenta).restFrame
+    assert N.allclose(N.einsum('nij,njk->nik', frames._matrices, frames._inverse_matrices), N.eye(4))
+    atRest = frames.coordinatesOf(momenta)
+    assert N.allclose(atRest[:, 1:], 0.)
+    assert N.allclose(atRest[:, 0], mass)
+
+
+if __name__ == '__main__':
+    testZeroCopy()
+    testArithmetic()
+    testShape()
+    testBatchedBoost()
+    testRestFrames()